@@ -0,0 +1,175 @@
+import argparse
+import io
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+CITIES = [
+    ("London", "EC1A 1BB", "United Kingdom", "GBP"),
+    ("Manchester", "M1 1AE", "United Kingdom", "GBP"),
+    ("Swindon", "SN4 9QP", "United Kingdom", "GBP"),
+    ("Paris", "75001", "France", "EUR"),
+    ("Berlin", "10115", "Germany", "EUR"),
+    ("Madrid", "28001", "Spain", "EUR"),
+    ("New York", "10001", "United States", "USD"),
+    ("Chicago", "60601", "United States", "USD"),
+]
+
+PRODUCT_TYPES = ["Keyboard", "Guitar", "Drums", "Amplifier", "Microphone", "Accessories"]
+
+PAYMENT_TYPES = ["Debit", "Credit", "PayPal", "Bank Transfer"]
+
+STREETS = ["High Street", "Station Road", "Academy Street", "Church Lane", "Park Avenue"]
+
+# rows generated and written at a time, so memory stays bounded at any row count
+BLOCK_ROWS = 1_000_000
+
+
+class GeneratorConfig(NamedTuple):
+    """The shape of a synthetic order file.
+
+    Args:
+        rows: The number of data lines, including duplicates and bad lines.
+        clients: The number of distinct clients.
+        products: The number of distinct products.
+        payments: The number of distinct payment billing codes. Defaults to one
+            per order.
+        duplicate_ratio: The share of lines that repeat an earlier order exactly.
+        bad_line_ratio: The share of lines with an extra field, which
+            `extract_file` skips.
+        seed: The random seed; the same config always produces the same file.
+        first_order: The number of the first order, so the files of one input
+            set can be given disjoint order numbers.
+    """
+
+    rows: int
+    clients: int = 1_000
+    products: int = 200
+    payments: int = 0
+    duplicate_ratio: float = 0.0
+    bad_line_ratio: float = 0.0
+    seed: int = 0
+    first_order: int = 0
+
+
+def _order_block(config: GeneratorConfig, start: int, size: int, rng: np.random.Generator) -> pd.DataFrame:
+    order_ids = np.arange(config.first_order + start, config.first_order + start + size)
+
+    # repeat an earlier order of the same block for the duplicate lines
+    duplicates = rng.random(size) < config.duplicate_ratio
+    duplicates[0] = False
+    earlier = (rng.random(size) * np.arange(size)).astype(np.int64)
+    order_ids[duplicates] = order_ids[earlier[duplicates]]
+
+    # every attribute is a function of the order id, so duplicates repeat exactly
+    client = (order_ids * 2654435761 + config.seed) % config.clients
+    product = (order_ids * 40503 + 7 * config.seed) % config.products
+    payment = order_ids if config.payments <= 0 else (order_ids * 97 + config.seed) % config.payments
+    quantity = 1 + (order_ids * 31 + config.seed) % 5
+    unit_price = 50 + (product * 37) % 4950
+    days = (payment * 13) % 1461
+
+    city = client % len(CITIES)
+    cities = np.array([c[0] for c in CITIES], dtype=object)
+    postcodes = np.array([c[1] for c in CITIES], dtype=object)
+    countries = np.array([c[2] for c in CITIES], dtype=object)
+    currencies = np.array([c[3] for c in CITIES], dtype=object)
+    # format each of the 1461 possible dates once and take the strings by index
+    calendar = pd.Timestamp("2020-01-01") + pd.to_timedelta(np.arange(1461), unit="D")
+    billing_dates = np.asarray(calendar.strftime("%Y%m%d"), dtype=object)[days]
+    payment_dates = np.asarray(calendar.strftime("%d/%m/%Y"), dtype=object)[days]
+
+    client_str = pd.Series(client).astype(str)
+    order_str = pd.Series(order_ids).astype(str).str.zfill(7)
+    payment_str = pd.Series(payment).astype(str).str.zfill(7)
+    return pd.DataFrame(
+        {
+            "OrderNumber": "PO" + order_str + "-1",
+            "ClientName": "Client " + client_str,
+            "ProductName": "Product " + pd.Series(product).astype(str),
+            "ProductType": np.array(PRODUCT_TYPES, dtype=object)[product % len(PRODUCT_TYPES)],
+            "UnitPrice": unit_price,
+            "ProductQuantity": quantity,
+            "TotalPrice": unit_price * quantity,
+            "Currency": currencies[city],
+            "DeliveryAddress": pd.Series(client % 200 + 1).astype(str)
+            + " "
+            + np.array(STREETS, dtype=object)[client % len(STREETS)],
+            "DeliveryCity": cities[city],
+            "DeliveryPostcode": postcodes[city],
+            "DeliveryCountry": countries[city],
+            "DeliveryContactNumber": "44 7911 " + client_str.str.zfill(6),
+            "PaymentType": np.array(PAYMENT_TYPES, dtype=object)[payment % len(PAYMENT_TYPES)],
+            "PaymentBillingCode": "PO" + payment_str + "-" + billing_dates,
+            "PaymentDate": payment_dates,
+        }
+    )
+
+
+def generate_orders(path: Path, config: GeneratorConfig) -> int:
+    """Write a synthetic order CSV matching the schema read by `extract_file`.
+
+    The file is generated and written in blocks of BLOCK_ROWS rows with vectorized
+    numpy operations, so anything from thousands to tens of millions of rows can
+    be generated in bounded memory. Duplicate lines repeat an earlier order of the
+    same block, and bad lines carry one field too many.
+
+    Args:
+        path: The path of the CSV file to write.
+        config: The shape of the file.
+
+    Returns:
+        The number of distinct orders on lines that are not bad lines, i.e. the
+        number of fact rows a load of the file should produce.
+    """
+    rng = np.random.default_rng(config.seed)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    valid_rows = 0
+    with open(path, "w", newline="") as f:
+        for start in range(0, config.rows, BLOCK_ROWS):
+            size = min(BLOCK_ROWS, config.rows - start)
+            block = _order_block(config, start, size, rng)
+            buffer = io.StringIO()
+            block.to_csv(buffer, index=False, header=start == 0, lineterminator="\n")
+            lines = buffer.getvalue().split("\n")
+
+            header_lines = 1 if start == 0 else 0
+            bad = np.flatnonzero(rng.random(size) < config.bad_line_ratio)
+            for i in bad:
+                lines[header_lines + i] += ",unexpected"
+            f.write("\n".join(lines))
+
+            valid = np.ones(size, dtype=bool)
+            valid[bad] = False
+            valid_rows += block.loc[valid, "OrderNumber"].nunique()
+    return valid_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic order CSV file")
+    parser.add_argument("path", help="the CSV file to write")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--clients", type=int, default=1_000)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--payments", type=int, default=0, help="distinct billing codes, 0 for one per order")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0)
+    parser.add_argument("--bad-line-ratio", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--first-order", type=int, default=0)
+    args = parser.parse_args()
+    generate_orders(
+        args.path,
+        GeneratorConfig(
+            rows=args.rows,
+            clients=args.clients,
+            products=args.products,
+            payments=args.payments,
+            duplicate_ratio=args.duplicate_ratio,
+            bad_line_ratio=args.bad_line_ratio,
+            seed=args.seed,
+            first_order=args.first_order,
+        ),
+    )
@@ -0,0 +1,185 @@
+import argparse
+import json
+import logging
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks.generate_orders import GeneratorConfig, generate_orders
+from src.lib.metrics import MetricsCollector
+from src.lib.migrations import apply_migrations
+from src.lib.pipeline import run_chunked_pipeline, run_pipeline, run_pipelined
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+MIGRATIONS_DIR = REPO_ROOT / "model" / "migrations"
+RESULTS_DIR = REPO_ROOT / "benchmarks" / "results"
+BASELINE_PATH = REPO_ROOT / "benchmarks" / "baseline.json"
+
+# the pipeline entry points benchmarked on every size, each on a fresh database
+SCENARIOS = {
+    "pipeline": lambda database, files: run_pipeline(database, files),
+    "pipeline_star": lambda database, files: run_pipeline(database, files, fact_keys="star"),
+    "chunked": lambda database, files: run_chunked_pipeline(database, files, chunksize=100_000),
+    "pipelined": lambda database, files: run_pipelined(database, files, fact_keys="star"),
+}
+
+# timings shorter than this are too noisy to be flagged as regressions
+MIN_SECONDS = 0.05
+
+
+def generate_input(workdir: Path, rows: int, files: int, seed: int, **shape) -> List[Path]:
+    """Generate `rows` synthetic order rows split over `files` CSV files."""
+    paths = []
+    rows_per_file = rows // files
+    for i in range(files):
+        path = workdir / "input" / f"orders_{i:03d}.csv"
+        config = GeneratorConfig(
+            rows=rows_per_file, seed=seed + i, first_order=i * rows_per_file, **shape
+        )
+        generate_orders(path, config)
+        paths.append(path)
+    return paths
+
+
+def benchmark_scenario(name: str, files: List[Path], workdir: Path) -> dict:
+    """Run one scenario on a fresh database and return its timings per stage."""
+    workdir.mkdir(parents=True, exist_ok=True)
+    database = str(workdir / f"{name}.db")
+    apply_migrations(database, str(MIGRATIONS_DIR))
+    start = time.perf_counter()
+    with MetricsCollector() as collector:
+        loaded_rows = SCENARIOS[name](database, files)
+    return {
+        "wall_seconds": time.perf_counter() - start,
+        "loaded_rows": loaded_rows,
+        "stages": {
+            stage: summary["wall_seconds"]
+            for stage, summary in collector.summary().items()
+        },
+    }
+
+
+def benchmark_main(files: List[Path], workdir: Path) -> dict:
+    """Run src/main.py end to end in a scratch copy of the project layout."""
+    project = workdir / "project"
+    shutil.copytree(REPO_ROOT / "model", project / "model")
+    for folder in ["data/unprocessed", "data/processed", "output"]:
+        (project / folder).mkdir(parents=True)
+    for f in files:
+        shutil.copy(f, project / "data" / "unprocessed" / f.name)
+
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, str(REPO_ROOT / "src" / "main.py"), "run", "--root", str(project)],
+        cwd=project,
+        capture_output=True,
+        text=True,
+    )
+    result = {"wall_seconds": time.perf_counter() - start}
+    if completed.returncode != 0:
+        result["error"] = completed.stderr.strip().splitlines()[-1:] or ["failed"]
+    return result
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """List the timings that are more than `threshold` slower than the baseline.
+
+    Both dicts map benchmark names to results as returned by `benchmark_scenario`;
+    the total and the per-stage wall times are compared.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline or "error" in result or "error" in baseline[name]:
+            continue
+        timings = {"total": (result["wall_seconds"], baseline[name]["wall_seconds"])}
+        for stage, seconds in result.get("stages", {}).items():
+            if stage in baseline[name].get("stages", {}):
+                timings[stage] = (seconds, baseline[name]["stages"][stage])
+        for timing, (seconds, baseline_seconds) in timings.items():
+            if seconds > baseline_seconds * (1 + threshold) and seconds - baseline_seconds > MIN_SECONDS:
+                regressions.append(
+                    f"{name} {timing}: {seconds:.3f}s vs {baseline_seconds:.3f}s baseline "
+                    f"(+{(seconds / baseline_seconds - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def run_benchmarks(
+    sizes: List[int], files: int, seed: int, include_main: bool, shape: Dict, repeat: int = 3
+) -> dict:
+    """Generate the input for each size and run every scenario on it.
+
+    Each scenario is run `repeat` times and its fastest run is kept, which
+    filters out most of the noise of a shared machine.
+    """
+    results = {}
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            workdir = Path(tmp)
+            start = time.perf_counter()
+            inputs = generate_input(workdir, rows, files, seed, **shape)
+            logging.info(f"Generated {rows} rows in {time.perf_counter() - start:.1f}s")
+            for name in SCENARIOS:
+                runs = [benchmark_scenario(name, inputs, workdir / f"run{i}") for i in range(repeat)]
+                results[f"{rows}/{name}"] = min(runs, key=lambda run: run["wall_seconds"])
+                logging.info(f"{rows}/{name}: {results[f'{rows}/{name}']['wall_seconds']:.2f}s")
+            if include_main:
+                results[f"{rows}/main"] = benchmark_main(inputs, workdir)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ETL pipeline on synthetic order data")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000], help="input sizes to benchmark")
+    parser.add_argument("--files", type=int, default=4, help="number of files each input is split into")
+    parser.add_argument("--clients", type=int, default=1_000)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--payments", type=int, default=0, help="distinct billing codes, 0 for one per order")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.05)
+    parser.add_argument("--bad-line-ratio", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario, the fastest is kept")
+    parser.add_argument("--main", action="store_true", help="also time a full src/main.py run")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH), help="baseline results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown ratio flagged as a regression")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    shape = dict(
+        clients=args.clients,
+        products=args.products,
+        payments=args.payments,
+        duplicate_ratio=args.duplicate_ratio,
+        bad_line_ratio=args.bad_line_ratio,
+    )
+    results = run_benchmarks(args.rows, args.files, args.seed, args.main, shape, repeat=args.repeat)
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor()},
+        "config": dict(shape, files=args.files, seed=args.seed),
+        "results": results,
+    }
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    results_path = RESULTS_DIR / f"{datetime.now():%Y%m%d_%H%M%S}.json"
+    results_path.write_text(json.dumps(report, indent=2))
+    logging.info(f"Results saved to {results_path}")
+
+    exit_code = 0
+    baseline_path = Path(args.baseline)
+    if baseline_path.exists() and not args.update_baseline:
+        regressions = compare(results, json.loads(baseline_path.read_text())["results"], args.threshold)
+        for regression in regressions:
+            logging.warning(f"Regression: {regression}")
+        exit_code = 1 if regressions else 0
+    if args.update_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2))
+        logging.info(f"Baseline saved to {baseline_path}")
+    sys.exit(exit_code)
@@ -0,0 +1,5 @@
+-- Secondary indexes on the fact_orders foreign keys. They are built after the
+-- bulk load rather than by a migration, so a full load never maintains them row by row.
+CREATE INDEX IF NOT EXISTS idx_fact_orders_client_key ON fact_orders (client_key);
+CREATE INDEX IF NOT EXISTS idx_fact_orders_product_key ON fact_orders (product_key);
+CREATE INDEX IF NOT EXISTS idx_fact_orders_payment_key ON fact_orders (payment_key);
@@ -0,0 +1,16 @@
+DROP TABLE IF EXISTS dim_clients;
+DROP TABLE IF EXISTS dim_products;
+DROP TABLE IF EXISTS dim_payment;
+DROP TABLE IF EXISTS fact_orders;
+DROP TABLE IF EXISTS dim_clients_history;
+DROP TABLE IF EXISTS file_manifest;
+DROP TABLE IF EXISTS row_fingerprints;
+DROP TABLE IF EXISTS row_fingerprint_state;
+DROP TABLE IF EXISTS agg_daily_revenue;
+DROP TABLE IF EXISTS agg_monthly_revenue_by_country;
+DROP TABLE IF EXISTS run_journal;
+DROP TABLE IF EXISTS load_runs;
+DROP TABLE IF EXISTS file_leases;
+DROP TABLE IF EXISTS fact_order_shards;
+DROP TABLE IF EXISTS shard_loads;
+DROP TABLE IF EXISTS schema_migrations;
@@ -1,9 +1,3 @@
-DROP TABLE IF EXISTS dim_clients;
-DROP TABLE IF EXISTS dim_products;
-DROP TABLE IF EXISTS dim_payment;
-DROP TABLE IF EXISTS fact_orders;
-DROP TABLE IF EXISTS dim_clients_history;
-
 CREATE TABLE IF NOT EXISTS dim_clients (
   client_key INTEGER NOT NULL PRIMARY KEY,
   client_name VARCHAR(255) NOT NULL UNIQUE,
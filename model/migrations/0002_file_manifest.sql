@@ -0,0 +1,12 @@
+-- One row per ingested source file, keyed by the hash of its content
+CREATE TABLE IF NOT EXISTS file_manifest (
+  content_hash CHAR(64) NOT NULL PRIMARY KEY,
+  file_name VARCHAR(255) NOT NULL,
+  file_size INTEGER NOT NULL,
+  file_mtime REAL NOT NULL,
+  row_count INTEGER,
+  status VARCHAR(20) NOT NULL,
+  processed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_file_manifest_file ON file_manifest (file_name, file_size, file_mtime);
@@ -0,0 +1,14 @@
+-- Fingerprints of every business row loaded so far, used to drop rows re-sent in later runs.
+-- The fingerprint is the rowid, so the index is a single compact B-tree.
+CREATE TABLE IF NOT EXISTS row_fingerprints (
+  fingerprint INTEGER NOT NULL PRIMARY KEY
+);
+
+-- Bumped whenever fingerprints are added, so a stale on-disk bloom filter can be detected
+CREATE TABLE IF NOT EXISTS row_fingerprint_state (
+  id INTEGER NOT NULL PRIMARY KEY CHECK (id = 1),
+  generation INTEGER NOT NULL,
+  row_count INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO row_fingerprint_state (id, generation, row_count) VALUES (1, 0, 0);
@@ -0,0 +1,25 @@
+-- Summary tables for the reporting queries, maintained by lib/aggregates.py.
+-- Each load recomputes only the days and months its facts fall on.
+CREATE TABLE IF NOT EXISTS agg_daily_revenue (
+  sale_date DATE NOT NULL,
+  product_type VARCHAR(255) NOT NULL,
+  currency VARCHAR(255) NOT NULL,
+  order_count INTEGER NOT NULL,
+  units INTEGER NOT NULL,
+  revenue DECIMAL(14, 2) NOT NULL,
+  PRIMARY KEY (sale_date, product_type, currency)
+);
+
+CREATE TABLE IF NOT EXISTS agg_monthly_revenue_by_country (
+  sale_month CHAR(7) NOT NULL,
+  delivery_country VARCHAR(255) NOT NULL,
+  currency VARCHAR(255) NOT NULL,
+  order_count INTEGER NOT NULL,
+  units INTEGER NOT NULL,
+  revenue DECIMAL(14, 2) NOT NULL,
+  PRIMARY KEY (sale_month, delivery_country, currency)
+);
+
+-- Finds the payments of the days being recomputed without scanning dim_payment.
+-- With the currency and the implicit payment_key it covers the refresh queries.
+CREATE INDEX IF NOT EXISTS idx_dim_payment_date ON dim_payment (payment_date, currency);
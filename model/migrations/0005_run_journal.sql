@@ -0,0 +1,21 @@
+-- One row per checkpointed load run; runs not "completed" can be resumed
+CREATE TABLE IF NOT EXISTS load_runs (
+  run_id INTEGER NOT NULL PRIMARY KEY,
+  status VARCHAR(20) NOT NULL,
+  chunksize INTEGER NOT NULL,
+  started_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  finished_at DATETIME
+);
+
+-- The chunks and files a run has committed, each written in the transaction of its data.
+-- Files are keyed by the hash of their content, so a modified file is never resumed.
+CREATE TABLE IF NOT EXISTS run_journal (
+  run_id INTEGER NOT NULL REFERENCES load_runs (run_id),
+  content_hash CHAR(64) NOT NULL,
+  stage VARCHAR(20) NOT NULL,
+  chunk_number INTEGER NOT NULL,
+  file_name VARCHAR(255) NOT NULL,
+  row_count INTEGER NOT NULL,
+  committed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (run_id, content_hash, stage, chunk_number)
+);
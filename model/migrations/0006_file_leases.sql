@@ -0,0 +1,12 @@
+-- The files claimed by the workers of the shared inbox, see src/lib/workqueue.py.
+-- A lease whose expires_at (unix time) has passed belongs to a worker that stopped
+-- heartbeating, and its file is put back into the inbox.
+CREATE TABLE IF NOT EXISTS file_leases (
+  worker_id VARCHAR(255) NOT NULL,
+  file_name VARCHAR(255) NOT NULL,
+  claimed_at REAL NOT NULL,
+  expires_at REAL NOT NULL,
+  PRIMARY KEY (worker_id, file_name)
+);
+
+CREATE INDEX IF NOT EXISTS idx_file_leases_expires_at ON file_leases (expires_at);
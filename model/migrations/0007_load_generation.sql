@@ -0,0 +1,10 @@
+-- Bumped by every load transaction, so readers such as the query service's result cache
+-- can tell whether the warehouse changed since they last looked.
+-- Not in drop_tables.sql: a rebuilt warehouse must not restart at a generation readers have seen.
+CREATE TABLE IF NOT EXISTS load_generation (
+  id INTEGER NOT NULL PRIMARY KEY CHECK (id = 1),
+  generation INTEGER NOT NULL,
+  loaded_at DATETIME
+);
+
+INSERT OR IGNORE INTO load_generation (id, generation, loaded_at) VALUES (1, 0, NULL);
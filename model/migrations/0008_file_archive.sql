@@ -0,0 +1,16 @@
+-- One row per processed file kept in the compressed archive, keyed by the hash of its content.
+-- The PaymentDate range of each file lets a replay pick the files of a date range.
+-- Not in drop_tables.sql: the archive outlives the warehouse it is used to rebuild.
+CREATE TABLE IF NOT EXISTS file_archive (
+  content_hash CHAR(64) NOT NULL PRIMARY KEY,
+  file_name VARCHAR(255) NOT NULL,
+  archive_path VARCHAR(1024) NOT NULL,
+  first_payment_date DATE,
+  last_payment_date DATE,
+  row_count INTEGER,
+  file_size INTEGER NOT NULL,
+  archived_size INTEGER NOT NULL,
+  archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_file_archive_dates ON file_archive (first_payment_date, last_payment_date);
@@ -0,0 +1,15 @@
+-- The shard of each order loaded into the fact shards, see src/lib/partitions.py.
+-- Orders are only unique within a shard file, so this is how a re-sent order with a
+-- payment date in another period is found and kept in a single shard.
+CREATE TABLE IF NOT EXISTS fact_order_shards (
+  order_number VARCHAR(255) NOT NULL PRIMARY KEY,
+  shard_key VARCHAR(32) NOT NULL
+);
+
+-- The shard loads whose core transaction committed. The shards are committed just
+-- before the core database, so a shard load missing here when it is recovered was
+-- never committed as a whole and is undone.
+CREATE TABLE IF NOT EXISTS shard_loads (
+  load_token CHAR(32) NOT NULL PRIMARY KEY,
+  committed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
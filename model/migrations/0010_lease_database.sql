@@ -0,0 +1,4 @@
+-- The worker leases moved to their own database in the work folder, see src/lib/workqueue.py,
+-- so renewing a lease no longer waits for the write lock of a load. Files claimed before
+-- the upgrade have no lease there, and are given one by the next worker's reclaim_expired.
+DROP TABLE IF EXISTS file_leases;
@@ -0,0 +1,191 @@
+import logging
+import sqlite3
+from typing import Iterable, Optional, Set
+
+from .db_helper import bump_load_generation, connection_for
+from .metrics import instrument
+
+# the summary tables maintained from fact_orders, see model/migrations/0004_reporting_aggregates.sql
+AGGREGATE_TABLES = ("agg_daily_revenue", "agg_monthly_revenue_by_country")
+
+# refreshing more than this share of the days already aggregated is done with a
+# full rebuild, whose sequential scan beats that many index lookups
+REBUILD_DAY_SHARE = 0.5
+
+# CROSS JOIN fixes the join order: periods, then their payments through the
+# payment_date index, then their facts through the payment_key index (or an
+# automatic index if the deferred indexes are not built yet). Without it the
+# planner may scan fact_orders once per period on a freshly loaded warehouse
+# whose tables have no statistics yet.
+DAILY_REVENUE_SELECT = """
+SELECT date(p.payment_date), pr.product_type, p.currency,
+       COUNT(*), SUM(f.product_quantity), SUM(f.total_price)
+FROM {source}
+CROSS JOIN fact_orders f ON f.payment_key = p.payment_key
+JOIN dim_products pr ON pr.product_key = f.product_key
+WHERE date(p.payment_date) IS NOT NULL
+GROUP BY 1, 2, 3
+"""
+
+MONTHLY_REVENUE_SELECT = """
+SELECT strftime('%Y-%m', p.payment_date), c.delivery_country, p.currency,
+       COUNT(*), SUM(f.product_quantity), SUM(f.total_price)
+FROM {source}
+CROSS JOIN fact_orders f ON f.payment_key = p.payment_key
+JOIN dim_clients c ON c.client_key = f.client_key
+WHERE date(p.payment_date) IS NOT NULL
+GROUP BY 1, 2, 3
+"""
+
+
+def _stage_keys(conn: sqlite3.Connection, table: str, keys: Iterable[str]) -> None:
+    # a temporary key table joined against, rather than an IN list of unbounded length
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table} (key TEXT NOT NULL PRIMARY KEY)")
+    conn.execute(f"DELETE FROM {table}")
+    conn.executemany(
+        f"INSERT OR IGNORE INTO {table} (key) VALUES (?)", ((key,) for key in keys)
+    )
+
+
+def payment_days(
+    database: str, billing_codes: Iterable[str], conn: Optional[sqlite3.Connection] = None
+) -> Set[str]:
+    """Return the days, as yyyy-mm-dd strings, of the given payments in dim_payment.
+
+    Called after a batch's dimensions are loaded, this gives the days its facts
+    fall on, including for billing codes loaded by an earlier batch.
+    """
+    with connection_for(database, conn) as agg_conn:
+        _stage_keys(agg_conn, "agg_billing_codes", billing_codes)
+        rows = agg_conn.execute(
+            """
+            SELECT DISTINCT date(p.payment_date)
+            FROM agg_billing_codes k
+            JOIN dim_payment p ON p.payment_billing_code = k.key
+            """
+        ).fetchall()
+    return {day for (day,) in rows if day is not None}
+
+
+def order_days(
+    database: str, order_numbers: Iterable[str], conn: Optional[sqlite3.Connection] = None
+) -> Set[str]:
+    """Return the days the given orders currently fall on in fact_orders.
+
+    Called before an upsert, this gives the days orders may be moved away from.
+    """
+    with connection_for(database, conn) as agg_conn:
+        _stage_keys(agg_conn, "agg_order_numbers", order_numbers)
+        rows = agg_conn.execute(
+            """
+            SELECT DISTINCT date(p.payment_date)
+            FROM agg_order_numbers k
+            JOIN fact_orders f ON f.order_number = k.key
+            JOIN dim_payment p ON p.payment_key = f.payment_key
+            """
+        ).fetchall()
+    return {day for (day,) in rows if day is not None}
+
+
+@instrument
+def refresh_aggregates(
+    database: str, days: Iterable[str], conn: Optional[sqlite3.Connection] = None
+) -> int:
+    """Recompute the aggregate rows of the given days and of the months they fall in.
+
+    Only the facts of those days and months are read, found through the index on
+    dim_payment.payment_date, so the cost of a refresh depends on the size of the
+    batch rather than on the size of the history. When the days cover half the
+    history or more, e.g. on the first load, the tables are rebuilt instead.
+    Recomputing the affected periods, rather than adding the batch's totals, keeps
+    the aggregates right when orders are skipped or updated by the "append" and
+    "upsert" order modes.
+
+    Pass the LoadSession connection, so the aggregates are committed in the same
+    transaction as the facts.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        days: The days to recompute, as yyyy-mm-dd strings, e.g. from `payment_days`.
+        conn: An open connection to write through, e.g. from a LoadSession.
+
+    Returns:
+        The number of days recomputed.
+    """
+    days = sorted(set(days))
+    if not days:
+        return 0
+
+    try:
+        with connection_for(database, conn) as agg_conn:
+            known_days = agg_conn.execute(
+                "SELECT COUNT(DISTINCT sale_date) FROM agg_daily_revenue"
+            ).fetchone()[0]
+            if len(days) >= REBUILD_DAY_SHARE * known_days:
+                rebuild_aggregates(database, conn=agg_conn)
+                logging.info(f"Rebuilt the aggregates, {len(days)} days changed")
+                return len(days)
+
+            _stage_keys(agg_conn, "agg_days", days)
+            _stage_keys(agg_conn, "agg_months", {day[:7] for day in days})
+
+            agg_conn.execute(
+                "DELETE FROM agg_daily_revenue WHERE sale_date IN (SELECT key FROM agg_days)"
+            )
+            agg_conn.execute(
+                "INSERT INTO agg_daily_revenue "
+                + DAILY_REVENUE_SELECT.format(
+                    source="""agg_days d
+                    CROSS JOIN dim_payment p
+                      ON p.payment_date >= d.key AND p.payment_date < date(d.key, '+1 day')"""
+                )
+            )
+
+            agg_conn.execute(
+                "DELETE FROM agg_monthly_revenue_by_country WHERE sale_month IN (SELECT key FROM agg_months)"
+            )
+            agg_conn.execute(
+                "INSERT INTO agg_monthly_revenue_by_country "
+                + MONTHLY_REVENUE_SELECT.format(
+                    source="""agg_months m
+                    CROSS JOIN dim_payment p
+                      ON p.payment_date >= m.key || '-01'
+                     AND p.payment_date < date(m.key || '-01', '+1 month')"""
+                )
+            )
+    except Exception as e:
+        logging.error(f"Error while refreshing the aggregate tables: {e}", exc_info=True)
+        raise e
+
+    logging.info(f"Refreshed the aggregates of {len(days)} days")
+    return len(days)
+
+
+@instrument
+def rebuild_aggregates(database: str, conn: Optional[sqlite3.Connection] = None) -> None:
+    """Recompute the aggregate tables from the whole fact table.
+
+    Needed after changes the incremental refresh does not track, such as a
+    product's type being updated, or to repair the tables. Like a load, it bumps
+    the load generation, so readers caching results see the new rows.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        conn: An open connection to write through, e.g. from a LoadSession.
+    """
+    try:
+        with connection_for(database, conn) as agg_conn:
+            for table in AGGREGATE_TABLES:
+                agg_conn.execute(f"DELETE FROM {table}")
+            agg_conn.execute(
+                "INSERT INTO agg_daily_revenue "
+                + DAILY_REVENUE_SELECT.format(source="dim_payment p")
+            )
+            agg_conn.execute(
+                "INSERT INTO agg_monthly_revenue_by_country "
+                + MONTHLY_REVENUE_SELECT.format(source="dim_payment p")
+            )
+            bump_load_generation(database, conn=agg_conn)
+    except Exception as e:
+        logging.error(f"Error while rebuilding the aggregate tables: {e}", exc_info=True)
+        raise e
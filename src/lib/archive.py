@@ -0,0 +1,213 @@
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+from datetime import date
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Union
+
+from .db_helper import connection_for
+from .manifest import hash_file
+from .metrics import instrument
+from .schema import LEGACY_ENCODING, PAYMENT_DATE_FORMATS
+from .smallbatch import iter_rows, parse_payment_date
+
+# gzip's own default; higher levels save little on these files for much more CPU
+ARCHIVE_COMPRESSLEVEL = 6
+
+COPY_BLOCK_SIZE = 1024 * 1024
+
+ARCHIVE_COLUMNS = """content_hash, file_name, archive_path, first_payment_date, last_payment_date,
+    row_count, file_size, archived_size"""
+
+
+class ArchivedFile(NamedTuple):
+    """An entry of the file_archive index, see `FileArchive`."""
+
+    content_hash: str
+    file_name: str
+    archive_path: str
+    first_payment_date: Optional[str]
+    last_payment_date: Optional[str]
+    row_count: Optional[int]
+    file_size: int
+    archived_size: int
+
+
+class FileArchive:
+    """Keep loaded input files gzip-compressed, partitioned by the day they were archived.
+
+    A file `data.csv` archived on 2021-03-14 is stored as
+    `2021/03/14/data.<hash>.csv.gz` under the archive folder, and indexed in the
+    file_archive table of the database with its row count and the range of its
+    PaymentDates. A replay, see `pipeline.replay_archive`, selects files by that
+    range and reads them compressed, as pandas decompresses .gz files on the fly.
+    Files are keyed by the hash of their content, so a redelivered copy is stored
+    once.
+
+    Args:
+        archive_dir: The folder the archive is kept in.
+        database: A string representing the path to the SQLite database holding
+            the index.
+        compresslevel: The gzip compression level, 1 to 9.
+        date_formats: The formats PaymentDate is parsed with for the index, see
+            `etl.parse_dates`.
+        encoding: The encoding the files are decoded with for the index.
+    """
+
+    def __init__(
+        self,
+        archive_dir: Union[str, Path],
+        database: str,
+        compresslevel: int = ARCHIVE_COMPRESSLEVEL,
+        date_formats: Optional[List[str]] = None,
+        encoding: str = LEGACY_ENCODING,
+    ) -> None:
+        self.archive_dir = Path(archive_dir)
+        self.database = database
+        self.compresslevel = compresslevel
+        self.date_formats = date_formats or PAYMENT_DATE_FORMATS
+        self.encoding = encoding
+
+    def path(self, entry: ArchivedFile) -> Path:
+        """Return the path of an archived file."""
+        return self.archive_dir / entry.archive_path
+
+    def _scan(self, file_path: Path):
+        # the row count and PaymentDate range, read without pandas; a file the
+        # csv module cannot read is archived all the same, without them
+        try:
+            row_count, dates, parsed = 0, set(), {}
+            for row in iter_rows(file_path, self.encoding):
+                row_count += 1
+                value = row["PaymentDate"]
+                if value not in parsed:
+                    parsed[value] = parse_payment_date(value, self.date_formats)
+                dates.add(parsed[value])
+        except (ValueError, UnicodeError) as e:
+            logging.warning(f"Archiving {file_path.name} without its row count and dates: {e}")
+            return None, None, None
+        dates.discard(None)
+        return row_count, min(dates, default=None), max(dates, default=None)
+
+    def add(
+        self,
+        file_path: Path,
+        archived_on: Optional[date] = None,
+        conn: Optional[sqlite3.Connection] = None,
+    ) -> ArchivedFile:
+        """Compress a file into the archive, index it and delete the original.
+
+        The compressed file is written under a temporary name and renamed into
+        place before it is indexed, so an interrupted add leaves the original in
+        place and at worst an unindexed archive file that the next add replaces.
+
+        Args:
+            file_path: A Path object representing the file to archive.
+            archived_on: The day partition to store the file in. Defaults to today.
+            conn: An open connection to write the index through.
+
+        Returns:
+            The index entry of the file.
+        """
+        file_path = Path(file_path)
+        content_hash = hash_file(file_path)
+        with connection_for(self.database, conn) as index_conn:
+            row = index_conn.execute(
+                f"SELECT {ARCHIVE_COLUMNS} FROM file_archive WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if row is not None:
+                entry = ArchivedFile(*row)
+                logging.info(f"{file_path.name} is already archived as {entry.archive_path}")
+            else:
+                archived_on = archived_on or date.today()
+                archive_path = Path(
+                    f"{archived_on:%Y}", f"{archived_on:%m}", f"{archived_on:%d}",
+                    f"{file_path.stem}.{content_hash[:12]}{file_path.suffix}.gz",
+                )
+                target = self.archive_dir / archive_path
+                target.parent.mkdir(parents=True, exist_ok=True)
+                partial = target.with_name(target.name + ".partial")
+                with open(file_path, "rb") as src, gzip.open(
+                    partial, "wb", compresslevel=self.compresslevel
+                ) as dest:
+                    shutil.copyfileobj(src, dest, COPY_BLOCK_SIZE)
+                os.replace(partial, target)
+
+                row_count, first_date, last_date = self._scan(file_path)
+                entry = ArchivedFile(
+                    content_hash,
+                    file_path.name,
+                    archive_path.as_posix(),
+                    first_date,
+                    last_date,
+                    row_count,
+                    os.path.getsize(file_path),
+                    os.path.getsize(target),
+                )
+                index_conn.execute(
+                    f"""
+                    INSERT INTO file_archive ({ARCHIVE_COLUMNS})
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    entry,
+                )
+                logging.info(
+                    f"Archived {file_path.name} as {entry.archive_path}, "
+                    f"{entry.file_size} to {entry.archived_size} bytes"
+                )
+        file_path.unlink()
+        return entry
+
+    def select(self, first: Optional[str] = None, last: Optional[str] = None) -> List[ArchivedFile]:
+        """List the archived files holding payments between two days, oldest first.
+
+        Files whose dates could not be read are always listed.
+
+        Args:
+            first: The first day, as yyyy-mm-dd. Defaults to the earliest.
+            last: The last day, as yyyy-mm-dd. Defaults to the latest.
+
+        Returns:
+            A list of ArchivedFile entries.
+        """
+        with connection_for(self.database) as conn:
+            rows = conn.execute(
+                f"""
+                SELECT {ARCHIVE_COLUMNS}
+                FROM file_archive
+                WHERE first_payment_date IS NULL
+                   OR ((? IS NULL OR last_payment_date >= ?) AND (? IS NULL OR first_payment_date <= ?))
+                ORDER BY archived_at, archive_path
+                """,
+                (first, first, last, last),
+            ).fetchall()
+        return [ArchivedFile(*row) for row in rows]
+
+
+@instrument
+def archive_processed_files(
+    src: str,
+    archive: FileArchive,
+    files: Optional[List[Path]] = None,
+) -> None:
+    """Compress processed files from the source folder into the archive.
+
+    The counterpart of `files.move_processed_files` for an archive.
+
+    Args:
+        src: A string representing the path to the source folder.
+        archive: The FileArchive to store the files in.
+        files: If given, only these files of the source folder are archived.
+            Otherwise all CSV files of the folder are.
+
+    Returns:
+        None.
+    """
+    paths = sorted(Path(src).glob("*.csv")) if files is None else [Path(src) / Path(f).name for f in files]
+    for path in paths:
+        try:
+            archive.add(path)
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"Error while archiving {path.name}: {e}", exc_info=True)
@@ -0,0 +1,111 @@
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional
+
+import pandas as pd
+
+from .manifest import hash_file
+from .readers import HAS_PYARROW, arrow_to_pandas
+
+# bump when the way files are parsed changes without the dtypes changing
+CACHE_FORMAT_VERSION = 1
+
+CACHE_SUFFIX = ".feather"
+
+
+class ParsedFileCache:
+    """A local cache of parsed and typed CSV files, stored as Feather files.
+
+    Entries are keyed by the SHA-256 of the source file's content, the dtypes it
+    was read with, the encoding and CACHE_FORMAT_VERSION, so a changed file or
+    schema never hits a stale entry. Entries are written uncompressed, which lets
+    them be memory-mapped and read without copying the numeric columns.
+
+    The cache is trimmed to `max_bytes` after every write, evicting the least
+    recently used entries first; a hit refreshes the entry's mtime, which serves
+    as its last-used time.
+
+    Args:
+        cache_dir: The directory holding the cache entries. Created if missing.
+        max_bytes: The size the cache is trimmed to.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 2 * 1024**3) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.enabled = HAS_PYARROW
+        if not self.enabled:
+            logging.warning("pyarrow is not installed, the parsed-file cache is disabled")
+
+    def entry_path(self, file_path: Path, dtype: Dict[str, object], encoding: str) -> Path:
+        """Return the path of the cache entry for a source file read with `dtype` and `encoding`."""
+        params = repr((CACHE_FORMAT_VERSION, sorted((c, str(t)) for c, t in dtype.items()), encoding))
+        params_digest = hashlib.sha256(params.encode()).hexdigest()[:16]
+        return self.cache_dir / f"{hash_file(file_path)}-{params_digest}{CACHE_SUFFIX}"
+
+    def get(
+        self, file_path: Path, dtype: Dict[str, object], encoding: str
+    ) -> Optional[pd.DataFrame]:
+        """Return the cached DataFrame for a source file, or None on a miss."""
+        if not self.enabled:
+            return None
+        import pyarrow.feather as feather
+
+        entry = self.entry_path(file_path, dtype, encoding)
+        try:
+            table = feather.read_table(entry, memory_map=True)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Dropping unreadable cache entry {entry.name}: {e}")
+            entry.unlink(missing_ok=True)
+            return None
+
+        os.utime(entry)
+        logging.info(f"Read {Path(file_path).name} from the parsed-file cache")
+        return arrow_to_pandas(table, dtype)
+
+    def put(
+        self, file_path: Path, dtype: Dict[str, object], encoding: str, df: pd.DataFrame
+    ) -> None:
+        """Store the parsed DataFrame of a source file, then trim the cache."""
+        if not self.enabled:
+            return
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entry = self.entry_path(file_path, dtype, encoding)
+        # write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            feather.write_feather(table, tmp_path, compression="uncompressed")
+            os.replace(tmp_path, entry)
+        except Exception as e:
+            logging.warning(f"Could not cache {Path(file_path).name}: {e}")
+            Path(tmp_path).unlink(missing_ok=True)
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete the least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for entry in self.cache_dir.glob(f"*{CACHE_SUFFIX}"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+            logging.info(f"Evicted {entry.name} from the parsed-file cache")
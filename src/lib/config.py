@@ -0,0 +1,50 @@
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+# the repository root, so the default paths do not depend on the working directory
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+
+class Paths(NamedTuple):
+    """The files and folders a warehouse run reads and writes."""
+
+    database: Path
+    unprocessed: Path
+    processed: Path
+    rejected: Path
+    archive: Path
+    migrations: Path
+    drop_tables: Path
+    deferred_indexes: Path
+
+
+def default_paths(
+    root: Optional[str] = None,
+    database: Optional[str] = None,
+    data_dir: Optional[str] = None,
+) -> Paths:
+    """Return the paths of a warehouse laid out like this repository.
+
+    Args:
+        root: The folder holding the output, data and model folders. Defaults to
+            the repository root.
+        database: The SQLite database. Defaults to output/abcmusicaldwh.db under `root`.
+        data_dir: The folder holding the unprocessed, processed, rejected and
+            archive folders. Defaults to data under `root`.
+
+    Returns:
+        A Paths tuple.
+    """
+    root = PROJECT_ROOT if root is None else Path(root)
+    data = root / "data" if data_dir is None else Path(data_dir)
+    model = root / "model"
+    return Paths(
+        database=root / "output" / "abcmusicaldwh.db" if database is None else Path(database),
+        unprocessed=data / "unprocessed",
+        processed=data / "processed",
+        rejected=data / "rejected",
+        archive=data / "archive",
+        migrations=model / "migrations",
+        drop_tables=model / "drop_tables.sql",
+        deferred_indexes=model / "deferred_indexes.sql",
+    )
@@ -1,6 +1,63 @@
 import sqlite3
 import logging
-import pandas as pd
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, Optional, Union
+
+from .metrics import instrument
+
+if TYPE_CHECKING:
+    # imported where needed only, so that the small-batch path and the command
+    # line start without loading pandas
+    import pandas as pd
+
+# how load_data_orders and load_fact_orders_staged treat orders that already exist:
+# "insert" fails on them, "append" skips them, "upsert" updates them if they changed.
+# "insert" skips the orders already loaded with the same values, e.g. by an earlier
+# chunk of the run, as create_fact_orders drops them within a batch, see
+# `insert_mode_condition`
+ORDER_LOAD_MODES = ("insert", "append", "upsert")
+
+ORDER_CONFLICT_CLAUSES = {
+    "insert": "",
+    "append": "ON CONFLICT(order_number) DO NOTHING",
+    "upsert": """ON CONFLICT(order_number) DO UPDATE
+    SET client_key=excluded.client_key, product_key=excluded.product_key, payment_key=excluded.payment_key,
+        unit_price=excluded.unit_price, product_quantity=excluded.product_quantity, total_price=excluded.total_price
+    WHERE fact_orders.client_key IS NOT excluded.client_key
+       OR fact_orders.product_key IS NOT excluded.product_key
+       OR fact_orders.payment_key IS NOT excluded.payment_key
+       OR fact_orders.unit_price IS NOT excluded.unit_price
+       OR fact_orders.product_quantity IS NOT excluded.product_quantity
+       OR fact_orders.total_price IS NOT excluded.total_price""",
+}
+
+# the dimension inserts, shared by the pandas loads below and `smallbatch.load_small_files`
+CLIENT_INSERT_QUERY = """
+INSERT into dim_clients (client_name, delivery_address, delivery_city, delivery_postcode, delivery_country, delivery_contact_number)
+values(?, ?, ?, ?, ?, ?)
+ON CONFLICT(client_name) DO UPDATE
+SET delivery_address=excluded.delivery_address
+"""
+
+PAYMENT_INSERT_QUERY = """
+INSERT into dim_payment (payment_date, payment_type, payment_billing_code, currency)
+values(?, ?, ?, ?)
+ON CONFLICT(payment_billing_code) DO NOTHING;
+"""
+
+PRODUCT_INSERT_QUERY = """
+INSERT into dim_products (product_name, product_type)
+values(?, ?)
+ON CONFLICT(product_name) DO UPDATE SET product_type=excluded.product_type;
+"""
+
+# pragmas applied by LoadSession for bulk loading
+BULK_LOAD_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,  # negative values are in KiB, i.e. 64 MiB
+    "temp_store": "MEMORY",
+}
 
 
 def create_connection(db_file):
@@ -32,60 +89,165 @@ def create_tables_in_db(database, sql_path):
         if conn:
             conn.close()
     
-def create_connection_for_load(database, insert_query, insert_data):
-    conn = None
+class LoadSession:
+    """Hold one SQLite connection, tuned for bulk loading, for a whole pipeline run.
+
+    Example:
+        with LoadSession(database) as session, session.transaction():
+            load_data_clients(database, dim_client_df, conn=session.conn)
+            ...
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        pragmas: The pragmas to apply when the connection is opened. Defaults to
+            BULK_LOAD_PRAGMAS.
+        immediate: Start transactions with BEGIN IMMEDIATE, taking the write lock
+            up front. With several processes loading into one database, a deferred
+            transaction that has to upgrade its read lock fails at once with
+            "database is locked" instead of waiting for the busy timeout.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        pragmas: Optional[Dict[str, Union[str, int]]] = None,
+        immediate: bool = False,
+    ) -> None:
+        self.database = database
+        self.pragmas = BULK_LOAD_PRAGMAS if pragmas is None else pragmas
+        self.immediate = immediate
+        self.conn = None
+
+    def __enter__(self) -> "LoadSession":
+        # autocommit mode, so that transactions are only started by transaction()
+        self.conn = sqlite3.connect(self.database, isolation_level=None)
+        for name, value in self.pragmas.items():
+            self.conn.execute(f"PRAGMA {name} = {value}")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.conn.close()
+        self.conn = None
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run the enclosed loads in one transaction, rolled back if any of them fails."""
+        self.conn.execute("BEGIN IMMEDIATE" if self.immediate else "BEGIN")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            logging.error("Load failed, transaction rolled back")
+            raise
+        else:
+            self.conn.execute("COMMIT")
+
+
+@contextmanager
+def session_for(
+    database: str, session: Optional[LoadSession] = None
+) -> Iterator[LoadSession]:
+    """Yield `session` if given, otherwise a new LoadSession that is closed on exit.
+
+    This lets a long-running process keep one warm connection across many runs.
+    """
+    if session is not None:
+        yield session
+        return
+
+    with LoadSession(database) as session:
+        yield session
+
+
+@contextmanager
+def connection_for(
+    database: str, conn: Optional[sqlite3.Connection] = None
+) -> Iterator[sqlite3.Connection]:
+    """Yield `conn` if given, otherwise a new connection that is committed and closed on exit.
+
+    This lets the load functions either run standalone or join the transaction of
+    a LoadSession.
+    """
+    if conn is not None:
+        yield conn
+        return
+
+    conn = sqlite3.connect(database)
     try:
-        conn = sqlite3.connect(database)
-        cur = conn.cursor()
-        cur.executemany(insert_query, insert_data)
+        yield conn
         conn.commit()
+    finally:
+        conn.close()
+
+
+def frame_to_records(input_df: "pd.DataFrame") -> list:
+    """Convert a DataFrame to a list of row tuples that sqlite3 can bind.
+
+    Columns with a pandas extension dtype, such as the arrow-backed strings of the
+    compact representation, hold pd.NA for missing values, which sqlite3 cannot
+    bind, so they are converted to objects with None for missing values first.
+    """
+    import pandas as pd
+
+    extension_columns = [
+        column
+        for column, dtype in input_df.dtypes.items()
+        if isinstance(dtype, pd.api.extensions.ExtensionDtype)
+        and not isinstance(dtype, pd.CategoricalDtype)
+    ]
+    if extension_columns:
+        input_df = input_df.astype({column: object for column in extension_columns})
+        input_df[extension_columns] = input_df[extension_columns].where(
+            input_df[extension_columns].notna(), None
+        )
+    return list(input_df.itertuples(index=False, name=None))
+
+
+def create_connection_for_load(database, insert_query, insert_data, conn=None):
+    try:
+        with connection_for(database, conn) as load_conn:
+            return load_conn.executemany(insert_query, insert_data).rowcount
     except Exception as e:
         logging.error(f"Error while loading client data: {e}", exc_info=True)
         raise e
-    finally:
-        if conn:
-            conn.close()
 
-def load_data_products(database: str, input_df: pd.DataFrame) -> None:
+@instrument
+def load_data_products(
+    database: str, input_df: "pd.DataFrame", conn: Optional[sqlite3.Connection] = None
+) -> None:
     """Load product data into the products dimension table.
 
     Args:
-        conn: A SQLite3 database connection object.
+        database: A string representing the path to the SQLite database.
         input_df: A pandas DataFrame representing the input data.
+        conn: An open connection to load through, e.g. from a LoadSession.
 
     Returns:
         None.
     """
-    insert_query = """
-    INSERT into dim_products (product_name, product_type)
-    values(?, ?)
-    ON CONFLICT(product_name) DO UPDATE SET product_type=excluded.product_type;
-    """
+    insert_query = PRODUCT_INSERT_QUERY
 
-    insert_data = list(
-        input_df[["ProductName", "ProductType"]].itertuples(index=False, name=None)
-    )
+    insert_data = frame_to_records(input_df[["ProductName", "ProductType"]])
     
-    create_connection_for_load(database, insert_query, insert_data)
+    create_connection_for_load(database, insert_query, insert_data, conn)
 
-def load_data_clients(database: str, input_df: pd.DataFrame) -> None:
+@instrument
+def load_data_clients(
+    database: str, input_df: "pd.DataFrame", conn: Optional[sqlite3.Connection] = None
+) -> None:
     """Load client data into the clients dimension table.
 
     Args:
-        conn: A SQLite3 database connection object.
+        database: A string representing the path to the SQLite database.
         input_df: A pandas DataFrame representing the input data.
+        conn: An open connection to load through, e.g. from a LoadSession.
 
     Returns:
         None.
     """
-    insert_query = """
-        INSERT into dim_clients (client_name, delivery_address, delivery_city, delivery_postcode, delivery_country, delivery_contact_number)
-        values(?, ?, ?, ?, ?, ?)
-        ON CONFLICT(client_name) DO UPDATE 
-        SET delivery_address=excluded.delivery_address
-    """
+    insert_query = CLIENT_INSERT_QUERY
 
-    insert_data = list(
+    insert_data = frame_to_records(
         input_df[
             [
                 "ClientName",
@@ -95,53 +257,74 @@ def load_data_clients(database: str, input_df: pd.DataFrame) -> None:
                 "DeliveryCountry",
                 "DeliveryContactNumber",
             ]
-        ].itertuples(index=False, name=None)
+        ]
     )
 
-    create_connection_for_load(database, insert_query, insert_data)
+    create_connection_for_load(database, insert_query, insert_data, conn)
 
 
-def load_data_payments(database: str, input_df: pd.DataFrame) -> None:
+@instrument
+def load_data_payments(
+    database: str, input_df: "pd.DataFrame", conn: Optional[sqlite3.Connection] = None
+) -> None:
     """Load payment data into the payment dimension table.
 
     Args:
-        conn: A SQLite3 database connection object.
+        database: A string representing the path to the SQLite database.
         input_df: A pandas DataFrame representing the input data.
+        conn: An open connection to load through, e.g. from a LoadSession.
 
     Returns:
         None.
     """
-    insert_query = """
-    INSERT into dim_payment (payment_date, payment_type, payment_billing_code, currency)
-    values(?, ?, ?, ?)
-    ON CONFLICT(payment_billing_code) DO NOTHING;
-    """
+    insert_query = PAYMENT_INSERT_QUERY
 
-    insert_data = list(
+    insert_data = frame_to_records(
         input_df[
             ["PaymentDate", "PaymentType", "PaymentBillingCode", "Currency"]
-        ].itertuples(index=False, name=None)
+        ]
     )
     
-    create_connection_for_load(database, insert_query, insert_data)
+    create_connection_for_load(database, insert_query, insert_data, conn)
 
 
-def load_data_orders(database: str, input_df: pd.DataFrame) -> None:
+@instrument
+def load_data_orders(
+    database: str,
+    input_df: "pd.DataFrame",
+    conn: Optional[sqlite3.Connection] = None,
+    order_mode: str = "insert",
+) -> int:
     """Load order data into the fact_orders table.
 
     Args:
-        conn: A SQLite3 database connection object.
+        database: A string representing the path to the SQLite database.
         input_df: A pandas DataFrame representing the input data.
+        conn: An open connection to load through, e.g. from a LoadSession.
+        order_mode: One of ORDER_LOAD_MODES. "insert" fails if an order_number is
+            already loaded with other values and skips its exact duplicates,
+            "append" skips existing orders and "upsert" updates the existing orders
+            whose values changed. Existing orders are found through the
+            order_number primary key, so no other rows are read.
 
     Returns:
-        None.
+        The number of rows inserted or updated.
     """
-    insert_query = """
+    conflict_clause = order_conflict_clause(order_mode)
+    if order_mode == "insert":
+        insert_query = f"""
+    INSERT into fact_orders (order_number, client_key, product_key, payment_key, unit_price, product_quantity, total_price)
+    SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7
+    WHERE {insert_mode_condition("?1", "?5", "?6", "?7")};
+    """
+    else:
+        insert_query = f"""
     INSERT into fact_orders (order_number, client_key, product_key, payment_key, unit_price, product_quantity, total_price)
-    values(?, ?, ?, ?, ?, ?, ?);
+    values(?, ?, ?, ?, ?, ?, ?)
+    {conflict_clause};
     """
 
-    insert_data = list(
+    insert_data = frame_to_records(
         input_df[
             [
                 "OrderNumber",
@@ -152,7 +335,150 @@ def load_data_orders(database: str, input_df: pd.DataFrame) -> None:
                 "ProductQuantity",
                 "TotalPrice",
             ]
-        ].itertuples(index=False, name=None)
+        ]
     )
     
-    create_connection_for_load(database, insert_query, insert_data)
+    return create_connection_for_load(database, insert_query, insert_data, conn)
+
+
+def insert_mode_condition(
+    order_number: str, unit_price: str, product_quantity: str, total_price: str
+) -> str:
+    """Return the SQL condition selecting the fact rows the "insert" mode inserts.
+
+    A row is left out if fact_orders already has its order with the same
+    UnitPrice, ProductQuantity and TotalPrice, the key `create_fact_orders` drops
+    duplicates on. An order already loaded with other values is inserted, and
+    fails on the order_number primary key. The arguments are the SQL expressions
+    of the row's values, e.g. parameters or staging table columns.
+    """
+    return f"""NOT EXISTS (
+        SELECT 1 FROM fact_orders f
+        WHERE f.order_number = {order_number} AND f.unit_price = {unit_price}
+          AND f.product_quantity = {product_quantity} AND f.total_price = {total_price}
+    )"""
+
+
+def order_conflict_clause(order_mode: str) -> str:
+    """Return the ON CONFLICT clause of the fact_orders insert for `order_mode`."""
+    if order_mode not in ORDER_LOAD_MODES:
+        raise ValueError(
+            f"order_mode must be one of {ORDER_LOAD_MODES}, got {order_mode!r}"
+        )
+    return ORDER_CONFLICT_CLAUSES[order_mode]
+
+
+@instrument
+def load_fact_orders_staged(
+    database: str,
+    input_df: "pd.DataFrame",
+    conn: Optional[sqlite3.Connection] = None,
+    order_mode: str = "insert",
+) -> int:
+    """Load the fact_orders table by resolving the dimension keys inside SQLite.
+
+    The batch is bulk-inserted into a temporary staging table and the client,
+    product and payment keys are looked up with one INSERT ... SELECT ... JOIN
+    against the unique indexes on the dimension natural keys. Unlike
+    `create_fact_orders`, nothing is read from the dimension tables into pandas,
+    so the cost depends on the batch size rather than on the size of the dimensions.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        input_df: A pandas DataFrame returned by `transform_data`.
+        conn: An open connection to load through, e.g. from a LoadSession.
+        order_mode: One of ORDER_LOAD_MODES, see `load_data_orders`. In "append"
+            mode the new orders are selected with an anti-join against the
+            order_number primary key before anything is inserted.
+
+    Returns:
+        The number of rows inserted or updated.
+    """
+    staging_columns = [
+        "OrderNumber",
+        "ClientName",
+        "ProductName",
+        "PaymentBillingCode",
+        "UnitPrice",
+        "ProductQuantity",
+        "TotalPrice",
+    ]
+    staging_data = frame_to_records(
+        input_df[staging_columns].drop_duplicates(
+            ["OrderNumber", "UnitPrice", "ProductQuantity", "TotalPrice"]
+        )
+    )
+
+    insert_query = """
+    INSERT INTO fact_orders (order_number, client_key, product_key, payment_key, unit_price, product_quantity, total_price)
+    SELECT s.order_number, c.client_key, p.product_key, pay.payment_key, s.unit_price, s.product_quantity, s.total_price
+    FROM staging_orders s
+    JOIN dim_clients c ON c.client_name = s.client_name
+    JOIN dim_products p ON p.product_name = s.product_name
+    JOIN dim_payment pay ON pay.payment_billing_code = s.payment_billing_code
+    """
+    conflict_clause = order_conflict_clause(order_mode)
+    if order_mode == "append":
+        insert_query += """
+    WHERE NOT EXISTS (SELECT 1 FROM fact_orders f WHERE f.order_number = s.order_number)
+    """
+    elif order_mode == "insert":
+        insert_query += f"""
+    WHERE {insert_mode_condition("s.order_number", "s.unit_price", "s.product_quantity", "s.total_price")}
+    """
+    else:
+        # "WHERE true" keeps SQLite from parsing ON CONFLICT as a join constraint
+        insert_query += f"""
+    WHERE true
+    {conflict_clause}
+    """
+
+    try:
+        with connection_for(database, conn) as load_conn:
+            load_conn.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS staging_orders (
+                  order_number VARCHAR(255),
+                  client_name VARCHAR(255),
+                  product_name VARCHAR(255),
+                  payment_billing_code VARCHAR(255),
+                  unit_price DECIMAL(10, 2),
+                  product_quantity INT,
+                  total_price DECIMAL(10, 2)
+                )
+                """
+            )
+            load_conn.execute("DELETE FROM staging_orders")
+            load_conn.executemany(
+                "INSERT INTO staging_orders VALUES (?, ?, ?, ?, ?, ?, ?)", staging_data
+            )
+            loaded_rows = load_conn.execute(insert_query).rowcount
+            load_conn.execute("DELETE FROM staging_orders")
+    except Exception as e:
+        logging.error(f"Error while loading order data: {e}", exc_info=True)
+        raise e
+
+    logging.info(f"Loaded {loaded_rows} fact rows through the staging table")
+    return loaded_rows
+
+
+def bump_load_generation(database: str, conn: Optional[sqlite3.Connection] = None) -> None:
+    """Count a load in the load_generation table.
+
+    Called in the load transaction, so readers holding results computed at an
+    earlier generation, such as the query service's cache, see the change once
+    the load commits and not before.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        conn: An open connection to write through, e.g. from a LoadSession.
+    """
+    with connection_for(database, conn) as generation_conn:
+        generation_conn.execute(
+            "UPDATE load_generation SET generation = generation + 1, loaded_at = CURRENT_TIMESTAMP WHERE id = 1"
+        )
+
+
+def get_load_generation(conn: sqlite3.Connection) -> int:
+    """Return the number of loads committed to the database so far."""
+    return conn.execute("SELECT generation FROM load_generation WHERE id = 1").fetchone()[0]
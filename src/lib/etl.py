@@ -1,67 +1,137 @@
 import pandas as pd
 import numpy as np
-import pendulum
 from pathlib import Path
-import shutil
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import os
 import logging
 import sqlite3
-from typing import List
+from typing import Dict, Iterator, List, NamedTuple, Optional
 
+from .cache import ParsedFileCache
+from .files import get_csv_files_for_processing, move_processed_files
+from .metrics import instrument, stage
+from .readers import HAS_PYARROW, read_csv, read_csv_chunks
+from .schema import INPUT_SCHEMA, LEGACY_ENCODING, PAYMENT_DATE_FORMATS
+from .validation import Rule, validate_rows, write_bad_lines
 
-def get_csv_files_for_processing(folder_path: str) -> List[Path]:
-    """Get a list of CSV files in a folder.
+# low-cardinality text columns that the compact representation stores as categoricals
+COMPACT_CATEGORY_COLUMNS = [
+    "Currency",
+    "ProductType",
+    "PaymentType",
+    "DeliveryCountry",
+    "DeliveryCity",
+]
+
+
+def input_schema(compact: bool = False) -> Dict[str, object]:
+    """Return the dtypes used to read the CSV files.
 
     Args:
-        folder_path: A string representing the folder path.
+        compact: Use the compact in-memory representation: categoricals for the
+            low-cardinality text columns and, when pyarrow is installed,
+            arrow-backed strings instead of Python string objects for the other
+            text columns.
 
     Returns:
-        A list of Path objects representing the CSV files in the folder.
+        A dict mapping column names to dtypes.
     """
-    try:
-        files = Path(folder_path).glob("*.csv")
-        return list(files)
-    except Exception as e:
-        logging.error(f"Error while getting CSV files: {e}", exc_info=True)
-        return []
-    
+    if not compact:
+        return INPUT_SCHEMA
+
+    schema = {}
+    for column, dtype in INPUT_SCHEMA.items():
+        if column in COMPACT_CATEGORY_COLUMNS:
+            schema[column] = "category"
+        elif dtype is str and HAS_PYARROW:
+            schema[column] = pd.StringDtype("pyarrow")
+        else:
+            schema[column] = dtype
+    return schema
 
-def extract_file(file_path: Path) -> pd.DataFrame:
+
+def concat_frames(dfs: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate extracted frames, keeping the compact categorical columns categorical.
+
+    pd.concat falls back to object dtype when the categories of the frames differ,
+    so the categorical columns are combined with union_categoricals first.
+    """
+    categorical_columns = [
+        column
+        for column in COMPACT_CATEGORY_COLUMNS
+        if all(
+            column in df.columns and isinstance(df[column].dtype, pd.CategoricalDtype)
+            for df in dfs
+        )
+    ]
+    if len(dfs) > 1 and categorical_columns:
+        combined = {
+            column: pd.api.types.union_categoricals(
+                [df[column] for df in dfs]
+            ).categories
+            for column in categorical_columns
+        }
+        dfs = [
+            df.astype(
+                {
+                    column: pd.CategoricalDtype(categories)
+                    for column, categories in combined.items()
+                }
+            )
+            for df in dfs
+        ]
+    return pd.concat(dfs, ignore_index=True)
+
+
+@instrument(reads_file=True)
+def extract_file(
+    file_path: Path,
+    compact: bool = False,
+    engine: str = "pandas",
+    encoding: str = LEGACY_ENCODING,
+    cache: Optional[ParsedFileCache] = None,
+    reject_dir: Optional[str] = None,
+) -> pd.DataFrame:
     """Extract data from a CSV file.
 
     Args:
         file_path: A Path object representing the file path.
+        compact: Read the text columns into the compact representation, see
+            `input_schema`.
+        engine: The CSV reader backend, "pandas" or "pyarrow", see `readers.read_csv`.
+        encoding: The encoding the file is decoded with, or "auto" to detect it
+            per file, see `readers.detect_encoding`.
+        cache: If given, the parsed file is read from this cache when it holds an
+            entry for the file's content, and stored in it otherwise.
+        reject_dir: If given, the lines skipped for having more fields than the
+            header are written to this folder, see `validation.write_bad_lines`.
+            Otherwise they are skipped without being collected.
 
     Returns:
         A pandas DataFrame containing the extracted data, or None if there was an error.
     """
-    input_schema = {
-        "OrderNumber": str,
-        "ClientName": str,
-        "ProductName": str,
-        "ProductType": str,
-        "UnitPrice": float,
-        "ProductQuantity": "int64",
-        "TotalPrice": float,
-        "Currency": str,
-        "DeliveryAddress": str,
-        "DeliveryCity": str,
-        "DeliveryPostcode": str,
-        "DeliveryCountry": str,
-        "DeliveryContactNumber": str,
-        "PaymentType": str,
-        "PaymentBillingCode": str,
-        "PaymentDate": str,
-    }
-
     try:
-        extracted_df = pd.read_csv(
-            file_path,
-            dtype=input_schema,
-            encoding="unicode_escape",
-            header=[0],
-            on_bad_lines="skip",
+        dtype = input_schema(compact)
+        if cache is not None:
+            cached_df = cache.get(file_path, dtype, encoding)
+            if cached_df is not None:
+                return cached_df
+
+        # the skipped lines are only collected to be rejected, as collecting them
+        # takes the slower python parser
+        bad_lines = [] if reject_dir is not None else None
+        extracted_df = read_csv(
+            file_path, dtype, engine=engine, encoding=encoding, bad_lines=bad_lines
         )
+        if reject_dir is not None:
+            write_bad_lines(
+                bad_lines, list(extracted_df.columns), Path(file_path).stem, reject_dir
+            )
+
+        # a file with rejected lines is parsed again, so they are rejected again
+        if cache is not None and not bad_lines:
+            cache.put(file_path, dtype, encoding, extracted_df)
         return extracted_df
     except Exception as e:
         logging.error(
@@ -70,55 +140,418 @@ def extract_file(file_path: Path) -> pd.DataFrame:
         return None
 
 
-def extract_all_files(files: List[Path]) -> pd.DataFrame:
+def extract_all_files(
+    files: List[Path],
+    compact: bool = False,
+    engine: str = "pandas",
+    encoding: str = LEGACY_ENCODING,
+    cache: Optional[ParsedFileCache] = None,
+    failed_files: Optional[List[Path]] = None,
+    reject_dir: Optional[str] = None,
+) -> pd.DataFrame:
     """Extract data from multiple CSV files and concatenate into a single DataFrame.
 
     Args:
         files: A list of Path objects representing the CSV files to extract data from.
+        compact: Read the text columns into the compact representation, see
+            `input_schema`.
+        engine: The CSV reader backend, "pandas" or "pyarrow", see `readers.read_csv`.
+        encoding: The encoding the file is decoded with, or "auto" to detect it
+            per file, see `readers.detect_encoding`.
+        cache: If given, files are read from and stored in this parsed-file
+            cache, see `extract_file`.
+        failed_files: If given, the files that could not be extracted are
+            appended to this list.
+        reject_dir: If given, the lines skipped by the CSV reader are written to
+            this folder, see `extract_file`.
 
     Returns:
         A pandas DataFrame containing the extracted data from all the files, or None if no data was extracted.
     """
     dfs = []
     for f in files:
-        data = extract_file(f)
+        data = extract_file(
+            f,
+            compact=compact,
+            engine=engine,
+            encoding=encoding,
+            cache=cache,
+            reject_dir=reject_dir,
+        )
         if data is not None:
             data["file"] = f.stem
             dfs.append(data)
+        elif failed_files is not None:
+            failed_files.append(f)
 
     if len(dfs) == 0:
         logging.warning("No data extracted from CSV files")
         return None
 
-    df = pd.concat(dfs, ignore_index=True)
+    df = concat_frames(dfs)
     return df
 
 
-def transform_data(input_df: pd.DataFrame) -> pd.DataFrame:
+def extract_file_chunks(
+    file_path: Path,
+    chunksize: int,
+    compact: bool = False,
+    engine: str = "pandas",
+    encoding: str = LEGACY_ENCODING,
+    failed_files: Optional[List[Path]] = None,
+    reject_dir: Optional[str] = None,
+) -> Iterator[pd.DataFrame]:
+    """Extract data from a CSV file in chunks of at most `chunksize` rows.
+
+    Args:
+        file_path: A Path object representing the file path.
+        chunksize: The maximum number of rows per chunk.
+        compact: Read the text columns into the compact representation, see
+            `input_schema`.
+        engine: The CSV reader backend, "pandas" or "pyarrow", see `readers.read_csv`.
+        encoding: The encoding the file is decoded with, or "auto" to detect it
+            per file, see `readers.detect_encoding`.
+        failed_files: If given, the file is appended to this list if it could
+            not be read to its end.
+        reject_dir: If given, the lines skipped by the CSV reader are written to
+            this folder, see `extract_file`.
+
+    Yields:
+        pandas DataFrames with the same schema as `extract_file`. Nothing more is
+        yielded for a file once an error has been logged for it.
+    """
+    try:
+        dtype = input_schema(compact)
+        bad_lines = [] if reject_dir is not None else None
+        chunks = read_csv_chunks(
+            file_path,
+            dtype,
+            chunksize,
+            engine=engine,
+            encoding=encoding,
+            bad_lines=bad_lines,
+        )
+        columns = list(dtype)
+        bytes_read = os.path.getsize(file_path)
+        while True:
+            # time each chunk's parse, which happens when the reader is advanced
+            with stage("extract_file", file=Path(file_path).stem) as extract_stage:
+                chunk = next(chunks, None)
+                extract_stage.rows_out = None if chunk is None else len(chunk)
+                extract_stage.bytes_read, bytes_read = bytes_read, 0
+            if chunk is not None:
+                columns = list(chunk.columns)
+            if reject_dir is not None:
+                write_bad_lines(bad_lines, columns, Path(file_path).stem, reject_dir)
+                bad_lines.clear()
+            if chunk is None:
+                break
+            yield chunk
+    except Exception as e:
+        logging.error(
+            f"Error while extracting data from {file_path}: {e}", exc_info=True
+        )
+        if failed_files is not None:
+            failed_files.append(file_path)
+
+
+def extract_all_files_chunked(
+    files: List[Path],
+    chunksize: int,
+    compact: bool = False,
+    engine: str = "pandas",
+    encoding: str = LEGACY_ENCODING,
+    failed_files: Optional[List[Path]] = None,
+    reject_dir: Optional[str] = None,
+) -> Iterator[pd.DataFrame]:
+    """Extract data from multiple CSV files as a stream of bounded-size chunks.
+
+    Args:
+        files: A list of Path objects representing the CSV files to extract data from.
+        chunksize: The maximum number of rows per chunk.
+        compact: Read the text columns into the compact representation, see
+            `input_schema`.
+        engine: The CSV reader backend, "pandas" or "pyarrow", see `readers.read_csv`.
+        encoding: The encoding the file is decoded with, or "auto" to detect it
+            per file, see `readers.detect_encoding`.
+        failed_files: If given, the files that could not be read to their end are
+            appended to this list.
+        reject_dir: If given, the lines skipped by the CSV reader are written to
+            this folder, see `extract_file`.
+
+    Yields:
+        pandas DataFrames of at most `chunksize` rows, each tagged with a `file` column.
+    """
+    for f in files:
+        chunks = extract_file_chunks(
+            f,
+            chunksize,
+            compact=compact,
+            engine=engine,
+            encoding=encoding,
+            failed_files=failed_files,
+            reject_dir=reject_dir,
+        )
+        for chunk in chunks:
+            chunk["file"] = f.stem
+            yield chunk.reset_index(drop=True)
+
+
+def row_fingerprints(input_df: pd.DataFrame) -> np.ndarray:
+    """Hash the business columns of every row into a 64-bit fingerprint.
+
+    The hash covers the columns of INPUT_SCHEMA present in the frame, in schema
+    order, so the same row gets the same fingerprint whichever file or run it
+    arrives in.
+
+    Args:
+        input_df: A pandas DataFrame representing the extracted data.
+
+    Returns:
+        A uint64 numpy array with one fingerprint per row.
+    """
+    fingerprint_columns = [c for c in INPUT_SCHEMA if c in input_df.columns]
+    return pd.util.hash_pandas_object(
+        input_df[fingerprint_columns], index=False
+    ).to_numpy()
+
+
+def parse_dates(
+    values: pd.Series, formats: List[str], errors: str = "report"
+) -> pd.Series:
+    """Parse date strings with explicit formats, parsing each distinct string once.
+
+    A batch holds few distinct dates across many rows, so the distinct strings are
+    factorized out, parsed with each format in turn until one matches, and mapped
+    back to the rows by their codes. Nothing is inferred, so a value matching none
+    of the formats is never guessed, and dd/mm is never swapped with mm/dd.
+
+    Args:
+        values: A pandas Series of date strings.
+        formats: The strftime formats to try, in order.
+        errors: "report" to log the values matching no format and leave them NaT,
+            "raise" to raise a ValueError for them, "coerce" to leave them NaT
+            silently.
+
+    Returns:
+        A datetime64 pandas Series with the same index as `values`.
+    """
+    codes, uniques = pd.factorize(values)
+    parsed = pd.Series(pd.NaT, index=range(len(uniques)), dtype="datetime64[ns]")
+    for date_format in formats:
+        unparsed = parsed.isna().to_numpy()
+        if not unparsed.any():
+            break
+        parsed[unparsed] = pd.to_datetime(
+            pd.Series(uniques[unparsed]).astype(str), format=date_format, errors="coerce"
+        ).to_numpy()
+
+    malformed = uniques[parsed.isna().to_numpy()]
+    if len(malformed) > 0 and errors != "coerce":
+        malformed_rows = int(np.isin(codes, np.flatnonzero(parsed.isna())).sum())
+        message = (
+            f"{malformed_rows} rows of {values.name} match none of the formats "
+            f"{formats}, e.g. {list(malformed[:5])}"
+        )
+        if errors == "raise":
+            raise ValueError(message)
+        logging.warning(message)
+
+    # code -1 marks missing values, which pick up the NaT appended at the end
+    lookup = np.append(parsed.to_numpy(), np.datetime64("NaT", "ns"))
+    return pd.Series(lookup[codes], index=values.index, name=values.name)
+
+
+def current_load_date() -> pd.Timestamp:
+    """Return the current date and time in UTC as a pandas Timestamp."""
+    # imported here, as only the loads stamping their rows need pendulum
+    import pendulum
+
+    return pd.to_datetime(pendulum.now(tz="UTC").to_iso8601_string())
+
+
+@instrument
+def transform_data(
+    input_df: pd.DataFrame,
+    record_id_start: int = 0,
+    load_date: Optional[pd.Timestamp] = None,
+    date_formats: Optional[List[str]] = None,
+) -> pd.DataFrame:
     """Transform the input DataFrame by adding columns and modifying data.
 
+    Rows whose PaymentDate matches none of the date formats are dropped with a
+    logged count, while a missing PaymentDate is kept as NaT.
+
     Args:
         input_df: A pandas DataFrame representing the input data.
+        record_id_start: The first RecordId to assign, so that chunks of one run
+            get consecutive, non-overlapping ids.
+        load_date: The LoadDate to stamp on every row. Defaults to the current time.
+        date_formats: The formats PaymentDate is parsed with, see `parse_dates`.
+            Defaults to PAYMENT_DATE_FORMATS.
 
     Returns:
-        A pandas DataFrame with the transformed data.
+        A pandas DataFrame with the transformed data, with a fresh index if rows
+        were dropped.
     """
+    # fingerprint the business columns before they are modified
+    row_fingerprint = row_fingerprints(input_df)
+
     # add a new column 'LoadDate' with the current date and time in UTC
-    input_df["LoadDate"] = pd.to_datetime(pendulum.now(tz="UTC").to_iso8601_string())
+    if load_date is None:
+        load_date = current_load_date()
+    input_df["LoadDate"] = load_date
 
     # add a new column 'RecordId' with unique ID for each row
-    input_df["RecordId"] = np.arange(len(input_df))
+    input_df["RecordId"] = np.arange(record_id_start, record_id_start + len(input_df))
 
     # convert 'PaymentDate' column to datetime datatype
-    input_df["PaymentDate"] = pd.to_datetime(input_df["PaymentDate"])
+    formats = date_formats or PAYMENT_DATE_FORMATS
+    payment_dates = parse_dates(input_df["PaymentDate"], formats, errors="coerce")
+    malformed = (payment_dates.isna() & input_df["PaymentDate"].notna()).to_numpy()
+    malformed_dates = list(pd.unique(input_df["PaymentDate"][malformed])[:5])
+    input_df["PaymentDate"] = payment_dates
 
     # convert 'ClientName' column to lowercase
     input_df["ClientName"] = input_df["ClientName"].str.lower()
 
+    # add a new column 'RowFingerprint' identifying the row's business content
+    input_df["RowFingerprint"] = row_fingerprint
+
+    # drop the rows whose PaymentDate is malformed rather than load them undated
+    if malformed.any():
+        logging.warning(
+            f"Dropped {int(malformed.sum())} rows whose PaymentDate matches none of the "
+            f"formats {formats}, e.g. {malformed_dates}"
+        )
+        input_df = input_df[~malformed].reset_index(drop=True)
+
     # return the transformed DataFrame
     return input_df
 
 
+def extract_and_transform_file(
+    file_path: Path,
+    load_date: pd.Timestamp,
+    compact: bool = False,
+    date_formats: Optional[List[str]] = None,
+    engine: str = "pandas",
+    encoding: str = LEGACY_ENCODING,
+    cache: Optional[ParsedFileCache] = None,
+    validation_rules: Optional[List[Rule]] = None,
+    reject_dir: Optional[str] = None,
+) -> Optional[pd.DataFrame]:
+    """Extract, validate and transform a single CSV file.
+
+    This is the unit of work run by the worker processes of
+    `extract_transform_files_parallel`.
+
+    Args:
+        file_path: A Path object representing the file path.
+        load_date: The LoadDate to stamp on every row.
+        compact: Read the text columns into the compact representation, see
+            `input_schema`.
+        date_formats: The formats PaymentDate is parsed with, see `parse_dates`.
+        engine: The CSV reader backend, "pandas" or "pyarrow", see `readers.read_csv`.
+        encoding: The encoding the file is decoded with, or "auto" to detect it
+            per file, see `readers.detect_encoding`.
+        cache: If given, the file is read from and stored in this parsed-file
+            cache, see `extract_file`.
+        validation_rules: If given, rows failing these rules are dropped before
+            the transform, see `validation.validate_rows`.
+        reject_dir: The folder the rejected rows, and the lines skipped by the CSV
+            reader, are written to.
+
+    Returns:
+        A pandas DataFrame with the transformed data, or None if there was an error.
+    """
+    data = extract_file(
+        file_path,
+        compact=compact,
+        engine=engine,
+        encoding=encoding,
+        cache=cache,
+        reject_dir=reject_dir,
+    )
+    if data is None:
+        return None
+    data["file"] = Path(file_path).stem
+    if validation_rules is not None:
+        data = validate_rows(data, validation_rules, reject_dir)
+    return transform_data(data, load_date=load_date, date_formats=date_formats)
+
+
+@instrument
+def extract_transform_files_parallel(
+    files: List[Path],
+    workers: Optional[int] = None,
+    compact: bool = False,
+    date_formats: Optional[List[str]] = None,
+    engine: str = "pandas",
+    encoding: str = LEGACY_ENCODING,
+    cache: Optional[ParsedFileCache] = None,
+    validation_rules: Optional[List[Rule]] = None,
+    reject_dir: Optional[str] = None,
+    failed_files: Optional[List[Path]] = None,
+) -> pd.DataFrame:
+    """Extract and transform multiple CSV files across a pool of worker processes.
+
+    Results are concatenated in the order of `files`, whatever order the workers
+    finish in, and RecordIds are renumbered afterwards so they are unique across
+    the whole batch. All rows share one LoadDate.
+
+    Args:
+        files: A list of Path objects representing the CSV files to extract data from.
+        workers: The number of worker processes. Defaults to the number of CPUs.
+        compact: Read the text columns into the compact representation, see
+            `input_schema`.
+        date_formats: The formats PaymentDate is parsed with, see `parse_dates`.
+        engine: The CSV reader backend, "pandas" or "pyarrow", see `readers.read_csv`.
+        encoding: The encoding the file is decoded with, or "auto" to detect it
+            per file, see `readers.detect_encoding`.
+        cache: If given, files are read from and stored in this parsed-file
+            cache, see `extract_file`.
+        validation_rules: If given, rows failing these rules are dropped in the
+            workers before the transform, see `validation.validate_rows`.
+        reject_dir: The folder the rejected rows, and the lines skipped by the CSV
+            reader, are written to.
+        failed_files: If given, the files that could not be extracted are
+            appended to this list.
+
+    Returns:
+        A pandas DataFrame containing the transformed data from all the files, or None if no data was extracted.
+    """
+    load_date = current_load_date()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            extract_and_transform_file,
+            files,
+            repeat(load_date),
+            repeat(compact),
+            repeat(date_formats),
+            repeat(engine),
+            repeat(encoding),
+            repeat(cache),
+            repeat(validation_rules),
+            repeat(reject_dir),
+        )
+        dfs = []
+        for f, df in zip(files, results):
+            if df is not None:
+                dfs.append(df)
+            elif failed_files is not None:
+                failed_files.append(f)
+
+    if len(dfs) == 0:
+        logging.warning("No data extracted from CSV files")
+        return None
+
+    df = concat_frames(dfs)
+    df["RecordId"] = np.arange(len(df))
+    return df
+
+
+@instrument
 def create_dimension_client(input_df: pd.DataFrame) -> pd.DataFrame:
     """Create a dimension table for clients from the input data.
 
@@ -158,6 +591,7 @@ def create_dimension_client(input_df: pd.DataFrame) -> pd.DataFrame:
     return dim_client_df
 
 
+@instrument
 def create_dimension_payment(input_df: pd.DataFrame) -> pd.DataFrame:
     """Create a dimension table for payment from the input data.
 
@@ -188,6 +622,7 @@ def create_dimension_payment(input_df: pd.DataFrame) -> pd.DataFrame:
     return dim_payment_df
 
 
+@instrument
 def create_dimension_product(input_df: pd.DataFrame) -> pd.DataFrame:
     """Create a dimension table for products from the input data.
 
@@ -211,17 +646,25 @@ def create_dimension_product(input_df: pd.DataFrame) -> pd.DataFrame:
     return dim_product_df
 
 
-def create_fact_orders(database: str, input_df: pd.DataFrame) -> pd.DataFrame:
+@instrument
+def create_fact_orders(
+    database: str, input_df: pd.DataFrame, conn: Optional[sqlite3.Connection] = None
+) -> pd.DataFrame:
     """Create a fact table for orders by joining the input data with dimension tables.
 
     Args:
+        database: A string representing the path to the SQLite database.
         input_df: A pandas DataFrame representing the input data.
+        conn: An open connection to read the dimension keys through, e.g. from a
+            LoadSession, so that uncommitted dimension rows are visible.
 
     Returns:
         A pandas DataFrame representing the fact table for orders.
     """
-    # connect to SQLite database
-    conn = sqlite3.connect(database)
+    # connect to SQLite database unless a connection was given
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(database)
 
     # query dimension tables for client, product, and payment keys
     dim_clients_query = """SELECT * FROM dim_clients"""
@@ -277,34 +720,222 @@ def create_fact_orders(database: str, input_df: pd.DataFrame) -> pd.DataFrame:
 
     # print the shape of the resulting DataFrame
     print(fact_orders_df.shape)
-    
-    conn.close()
+
+    if own_conn:
+        conn.close()
 
     return fact_orders_df
 
 
-def move_processed_files(
-    src: str = r"C:\Users\Anthony\Documents\GitHub\allicabank\data\unprocessed",
-    dest: str = r"C:\Users\Anthony\Documents\GitHub\allicabank\data\processed",
-) -> None:
-    """Move processed files from the source folder to the destination folder.
+class StarBatch(NamedTuple):
+    """The dimension and fact frames of one batch, built by `build_star_schema`.
+
+    Row `i` of each dimension frame holds the natural key with code `i`, and the
+    fact frame refers to them through its client_code, product_code and
+    payment_code columns.
+    """
+
+    dim_client: pd.DataFrame
+    dim_payment: pd.DataFrame
+    dim_product: pd.DataFrame
+    fact_orders: pd.DataFrame
+
+
+def _first_occurrences(codes: np.ndarray) -> np.ndarray:
+    # factorize numbers codes in order of first appearance, so a code appears for
+    # the first time exactly where it exceeds every code before it
+    running_max = np.maximum.accumulate(codes)
+    previous_max = np.concatenate(([-1], running_max[:-1]))
+    return np.flatnonzero(codes > previous_max)
+
+
+def _last_occurrences(codes: np.ndarray, n_codes: int) -> np.ndarray:
+    last = np.full(n_codes, -1)
+    valid = codes >= 0
+    np.maximum.at(last, codes[valid], np.flatnonzero(valid))
+    return last
+
+
+@instrument
+def build_star_schema(input_df: pd.DataFrame) -> StarBatch:
+    """Build the client, payment and product dimensions and the fact frame in one pass.
+
+    Each dimension's natural key (ClientName, PaymentBillingCode, ProductName) is
+    factorized once, and the dimension rows and the fact table's foreign keys are
+    both taken from those integer codes. This replaces the per-dimension column
+    copies and drop_duplicates of the create_dimension_* functions and the full
+    frame merges of `create_fact_orders`.
+
+    Each dimension gets one row per natural key, matching what the ON CONFLICT
+    clauses of the loads keep: the first payment row for a billing code, and for
+    clients and products the first row with the last delivery address or product
+    type seen in the batch. Rows with a missing natural key are left out.
 
     Args:
-        src: A string representing the path to the source folder.
-        dest: A string representing the path to the destination folder.
+        input_df: A pandas DataFrame returned by `transform_data`.
 
     Returns:
-        None.
+        A StarBatch whose fact frame still needs its codes resolved to dimension
+        keys by `create_fact_orders_from_star`.
     """
-    try:
-        # loop over files in the source folder
-        for item in os.listdir(src):
-            print(f"Moving {item}...")
-            # move each file to the destination folder
-            shutil.move(os.path.join(src, item), os.path.join(dest, item))
-    except OSError as e:
-        print(f"Error while moving files: {e}")
-    except Exception as e:
-        print(f"Unknown error: {e}")
-    else:
-        print("All files moved successfully.")
+    client_codes, client_names = pd.factorize(input_df["ClientName"])
+    product_codes, product_names = pd.factorize(input_df["ProductName"])
+    payment_codes, billing_codes = pd.factorize(input_df["PaymentBillingCode"])
+
+    # client dimension: first row per client, with the last delivery address
+    dim_client_df = input_df.iloc[_first_occurrences(client_codes)][
+        [
+            "RecordId",
+            "OrderNumber",
+            "ClientName",
+            "DeliveryAddress",
+            "DeliveryCity",
+            "DeliveryPostcode",
+            "DeliveryCountry",
+            "DeliveryContactNumber",
+        ]
+    ].reset_index(drop=True)
+    last_client_rows = _last_occurrences(client_codes, len(client_names))
+    dim_client_df["DeliveryAddress"] = input_df["DeliveryAddress"].to_numpy()[
+        last_client_rows
+    ]
+
+    # payment dimension: first row per billing code
+    dim_payment_df = input_df.iloc[_first_occurrences(payment_codes)][
+        [
+            "RecordId",
+            "OrderNumber",
+            "PaymentType",
+            "PaymentBillingCode",
+            "PaymentDate",
+            "Currency",
+        ]
+    ].reset_index(drop=True)
+    dim_payment_df["PaymentDate"] = dim_payment_df["PaymentDate"].astype(str)
+
+    # product dimension: first row per product, with the last product type
+    dim_product_df = input_df.iloc[_first_occurrences(product_codes)][
+        ["RecordId", "OrderNumber", "ProductName", "ProductType"]
+    ].reset_index(drop=True)
+    last_product_rows = _last_occurrences(product_codes, len(product_names))
+    dim_product_df["ProductType"] = input_df["ProductType"].to_numpy()[
+        last_product_rows
+    ]
+
+    # fact frame keyed by the dimension codes
+    fact_orders_df = pd.DataFrame(
+        {
+            "RecordId": input_df["RecordId"].to_numpy(),
+            "OrderNumber": input_df["OrderNumber"].to_numpy(),
+            "client_code": client_codes,
+            "product_code": product_codes,
+            "payment_code": payment_codes,
+            "UnitPrice": input_df["UnitPrice"].to_numpy(),
+            "ProductQuantity": input_df["ProductQuantity"].to_numpy(),
+            "TotalPrice": input_df["TotalPrice"].to_numpy(),
+        }
+    )
+    has_keys = (client_codes >= 0) & (product_codes >= 0) & (payment_codes >= 0)
+    fact_orders_df = fact_orders_df[has_keys].drop_duplicates(
+        ["OrderNumber", "UnitPrice", "ProductQuantity", "TotalPrice"]
+    )
+
+    return StarBatch(dim_client_df, dim_payment_df, dim_product_df, fact_orders_df)
+
+
+def _lookup_dimension_keys(
+    conn: sqlite3.Connection,
+    table: str,
+    name_column: str,
+    key_column: str,
+    names: pd.Series,
+) -> np.ndarray:
+    # look up the keys of this batch's natural keys only, through the unique index
+    conn.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS star_natural_keys (code INTEGER PRIMARY KEY, name VARCHAR(255))"
+    )
+    conn.execute("DELETE FROM star_natural_keys")
+    conn.executemany(
+        "INSERT INTO star_natural_keys (code, name) VALUES (?, ?)",
+        enumerate(names.tolist()),
+    )
+    rows = conn.execute(
+        f"""
+        SELECT t.code, d.{key_column}
+        FROM star_natural_keys t
+        JOIN {table} d ON d.{name_column} = t.name
+        """
+    ).fetchall()
+    conn.execute("DELETE FROM star_natural_keys")
+
+    keys = np.full(len(names), -1, dtype=np.int64)
+    if rows:
+        codes, found_keys = zip(*rows)
+        keys[list(codes)] = found_keys
+    return keys
+
+
+@instrument
+def create_fact_orders_from_star(
+    database: str, star: StarBatch, conn: Optional[sqlite3.Connection] = None
+) -> pd.DataFrame:
+    """Resolve the dimension codes of a StarBatch's fact frame to dimension keys.
+
+    Only the natural keys of the batch are looked up, so the cost does not grow
+    with the size of the dimension tables. Load the StarBatch's dimensions first.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        star: A StarBatch returned by `build_star_schema`.
+        conn: An open connection to read the dimension keys through, e.g. from a
+            LoadSession, so that uncommitted dimension rows are visible.
+
+    Returns:
+        A pandas DataFrame representing the fact table for orders, with the same
+        columns as `create_fact_orders`.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(database)
+
+    client_keys = _lookup_dimension_keys(
+        conn, "dim_clients", "client_name", "client_key", star.dim_client["ClientName"]
+    )
+    product_keys = _lookup_dimension_keys(
+        conn, "dim_products", "product_name", "product_key", star.dim_product["ProductName"]
+    )
+    payment_keys = _lookup_dimension_keys(
+        conn,
+        "dim_payment",
+        "payment_billing_code",
+        "payment_key",
+        star.dim_payment["PaymentBillingCode"],
+    )
+
+    if own_conn:
+        conn.close()
+
+    fact = star.fact_orders
+    fact_orders_df = pd.DataFrame(
+        {
+            "RecordId": fact["RecordId"].to_numpy(),
+            "OrderNumber": fact["OrderNumber"].to_numpy(),
+            "client_key": client_keys[fact["client_code"].to_numpy()],
+            "product_key": product_keys[fact["product_code"].to_numpy()],
+            "payment_key": payment_keys[fact["payment_code"].to_numpy()],
+            "UnitPrice": fact["UnitPrice"].to_numpy(),
+            "ProductQuantity": fact["ProductQuantity"].to_numpy(),
+            "TotalPrice": fact["TotalPrice"].to_numpy(),
+        }
+    )
+
+    # keep the inner join semantics of create_fact_orders
+    has_keys = (
+        (fact_orders_df["client_key"] >= 0)
+        & (fact_orders_df["product_key"] >= 0)
+        & (fact_orders_df["payment_key"] >= 0)
+    )
+    fact_orders_df = fact_orders_df[has_keys]
+    logging.info(f"Built {len(fact_orders_df)} fact rows from the star batch")
+
+    return fact_orders_df
@@ -0,0 +1,76 @@
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import List, Optional
+
+from .archive import FileArchive, archive_processed_files
+from .manifest import filter_unprocessed_files
+from .metrics import instrument
+
+
+def get_csv_files_for_processing(
+    folder_path: str, database: Optional[str] = None
+) -> List[Path]:
+    """Get a list of CSV files in a folder.
+
+    Args:
+        folder_path: A string representing the folder path.
+        database: If given, the path to the SQLite database whose file manifest is
+            consulted to leave out files that were already loaded, including
+            redelivered copies under another name.
+
+    Returns:
+        A list of Path objects representing the CSV files in the folder, sorted by name.
+
+    Raises:
+        sqlite3.Error: If the manifest cannot be read. This is not reported as an
+            empty folder, which would let the caller move the files away unloaded.
+    """
+    try:
+        files = sorted(Path(folder_path).glob("*.csv"))
+    except OSError as e:
+        logging.error(f"Error while getting CSV files: {e}", exc_info=True)
+        return []
+    if database is not None:
+        files = filter_unprocessed_files(database, files)
+    return files
+
+
+@instrument
+def move_processed_files(
+    src: str,
+    dest: str,
+    files: Optional[List[Path]] = None,
+    archive: Optional[FileArchive] = None,
+) -> None:
+    """Move processed files from the source folder to the destination folder.
+
+    Args:
+        src: A string representing the path to the source folder.
+        dest: A string representing the path to the destination folder.
+        files: If given, only these files of the source folder are moved, e.g. the
+            files of one micro-batch while others are still arriving.
+        archive: If given, the files are compressed into this FileArchive instead
+            of being moved to `dest`, see `archive.archive_processed_files`.
+
+    Returns:
+        None.
+    """
+    if archive is not None:
+        archive_processed_files(src, archive, files=files)
+        return
+
+    try:
+        items = os.listdir(src) if files is None else [Path(f).name for f in files]
+        # loop over files in the source folder
+        for item in items:
+            print(f"Moving {item}...")
+            # move each file to the destination folder
+            shutil.move(os.path.join(src, item), os.path.join(dest, item))
+    except OSError as e:
+        print(f"Error while moving files: {e}")
+    except Exception as e:
+        print(f"Unknown error: {e}")
+    else:
+        print("All files moved successfully.")
@@ -0,0 +1,194 @@
+import logging
+import math
+import os
+import sqlite3
+from typing import Optional
+
+import numpy as np
+
+# stay below the default SQLITE_MAX_VARIABLE_NUMBER of older SQLite builds
+SQLITE_MAX_VARIABLES = 900
+
+FETCH_SIZE = 1_000_000
+
+
+class BloomFilter:
+    """A bloom filter over 64-bit row fingerprints, with vectorized adds and lookups.
+
+    The fingerprints are already uniformly distributed hashes, so the bit positions
+    are derived from their two 32-bit halves by double hashing instead of hashing
+    them again.
+
+    Args:
+        num_bits: The size of the bit array.
+        num_hashes: The number of bit positions per fingerprint.
+    """
+
+    def __init__(self, num_bits: int, num_hashes: int) -> None:
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = np.zeros((num_bits + 7) // 8, dtype=np.uint8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> "BloomFilter":
+        """Create a filter sized for `capacity` fingerprints at the given false positive rate."""
+        capacity = max(capacity, 1)
+        num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, fingerprints: np.ndarray) -> np.ndarray:
+        fingerprints = fingerprints.astype(np.uint64, copy=False)
+        h1 = fingerprints & np.uint64(0xFFFFFFFF)
+        h2 = (fingerprints >> np.uint64(32)) | np.uint64(1)
+        i = np.arange(self.num_hashes, dtype=np.uint64)[:, None]
+        return (h1 + i * h2) % np.uint64(self.num_bits)
+
+    def add(self, fingerprints: np.ndarray) -> None:
+        """Add an array of fingerprints to the filter."""
+        positions = self._positions(fingerprints).ravel()
+        masks = np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), masks)
+
+    def might_contain(self, fingerprints: np.ndarray) -> np.ndarray:
+        """Return a boolean array, False where a fingerprint was certainly never added."""
+        positions = self._positions(fingerprints)
+        masks = np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        return ((self.bits[positions >> np.uint64(3)] & masks) != 0).all(axis=0)
+
+
+class FingerprintIndex:
+    """Persistent index of the row fingerprints loaded by earlier runs.
+
+    Fingerprints are stored in the row_fingerprints table, whose primary key is the
+    fingerprint itself. An in-memory bloom filter, saved next to the database
+    between runs, answers most lookups for new rows without touching SQLite; only
+    the fingerprints it reports as possibly seen are confirmed against the table.
+    The bloom file records the row_fingerprint_state generation it was built for
+    and is rebuilt from the table when it is stale or full.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        bloom_path: The path of the saved bloom filter. Defaults to the database
+            path with a ".bloom.npz" suffix.
+        capacity: The number of fingerprints the bloom filter is sized for at first.
+            It is rebuilt at twice the current count when it outgrows this.
+        error_rate: The bloom filter's target false positive rate.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        bloom_path: Optional[str] = None,
+        capacity: int = 10_000_000,
+        error_rate: float = 0.01,
+    ) -> None:
+        self.database = database
+        self.bloom_path = bloom_path or f"{database}.bloom.npz"
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bloom = None
+
+    def _state(self, conn: sqlite3.Connection):
+        return conn.execute(
+            "SELECT generation, row_count FROM row_fingerprint_state WHERE id = 1"
+        ).fetchone()
+
+    def _load_bloom(self, conn: sqlite3.Connection) -> None:
+        generation, row_count = self._state(conn)
+        if os.path.exists(self.bloom_path):
+            saved = np.load(self.bloom_path)
+            num_bits, num_hashes, saved_generation, capacity = saved["meta"].tolist()
+            if saved_generation == generation and row_count <= capacity:
+                self.bloom = BloomFilter(num_bits, num_hashes)
+                self.bloom.bits = saved["bits"]
+                self.capacity = capacity
+                return
+
+        # the saved filter is missing, stale or full, rebuild it from the table
+        self.capacity = max(self.capacity, 2 * row_count)
+        logging.info(f"Rebuilding the row fingerprint bloom filter ({row_count} rows)")
+        self.bloom = BloomFilter.for_capacity(self.capacity, self.error_rate)
+        cur = conn.execute("SELECT fingerprint FROM row_fingerprints")
+        while True:
+            rows = cur.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            self.bloom.add(np.array(rows, dtype=np.int64).ravel().view(np.uint64))
+
+    def _loaded(self, fingerprints: np.ndarray, conn: sqlite3.Connection) -> np.ndarray:
+        # confirm the bloom filter's positives against the primary key
+        signed = fingerprints.view(np.int64).tolist()
+        loaded = set()
+        for start in range(0, len(signed), SQLITE_MAX_VARIABLES):
+            batch = signed[start : start + SQLITE_MAX_VARIABLES]
+            placeholders = ", ".join("?" * len(batch))
+            loaded.update(
+                row[0]
+                for row in conn.execute(
+                    f"SELECT fingerprint FROM row_fingerprints WHERE fingerprint IN ({placeholders})",
+                    batch,
+                )
+            )
+        return np.isin(fingerprints.view(np.int64), np.fromiter(loaded, dtype=np.int64, count=len(loaded)))
+
+    def new_rows_mask(self, fingerprints: np.ndarray, conn: sqlite3.Connection) -> np.ndarray:
+        """Return a boolean mask of the rows that were not loaded before.
+
+        Rows whose fingerprint is already in the index are masked out, and so are
+        repeats of a fingerprint within `fingerprints` after its first occurrence.
+
+        Args:
+            fingerprints: The RowFingerprint values of a batch, as uint64.
+            conn: An open connection to the database.
+
+        Returns:
+            A boolean numpy array, True for the rows to keep.
+        """
+        if self.bloom is None:
+            self._load_bloom(conn)
+
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        _, first_index = np.unique(fingerprints, return_index=True)
+        mask = np.zeros(len(fingerprints), dtype=bool)
+        mask[first_index] = True
+
+        maybe_seen = mask & self.bloom.might_contain(fingerprints)
+        if maybe_seen.any():
+            maybe_seen_index = np.flatnonzero(maybe_seen)
+            mask[maybe_seen_index[self._loaded(fingerprints[maybe_seen_index], conn)]] = False
+        return mask
+
+    def add(self, fingerprints: np.ndarray, conn: sqlite3.Connection) -> None:
+        """Add the fingerprints of a loaded batch to the index.
+
+        Call with the LoadSession connection, so the fingerprints are committed in
+        the same transaction as the rows they describe.
+        """
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        if self.bloom is None:
+            self._load_bloom(conn)
+
+        inserted = conn.executemany(
+            "INSERT OR IGNORE INTO row_fingerprints (fingerprint) VALUES (?)",
+            ((fp,) for fp in fingerprints.view(np.int64).tolist()),
+        ).rowcount
+        conn.execute(
+            "UPDATE row_fingerprint_state SET generation = generation + 1, row_count = row_count + ? WHERE id = 1",
+            (inserted,),
+        )
+        self.bloom.add(fingerprints)
+
+    def save(self, conn: sqlite3.Connection) -> None:
+        """Save the bloom filter for the next run. Call after the load has committed."""
+        if self.bloom is None:
+            return
+        generation, _ = self._state(conn)
+        meta = np.array(
+            [self.bloom.num_bits, self.bloom.num_hashes, generation, self.capacity],
+            dtype=np.int64,
+        )
+        # write to a temporary file first so a crash never leaves a truncated filter
+        tmp_path = f"{self.bloom_path}.tmp.npz"
+        np.savez(tmp_path, bits=self.bloom.bits, meta=meta)
+        os.replace(tmp_path, self.bloom_path)
@@ -0,0 +1,163 @@
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Set
+
+from .db_helper import connection_for
+from .manifest import hash_file
+
+# load run statuses; runs that are not completed are resumed by the next checkpointed run
+RUN_RUNNING = "running"
+RUN_COMPLETED = "completed"
+RUN_FAILED = "failed"
+
+# journal stages: a chunk's dimensions and facts were committed, or all chunks of a file
+# were and the file was recorded in the manifest
+STAGE_CHUNK = "chunk"
+STAGE_FILE = "file"
+
+
+class RunCheckpoint(NamedTuple):
+    """Where a load run stands, as recorded in its journal.
+
+    Args:
+        run_id: The id of the run in load_runs.
+        chunks: The number of chunks committed per file, keyed by content hash.
+        rows: The number of rows committed per file, keyed by content hash.
+        files: The content hashes of the files whose chunks were all committed.
+    """
+
+    run_id: int
+    chunks: Dict[str, int]
+    rows: Dict[str, int]
+    files: Set[str]
+
+
+def incomplete_run(
+    database: str, chunksize: Optional[int] = None, conn: Optional[sqlite3.Connection] = None
+) -> Optional[int]:
+    """Return the id of the latest run that did not complete, None if there is none.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        chunksize: If given, only consider runs with this chunk size, as chunk
+            checkpoints cannot be resumed with another one.
+        conn: An open connection to read through.
+    """
+    with connection_for(database, conn) as journal_conn:
+        has_journal = journal_conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'load_runs'"
+        ).fetchone()
+        if not has_journal:
+            return None
+        row = journal_conn.execute(
+            """
+            SELECT run_id FROM load_runs
+            WHERE status != ? AND (? IS NULL OR chunksize = ?)
+            ORDER BY run_id DESC LIMIT 1
+            """,
+            (RUN_COMPLETED, chunksize, chunksize),
+        ).fetchone()
+    return None if row is None else row[0]
+
+
+def start_run(
+    database: str,
+    chunksize: int,
+    resume: bool = True,
+    conn: Optional[sqlite3.Connection] = None,
+) -> RunCheckpoint:
+    """Start a new load run, or resume the latest incomplete one.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        chunksize: The maximum number of rows per chunk of the run.
+        resume: Resume the latest incomplete run with the same chunk size, if any.
+        conn: An open connection to write through, e.g. from a LoadSession.
+
+    Returns:
+        The RunCheckpoint of the run, empty for a new run.
+    """
+    with connection_for(database, conn) as journal_conn:
+        run_id = incomplete_run(database, chunksize, conn=journal_conn) if resume else None
+        if run_id is None:
+            run_id = journal_conn.execute(
+                "INSERT INTO load_runs (status, chunksize) VALUES (?, ?)",
+                (RUN_RUNNING, chunksize),
+            ).lastrowid
+            logging.info(f"Started load run {run_id}")
+            return RunCheckpoint(run_id, {}, {}, set())
+
+        journal_conn.execute(
+            "UPDATE load_runs SET status = ?, finished_at = NULL WHERE run_id = ?",
+            (RUN_RUNNING, run_id),
+        )
+        chunks, rows = {}, {}
+        for content_hash, chunk_count, row_count in journal_conn.execute(
+            """
+            SELECT content_hash, COUNT(*), SUM(row_count) FROM run_journal
+            WHERE run_id = ? AND stage = ?
+            GROUP BY content_hash
+            """,
+            (run_id, STAGE_CHUNK),
+        ):
+            chunks[content_hash] = chunk_count
+            rows[content_hash] = row_count
+        files = {
+            content_hash
+            for (content_hash,) in journal_conn.execute(
+                "SELECT content_hash FROM run_journal WHERE run_id = ? AND stage = ?",
+                (run_id, STAGE_FILE),
+            )
+        }
+    logging.info(
+        f"Resuming load run {run_id}: {len(files)} files and "
+        f"{sum(chunks.values())} chunks already committed"
+    )
+    return RunCheckpoint(run_id, chunks, rows, files)
+
+
+def record_checkpoint(
+    database: str,
+    run_id: int,
+    file_path: Path,
+    stage: str,
+    chunk_number: int,
+    row_count: int,
+    conn: Optional[sqlite3.Connection] = None,
+) -> None:
+    """Record that a chunk or a whole file of a run was committed.
+
+    Pass the LoadSession connection, so the checkpoint is committed in the same
+    transaction as the data it stands for.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        run_id: The id of the run.
+        file_path: A Path object representing the source file.
+        stage: STAGE_CHUNK or STAGE_FILE.
+        chunk_number: The number of the chunk within its file, or the number of
+            chunks of the file for STAGE_FILE.
+        row_count: The number of rows of the chunk or file.
+        conn: An open connection to write through, e.g. from a LoadSession.
+    """
+    with connection_for(database, conn) as journal_conn:
+        journal_conn.execute(
+            """
+            INSERT OR REPLACE INTO run_journal (run_id, content_hash, stage, chunk_number, file_name, row_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (run_id, hash_file(file_path), stage, chunk_number, file_path.name, row_count),
+        )
+
+
+def finish_run(
+    database: str, run_id: int, status: str, conn: Optional[sqlite3.Connection] = None
+) -> None:
+    """Set the final status of a run, RUN_COMPLETED or RUN_FAILED."""
+    with connection_for(database, conn) as journal_conn:
+        journal_conn.execute(
+            "UPDATE load_runs SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE run_id = ?",
+            (status, run_id),
+        )
+    logging.info(f"Load run {run_id} {status}")
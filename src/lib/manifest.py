@@ -0,0 +1,132 @@
+import hashlib
+import logging
+import os
+import sqlite3
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .db_helper import connection_for
+
+# manifest statuses; only files with status "loaded" are skipped on later runs
+STATUS_LOADED = "loaded"
+STATUS_FAILED = "failed"
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+@lru_cache(maxsize=4096)
+def _hash_file(path: str, size: int, mtime: float) -> str:
+    # size and mtime are part of the cache key so a rewritten file is hashed again
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_file(file_path: Path) -> str:
+    """Return the SHA-256 hex digest of a file's content.
+
+    The digest is memoized per path, size and mtime, so a file that is checked
+    against the manifest and then recorded in it is only read once.
+
+    Args:
+        file_path: A Path object representing the file path.
+
+    Returns:
+        The hex digest of the file content.
+    """
+    stat = os.stat(file_path)
+    return _hash_file(str(file_path), stat.st_size, stat.st_mtime)
+
+
+def filter_unprocessed_files(database: str, files: List[Path]) -> List[Path]:
+    """Drop the files that the manifest already records as loaded.
+
+    A file whose name, size and mtime match a loaded manifest entry is skipped
+    without being read. Other files are hashed and skipped if a file with the same
+    content was loaded before under any name, or appears earlier in `files`.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        files: A list of Path objects representing the candidate CSV files.
+
+    Returns:
+        The files that still need processing, in their original order.
+    """
+    unprocessed = []
+    seen_hashes = set()
+    with connection_for(database) as conn:
+        for f in files:
+            stat = os.stat(f)
+            known = conn.execute(
+                """
+                SELECT 1 FROM file_manifest
+                WHERE file_name = ? AND file_size = ? AND file_mtime = ? AND status = ?
+                """,
+                (f.name, stat.st_size, stat.st_mtime, STATUS_LOADED),
+            ).fetchone()
+            if known:
+                logging.info(f"Skipping {f.name}, already loaded")
+                continue
+
+            content_hash = hash_file(f)
+            loaded = conn.execute(
+                "SELECT file_name FROM file_manifest WHERE content_hash = ? AND status = ?",
+                (content_hash, STATUS_LOADED),
+            ).fetchone()
+            if loaded or content_hash in seen_hashes:
+                original = loaded[0] if loaded else "an earlier file of this batch"
+                logging.info(f"Skipping {f.name}, same content as {original}")
+                continue
+
+            seen_hashes.add(content_hash)
+            unprocessed.append(f)
+    return unprocessed
+
+
+def record_files(
+    database: str,
+    files: List[Path],
+    row_counts: Dict[str, int],
+    status: str,
+    conn: Optional[sqlite3.Connection] = None,
+) -> None:
+    """Record files in the manifest with their row counts and load status.
+
+    Pass the LoadSession connection when recording loaded files, so the manifest
+    entries are committed in the same transaction as the data.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        files: A list of Path objects representing the processed CSV files.
+        row_counts: The number of extracted rows per file, keyed by file stem.
+        status: STATUS_LOADED or STATUS_FAILED.
+        conn: An open connection to write through, e.g. from a LoadSession.
+    """
+    manifest_data = []
+    for f in files:
+        stat = os.stat(f)
+        manifest_data.append(
+            (
+                hash_file(f),
+                f.name,
+                stat.st_size,
+                stat.st_mtime,
+                row_counts.get(f.stem, 0),
+                status,
+            )
+        )
+
+    with connection_for(database, conn) as manifest_conn:
+        manifest_conn.executemany(
+            """
+            INSERT INTO file_manifest (content_hash, file_name, file_size, file_mtime, row_count, status)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(content_hash) DO UPDATE
+            SET file_name=excluded.file_name, file_size=excluded.file_size, file_mtime=excluded.file_mtime,
+                row_count=excluded.row_count, status=excluded.status, processed_at=CURRENT_TIMESTAMP
+            """,
+            manifest_data,
+        )
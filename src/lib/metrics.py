@@ -0,0 +1,303 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# the collector the instrumented functions report to; None disables recording
+_active_collector = None
+
+# the source file the current batch comes from, for stages whose arguments do not say
+_current_file: ContextVar[Optional[str]] = ContextVar("current_file", default=None)
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Return the peak resident set size of the process so far, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageMetrics(NamedTuple):
+    """The measurements of one call of an instrumented stage.
+
+    CPU time is that of the calling thread, so stages running concurrently in
+    `run_pipelined` are not charged for each other's work.
+    """
+
+    stage: str
+    file: Optional[str]
+    wall_seconds: float
+    cpu_seconds: float
+    rows_in: Optional[int]
+    rows_out: Optional[int]
+    bytes_read: Optional[int]
+    peak_rss_bytes: Optional[int]
+
+    @property
+    def rows_per_second(self) -> Optional[float]:
+        rows = self.rows_in if self.rows_in is not None else self.rows_out
+        if rows is None or self.wall_seconds <= 0:
+            return None
+        return rows / self.wall_seconds
+
+
+class MetricsCollector:
+    """Collect the metrics of the instrumented stages of a run.
+
+    Use as a context manager; while it is active, every function decorated with
+    `instrument` and every `stage` block records a StageMetrics entry. When no
+    collector is active the instrumented functions only pay for one global lookup.
+    """
+
+    def __init__(self) -> None:
+        self.records: List[StageMetrics] = []
+        self.started_at = None
+        self.wall_seconds = None
+        self._start = None
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "MetricsCollector":
+        global _active_collector
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self._previous, _active_collector = _active_collector, self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        global _active_collector
+        self.wall_seconds = time.perf_counter() - self._start
+        _active_collector = self._previous
+
+    def record(self, metrics: StageMetrics) -> None:
+        with self._lock:
+            self.records.append(metrics)
+
+    def summary(self) -> Dict[str, dict]:
+        """Aggregate the records per stage."""
+        summary = {}
+        for r in self.records:
+            s = summary.setdefault(
+                r.stage,
+                {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "rows_in": 0, "rows_out": 0, "bytes_read": 0},
+            )
+            s["calls"] += 1
+            s["wall_seconds"] += r.wall_seconds
+            s["cpu_seconds"] += r.cpu_seconds
+            s["rows_in"] += r.rows_in or 0
+            s["rows_out"] += r.rows_out or 0
+            s["bytes_read"] += r.bytes_read or 0
+        for s in summary.values():
+            rows = s["rows_in"] or s["rows_out"]
+            s["rows_per_second"] = rows / s["wall_seconds"] if s["wall_seconds"] > 0 else None
+        return summary
+
+    def report(self) -> dict:
+        """Return the run report as a JSON-serializable dict."""
+        return {
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "wall_seconds": self.wall_seconds,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "summary": self.summary(),
+            "stages": [
+                dict(r._asdict(), rows_per_second=r.rows_per_second) for r in self.records
+            ],
+        }
+
+    def write_json(self, path: str) -> None:
+        """Write the run report to a JSON file."""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_prometheus(self, path: str, prefix: str = "etl") -> None:
+        """Write the metrics per stage and file in the Prometheus text format.
+
+        The file is meant for the node_exporter textfile collector, so it is
+        written to a temporary file and renamed into place.
+        """
+        totals = {}
+        for r in self.records:
+            key = (r.stage, r.file or "")
+            t = totals.setdefault(key, [0, 0.0, 0.0, 0, 0, 0])
+            t[0] += 1
+            t[1] += r.wall_seconds
+            t[2] += r.cpu_seconds
+            t[3] += r.rows_in or 0
+            t[4] += r.rows_out or 0
+            t[5] += r.bytes_read or 0
+
+        metrics = [
+            ("stage_calls", "Number of calls of the stage"),
+            ("stage_wall_seconds", "Wall time spent in the stage"),
+            ("stage_cpu_seconds", "CPU time spent in the stage"),
+            ("stage_rows_in", "Rows passed to the stage"),
+            ("stage_rows_out", "Rows returned or loaded by the stage"),
+            ("stage_bytes_read", "Bytes of source files read by the stage"),
+        ]
+        lines = []
+        for i, (name, help_text) in enumerate(metrics):
+            lines.append(f"# HELP {prefix}_{name} {help_text}.")
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            for (stage_name, file), values in sorted(totals.items()):
+                lines.append(
+                    f'{prefix}_{name}{{stage="{_escape_label(stage_name)}",file="{_escape_label(file)}"}} {values[i]}'
+                )
+        peak = peak_rss_bytes()
+        if peak is not None:
+            lines.append(f"# HELP {prefix}_peak_rss_bytes Peak resident set size of the run.")
+            lines.append(f"# TYPE {prefix}_peak_rss_bytes gauge")
+            lines.append(f"{prefix}_peak_rss_bytes {peak}")
+        if self.wall_seconds is not None:
+            lines.append(f"# HELP {prefix}_run_wall_seconds Wall time of the run.")
+            lines.append(f"# TYPE {prefix}_run_wall_seconds gauge")
+            lines.append(f"{prefix}_run_wall_seconds {self.wall_seconds}")
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _is_frame(value) -> bool:
+    # duck-typed so the module does not need pandas
+    return hasattr(value, "columns") and hasattr(value, "shape")
+
+
+def _count_rows(value) -> Optional[int]:
+    if _is_frame(value):
+        return len(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    return None
+
+
+@contextmanager
+def file_scope(file: Optional[str]):
+    """Attribute the stages run inside the block to a source file."""
+    token = _current_file.set(file)
+    try:
+        yield
+    finally:
+        _current_file.reset(token)
+
+
+class _StageTimer:
+    def __init__(self, collector: MetricsCollector, stage: str, file: Optional[str]) -> None:
+        self.collector = collector
+        self.stage = stage
+        self.file = file
+        self.rows_in = None
+        self.rows_out = None
+        self.bytes_read = None
+
+    def __enter__(self) -> "_StageTimer":
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.collector.record(
+            StageMetrics(
+                stage=self.stage,
+                file=self.file if self.file is not None else _current_file.get(),
+                wall_seconds=time.perf_counter() - self._wall,
+                cpu_seconds=time.thread_time() - self._cpu,
+                rows_in=self.rows_in,
+                rows_out=self.rows_out,
+                bytes_read=self.bytes_read,
+                peak_rss_bytes=peak_rss_bytes(),
+            )
+        )
+
+
+class _NullStage:
+    rows_in = rows_out = bytes_read = None
+
+    def __setattr__(self, name, value) -> None:
+        # shared by every block run without a collector, so it never keeps a value
+        pass
+
+    def __enter__(self) -> "_NullStage":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name: str, file: Optional[str] = None):
+    """Time a block of code as a stage of the active collector.
+
+    The returned object's rows_in, rows_out and bytes_read can be set inside the
+    block. Without an active collector this returns a shared no-op object.
+
+    Args:
+        name: The stage name.
+        file: The source file the stage works on. Defaults to the `file_scope`.
+    """
+    collector = _active_collector
+    if collector is None:
+        return _NULL_STAGE
+    return _StageTimer(collector, name, file)
+
+
+def instrument(func=None, *, reads_file: bool = False):
+    """Decorate a pipeline function so each call is recorded as a stage.
+
+    The stage is named after the function. Rows in are the length of the first
+    DataFrame argument, rows out the length of a returned DataFrame or a returned
+    row count, and otherwise the rows in.
+
+    Args:
+        reads_file: The first argument is the path of the source file the call
+            reads; its name labels the stage and its size is recorded as bytes read.
+    """
+    if func is None:
+        return functools.partial(instrument, reads_file=reads_file)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        collector = _active_collector
+        if collector is None:
+            return func(*args, **kwargs)
+
+        timer = _StageTimer(collector, func.__name__, None)
+        if reads_file and args:
+            timer.file = Path(args[0]).stem
+            try:
+                timer.bytes_read = os.path.getsize(args[0])
+            except OSError:
+                pass
+        timer.rows_in = next(
+            (len(a) for a in list(args) + list(kwargs.values()) if _is_frame(a)),
+            None,
+        )
+        with timer:
+            result = func(*args, **kwargs)
+            rows_out = _count_rows(result)
+            timer.rows_out = rows_out if rows_out is not None else timer.rows_in
+        return result
+
+    return wrapper
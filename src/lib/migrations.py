@@ -0,0 +1,111 @@
+import logging
+import re
+import sqlite3
+from pathlib import Path
+from typing import List, Tuple
+
+# migration scripts are named like 0001_initial_schema.sql
+MIGRATION_FILE_PATTERN = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+
+def list_migrations(migrations_dir: str) -> List[Tuple[int, str, Path]]:
+    """List the migration scripts in a folder, ordered by version.
+
+    Args:
+        migrations_dir: A string representing the path to the migrations folder.
+
+    Returns:
+        A list of (version, name, path) tuples.
+    """
+    migrations = []
+    for path in Path(migrations_dir).glob("*.sql"):
+        match = MIGRATION_FILE_PATTERN.match(path.name)
+        if match is None:
+            logging.warning(f"Ignoring {path.name}, not a migration script name")
+            continue
+        migrations.append((int(match.group(1)), match.group(2), path))
+
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {migrations_dir}")
+    return migrations
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Return the latest migration version applied to the database, 0 if none."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+          version INTEGER NOT NULL PRIMARY KEY,
+          name VARCHAR(255) NOT NULL,
+          applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    version = conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()[0]
+    return version or 0
+
+
+def apply_migrations(database: str, migrations_dir: str) -> int:
+    """Apply the migration scripts that the database has not seen yet.
+
+    Each script runs in its own transaction together with the schema_migrations row
+    that records it, so a failing script leaves the database at the previous version.
+    Existing tables and data are never dropped.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        migrations_dir: A string representing the path to the migrations folder.
+
+    Returns:
+        The schema version of the database after migrating.
+    """
+    conn = sqlite3.connect(database)
+    try:
+        version = get_schema_version(conn)
+        for migration_version, name, path in list_migrations(migrations_dir):
+            if migration_version <= version:
+                continue
+            logging.info(f"Applying schema migration {path.name}")
+            with open(path, "r") as f:
+                sql_script = f.read()
+            try:
+                conn.executescript(
+                    f"""
+                    BEGIN;
+                    {sql_script}
+                    ;
+                    INSERT INTO schema_migrations (version, name) VALUES ({migration_version}, '{name}');
+                    COMMIT;
+                    """
+                )
+            except sqlite3.Error as e:
+                conn.rollback()
+                logging.error(f"Error while applying {path.name}: {e}", exc_info=True)
+                raise e
+            version = migration_version
+        return version
+    finally:
+        conn.close()
+
+
+def build_deferred_indexes(database: str, sql_path: str) -> None:
+    """Build the secondary indexes that are deliberately left out of the migrations.
+
+    Run after the bulk load: on a fresh warehouse the indexes are then built in one
+    sorted pass instead of being maintained for every inserted row. On an existing
+    warehouse the statements are no-ops. The query planner statistics are refreshed
+    afterwards.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        sql_path: A string representing the path to the index creation script.
+    """
+    conn = sqlite3.connect(database)
+    try:
+        with open(sql_path, "r") as f:
+            conn.executescript(f.read())
+        conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
@@ -0,0 +1,467 @@
+import logging
+import os
+import re
+import sqlite3
+import uuid
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .db_helper import BULK_LOAD_PRAGMAS, load_data_orders
+
+# the periods fact_orders can be partitioned by, with the strftime format of their shard keys
+PARTITION_PERIODS = {
+    "year": "%Y",
+    "month": "%Y_%m",
+    "day": "%Y_%m_%d",
+}
+
+# the shard key of the facts whose PaymentDate could not be parsed
+UNDATED_SHARD = "undated"
+
+# SQLite's default limit on attached databases, assumed where Python cannot read the
+# actual limit: Connection.getlimit is new in Python 3.11
+DEFAULT_ATTACHED_LIMIT = 10
+
+SHARD_FILE_PATTERN = re.compile(r"^fact_orders_(\w+)\.db$")
+
+# the schema of a shard file. The dimension keys refer to the core database, which
+# SQLite cannot enforce across files, so there are no foreign keys.
+SHARD_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fact_orders (
+  order_number VARCHAR(255) NOT NULL PRIMARY KEY,
+  client_key INTEGER NOT NULL,
+  product_key INTEGER NOT NULL,
+  payment_key INTEGER NOT NULL,
+  unit_price DECIMAL(10, 2) NOT NULL,
+  product_quantity INT NOT NULL,
+  total_price DECIMAL(10, 2) NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fact_orders_client_key ON fact_orders (client_key);
+CREATE INDEX IF NOT EXISTS idx_fact_orders_product_key ON fact_orders (product_key);
+CREATE INDEX IF NOT EXISTS idx_fact_orders_payment_key ON fact_orders (payment_key);
+CREATE TABLE IF NOT EXISTS shard_undo (
+  load_token CHAR(32) NOT NULL,
+  order_number VARCHAR(255) NOT NULL,
+  client_key INTEGER,
+  product_key INTEGER,
+  payment_key INTEGER,
+  unit_price DECIMAL(10, 2),
+  product_quantity INT,
+  total_price DECIMAL(10, 2),
+  PRIMARY KEY (load_token, order_number)
+);
+"""
+
+# the journal of the shard loads committed in the shards but not yet known to be
+# committed in the core database, one file per load listing its shard keys
+PENDING_FILE_PATTERN = "pending_*.txt"
+
+
+def default_shard_dir(database: str) -> Path:
+    """Return the folder the shards of `database` are kept in by default, next to it."""
+    database = Path(database)
+    return database.parent / f"{database.stem}_shards"
+
+
+def list_shards(shard_dir: Union[str, Path]) -> List[Tuple[str, Path]]:
+    """List the shard files in a folder as (shard key, path) tuples, ordered by key."""
+    shards = []
+    for path in Path(shard_dir).glob("fact_orders_*.db"):
+        match = SHARD_FILE_PATTERN.match(path.name)
+        if match is not None:
+            shards.append((match.group(1), path))
+    return sorted(shards)
+
+
+def drop_shards(shard_dir: Union[str, Path]) -> None:
+    """Delete all shard files in a folder and their journal, e.g. before a full reload."""
+    for _, path in list_shards(shard_dir):
+        for suffix in ["", "-wal", "-shm"]:
+            Path(f"{path}{suffix}").unlink(missing_ok=True)
+    for path in Path(shard_dir).glob(PENDING_FILE_PATTERN):
+        path.unlink()
+
+
+class FactShards:
+    """Route fact rows into one SQLite file per period of their PaymentDate.
+
+    The dimensions stay in the core database; only fact_orders is partitioned.
+    Each shard is an independent file, so a closed period is never written again
+    and can be backed up, vacuumed, archived or deleted on its own. Use
+    `attach_shards` to query the shards together.
+
+    The core database keeps the shard of each order in fact_order_shards, so an
+    order is in one shard only, and records each committed shard load in
+    shard_loads, see `transaction`.
+
+    Example:
+        fact_shards = FactShards(shard_dir)
+        with LoadSession(database) as session, session.transaction(), fact_shards.transaction(session.conn):
+            load_batch(database, transformed_df, conn=session.conn, fact_shards=fact_shards)
+
+    Args:
+        shard_dir: The folder the shard files are kept in.
+        period: One of PARTITION_PERIODS.
+        pragmas: The pragmas applied to each shard connection. Defaults to
+            BULK_LOAD_PRAGMAS.
+    """
+
+    def __init__(
+        self,
+        shard_dir: Union[str, Path],
+        period: str = "month",
+        pragmas: Optional[Dict[str, Union[str, int]]] = None,
+    ) -> None:
+        if period not in PARTITION_PERIODS:
+            raise ValueError(
+                f"period must be one of {tuple(PARTITION_PERIODS)}, got {period!r}"
+            )
+        self.shard_dir = Path(shard_dir)
+        self.period = period
+        self.pragmas = BULK_LOAD_PRAGMAS if pragmas is None else pragmas
+        self.connections = {}
+        self.load_token = None
+
+    def shard_keys(self, payment_dates: pd.Series) -> np.ndarray:
+        """Return the shard key of each payment date.
+
+        Each distinct date is formatted once, see `etl.parse_dates` for the same
+        factorize-and-map approach.
+        """
+        codes, uniques = pd.factorize(payment_dates)
+        keys = pd.DatetimeIndex(uniques).strftime(PARTITION_PERIODS[self.period])
+        lookup = np.append(np.asarray(keys, dtype=object), UNDATED_SHARD)
+        lookup[pd.isna(lookup)] = UNDATED_SHARD
+        return lookup[codes]
+
+    def shard_path(self, key: str) -> Path:
+        """Return the path of the shard file of a shard key."""
+        return self.shard_dir / f"fact_orders_{key}.db"
+
+    def _connection(self, key: str) -> sqlite3.Connection:
+        # shards are opened on first use and join the transaction in progress
+        if key not in self.connections:
+            self.shard_dir.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.shard_path(key), isolation_level=None)
+            for name, value in self.pragmas.items():
+                conn.execute(f"PRAGMA {name} = {value}")
+            conn.executescript(SHARD_SCHEMA)
+            conn.execute("BEGIN")
+            conn.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS batch_orders (order_number VARCHAR(255) NOT NULL PRIMARY KEY)"
+            )
+            self.connections[key] = conn
+        return self.connections[key]
+
+    def _save_undo(self, key: str, order_numbers: np.ndarray) -> sqlite3.Connection:
+        # keep the rows the load is about to overwrite, or a NULL row for the new
+        # orders, so the load can be undone if the core database does not commit
+        conn = self._connection(key)
+        conn.execute("DELETE FROM temp.batch_orders")
+        conn.executemany(
+            "INSERT OR IGNORE INTO temp.batch_orders (order_number) VALUES (?)",
+            [(order_number,) for order_number in order_numbers],
+        )
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO shard_undo
+            SELECT ?, b.order_number, f.client_key, f.product_key, f.payment_key,
+                   f.unit_price, f.product_quantity, f.total_price
+            FROM temp.batch_orders b LEFT JOIN fact_orders f USING (order_number)
+            """,
+            (self.load_token,),
+        )
+        return conn
+
+    def _orders_in_other_shards(
+        self, conn: sqlite3.Connection, order_shards: pd.DataFrame
+    ) -> pd.DataFrame:
+        # the orders of the batch already loaded into another shard than their own
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS batch_order_shards "
+            "(order_number VARCHAR(255) NOT NULL PRIMARY KEY, shard_key VARCHAR(32) NOT NULL)"
+        )
+        conn.execute("DELETE FROM temp.batch_order_shards")
+        conn.executemany(
+            "INSERT OR REPLACE INTO temp.batch_order_shards (order_number, shard_key) VALUES (?, ?)",
+            order_shards.itertuples(index=False),
+        )
+        return pd.read_sql_query(
+            """
+            SELECT s.order_number, s.shard_key
+            FROM temp.batch_order_shards b JOIN fact_order_shards s USING (order_number)
+            WHERE s.shard_key != b.shard_key
+            """,
+            conn,
+        )
+
+    def _loaded_duplicates(self, moved: pd.DataFrame, fact_orders_df: pd.DataFrame) -> np.ndarray:
+        # the moved orders loaded into their shard with the same values, which the
+        # "insert" mode skips, see `db_helper.insert_mode_condition`
+        columns = ["OrderNumber", "UnitPrice", "ProductQuantity", "TotalPrice"]
+        loaded = []
+        for key, key_moved in moved.groupby("shard_key", sort=True):
+            conn = self._connection(key)
+            conn.execute("DELETE FROM temp.batch_orders")
+            conn.executemany(
+                "INSERT OR IGNORE INTO temp.batch_orders (order_number) VALUES (?)",
+                [(order_number,) for order_number in key_moved["order_number"]],
+            )
+            loaded.append(
+                pd.read_sql_query(
+                    """
+                    SELECT f.order_number, f.unit_price, f.product_quantity, f.total_price
+                    FROM temp.batch_orders JOIN fact_orders f USING (order_number)
+                    """,
+                    conn,
+                ).set_axis(columns, axis=1)
+            )
+        values = {column: float for column in columns[1:]}
+        duplicates = fact_orders_df[columns].astype(values).merge(pd.concat(loaded).astype(values))
+        return duplicates["OrderNumber"].unique()
+
+    def load(
+        self,
+        fact_orders_df: pd.DataFrame,
+        transformed_df: pd.DataFrame,
+        conn: sqlite3.Connection,
+        order_mode: str = "insert",
+    ) -> int:
+        """Load fact rows into the shards of their payment dates.
+
+        Must be called inside `transaction`. An order already loaded into the
+        shard of another period, e.g. re-sent with a corrected payment date, is
+        handled like a duplicate order by `order_mode`: "insert" skips it if it was
+        loaded with the same values and raises otherwise, "append" skips it and
+        "upsert" moves it to its new shard.
+
+        Args:
+            fact_orders_df: A pandas DataFrame returned by `create_fact_orders` or
+                `create_fact_orders_from_star`.
+            transformed_df: The transformed batch the facts were built from, which
+                holds their PaymentDate, matched through RecordId.
+            conn: The connection of the core database's transaction, which keeps
+                fact_order_shards.
+            order_mode: One of ORDER_LOAD_MODES, see `load_data_orders`.
+
+        Returns:
+            The number of rows inserted or updated.
+
+        Raises:
+            sqlite3.IntegrityError: If order_mode is "insert" and an order is
+                already loaded into another shard.
+        """
+        positions = pd.Index(transformed_df["RecordId"]).get_indexer(
+            fact_orders_df["RecordId"]
+        )
+        keys = self.shard_keys(transformed_df["PaymentDate"])[positions]
+        order_shards = pd.DataFrame(
+            {"order_number": fact_orders_df["OrderNumber"].to_numpy(), "shard_key": keys}
+        )
+
+        moved = self._orders_in_other_shards(conn, order_shards)
+        if len(moved) > 0:
+            if order_mode == "insert":
+                conflicting = moved[
+                    ~moved["order_number"].isin(self._loaded_duplicates(moved, fact_orders_df))
+                ]
+                if len(conflicting) > 0:
+                    raise sqlite3.IntegrityError(
+                        f"{len(conflicting)} orders are already loaded into another shard, "
+                        f"e.g. {conflicting['order_number'].iloc[0]} in {conflicting['shard_key'].iloc[0]}"
+                    )
+            if order_mode in ("insert", "append"):
+                logging.info(f"Skipping {len(moved)} orders already loaded into another shard")
+                kept = ~order_shards["order_number"].isin(moved["order_number"]).to_numpy()
+                fact_orders_df, keys = fact_orders_df[kept], keys[kept]
+                conn.execute(
+                    "DELETE FROM temp.batch_order_shards WHERE order_number IN "
+                    "(SELECT order_number FROM fact_order_shards)"
+                )
+            else:
+                logging.info(f"Moving {len(moved)} orders to the shard of their new payment date")
+                for key, key_moved in moved.groupby("shard_key", sort=True):
+                    self._save_undo(key, key_moved["order_number"].to_numpy()).execute(
+                        "DELETE FROM fact_orders WHERE order_number IN "
+                        "(SELECT order_number FROM temp.batch_orders)"
+                    )
+
+        loaded_rows = 0
+        for key, shard_df in fact_orders_df.groupby(keys, sort=True):
+            loaded_rows += load_data_orders(
+                str(self.shard_path(key)),
+                shard_df,
+                conn=self._save_undo(key, shard_df["OrderNumber"].to_numpy()),
+                order_mode=order_mode,
+            )
+
+        conn.execute(
+            """
+            INSERT INTO fact_order_shards (order_number, shard_key)
+            SELECT order_number, shard_key FROM temp.batch_order_shards WHERE true
+            ON CONFLICT (order_number) DO UPDATE SET shard_key = excluded.shard_key
+            """
+        )
+        conn.execute("INSERT OR IGNORE INTO shard_loads (load_token) VALUES (?)", (self.load_token,))
+        return loaded_rows
+
+    def _pending_path(self, load_token: str) -> Path:
+        return self.shard_dir / PENDING_FILE_PATTERN.replace("*", load_token)
+
+    def recover(self, conn: sqlite3.Connection) -> None:
+        """Finish the shard loads a failed or interrupted commit left pending.
+
+        A load whose token is in shard_loads committed in the core database too,
+        so only its undo rows are dropped. Any other load is undone in the shards
+        that committed it, restoring the rows it overwrote or moved away.
+
+        Args:
+            conn: The connection of a core database transaction. Its write lock
+                is taken first, so a load still committing elsewhere finishes
+                before its journal is read.
+        """
+        journals = sorted(self.shard_dir.glob(PENDING_FILE_PATTERN))
+        if not journals:
+            return
+        conn.execute("DELETE FROM shard_loads WHERE 0")
+        for journal in journals:
+            load_token = journal.stem[len("pending_"):]
+            committed = conn.execute(
+                "SELECT 1 FROM shard_loads WHERE load_token = ?", (load_token,)
+            ).fetchone() is not None
+            for key in journal.read_text().split():
+                if not self.shard_path(key).exists():
+                    continue
+                with closing(sqlite3.connect(self.shard_path(key), isolation_level=None)) as shard_conn:
+                    shard_conn.execute("BEGIN")
+                    if not committed:
+                        shard_conn.execute(
+                            "DELETE FROM fact_orders WHERE order_number IN "
+                            "(SELECT order_number FROM shard_undo WHERE load_token = ?)",
+                            (load_token,),
+                        )
+                        shard_conn.execute(
+                            """
+                            INSERT INTO fact_orders
+                            SELECT order_number, client_key, product_key, payment_key,
+                                   unit_price, product_quantity, total_price
+                            FROM shard_undo WHERE load_token = ? AND client_key IS NOT NULL
+                            """,
+                            (load_token,),
+                        )
+                    shard_conn.execute("DELETE FROM shard_undo WHERE load_token = ?", (load_token,))
+                    shard_conn.execute("COMMIT")
+            if not committed:
+                logging.warning(f"Undid the shard load {load_token}, the core database did not commit it")
+            conn.execute("DELETE FROM shard_loads WHERE load_token = ?", (load_token,))
+            journal.unlink()
+
+    @contextmanager
+    def transaction(self, conn: sqlite3.Connection) -> Iterator["FactShards"]:
+        """Commit the shards written in the enclosed block, or roll them all back.
+
+        Nest it inside the LoadSession transaction of `conn`, so the shards are
+        committed just before the core database. The shard keys are written to a
+        journal file before the shards commit, and the rows a load overwrites are
+        kept in each shard's shard_undo table. If the core database then fails to
+        commit, `recover`, run at the start of the next transaction, undoes the
+        load in the shards.
+
+        Args:
+            conn: The connection of the core database's transaction.
+        """
+        self.recover(conn)
+        self.load_token = uuid.uuid4().hex
+        try:
+            yield self
+        except BaseException:
+            for shard_conn in self.connections.values():
+                shard_conn.execute("ROLLBACK")
+            logging.error("Load failed, shard transactions rolled back")
+            raise
+        else:
+            if self.connections:
+                pending_path = self._pending_path(self.load_token)
+                with open(pending_path, "w") as f:
+                    f.write("\n".join(sorted(self.connections)) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            for shard_conn in self.connections.values():
+                shard_conn.execute("COMMIT")
+        finally:
+            for shard_conn in self.connections.values():
+                shard_conn.close()
+            self.connections = {}
+            self.load_token = None
+
+
+def attached_limit(conn: sqlite3.Connection) -> int:
+    """Return how many databases SQLite lets `conn` attach, or DEFAULT_ATTACHED_LIMIT before Python 3.11."""
+    if not hasattr(conn, "getlimit"):
+        return DEFAULT_ATTACHED_LIMIT
+    return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+
+
+def attach_shards(
+    conn: sqlite3.Connection,
+    shard_dir: Union[str, Path],
+    first: Optional[str] = None,
+    last: Optional[str] = None,
+    view_name: str = "fact_orders_all",
+) -> List[str]:
+    """ATTACH the shard files and expose them as one UNION ALL view.
+
+    The view is a TEMP view, so it only exists on `conn` and nothing is written to
+    the core database. Restricting the shard keys to the period being queried keeps
+    the other shards closed, and stays within SQLite's limit on attached databases
+    (10 in most builds). Must be called outside of a transaction.
+
+    Example:
+        conn = sqlite3.connect(database)
+        attach_shards(conn, default_shard_dir(database), first="2021_01", last="2021_06")
+        conn.execute("SELECT SUM(total_price) FROM fact_orders_all").fetchone()
+
+    Args:
+        conn: An open connection to the core database.
+        shard_dir: The folder the shard files are kept in.
+        first: If given, the first shard key to attach, e.g. "2021_01".
+        last: If given, the last shard key to attach.
+        view_name: The name of the view.
+
+    Returns:
+        The keys of the attached shards.
+    """
+    shards = [
+        (key, path)
+        for key, path in list_shards(shard_dir)
+        if (first is None or key >= first) and (last is None or key <= last)
+    ]
+    attached = {
+        row[1] for row in conn.execute("PRAGMA database_list") if row[1] not in ("main", "temp")
+    }
+    limit = attached_limit(conn)
+    new_shards = [(key, path) for key, path in shards if f"shard_{key}" not in attached]
+    if len(attached) + len(new_shards) > limit:
+        raise ValueError(
+            f"{len(shards)} shards selected, SQLite allows {limit} attached databases; "
+            "narrow the range with first and last"
+        )
+
+    for key, path in new_shards:
+        conn.execute("ATTACH DATABASE ? AS ?", (str(path), f"shard_{key}"))
+
+    conn.execute(f"DROP VIEW IF EXISTS temp.{view_name}")
+    if shards:
+        union = "\nUNION ALL\n".join(
+            f"SELECT * FROM shard_{key}.fact_orders" for key, _ in shards
+        )
+    else:
+        # no shards yet, so the view has the columns of fact_orders but no rows
+        union = "SELECT * FROM main.fact_orders WHERE 0"
+    conn.execute(f"CREATE TEMP VIEW {view_name} AS {union}")
+    logging.info(f"Attached {len(shards)} shards as {view_name}")
+    return [key for key, _ in shards]
@@ -0,0 +1,968 @@
+import logging
+import queue
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+import pandas as pd
+
+from .etl import (
+    current_load_date,
+    extract_file,
+    extract_file_chunks,
+    extract_all_files,
+    extract_all_files_chunked,
+    extract_transform_files_parallel,
+    transform_data,
+    create_dimension_client,
+    create_dimension_payment,
+    create_dimension_product,
+    create_fact_orders,
+    build_star_schema,
+    create_fact_orders_from_star,
+)
+from .db_helper import (
+    LoadSession,
+    bump_load_generation,
+    session_for,
+    load_fact_orders_staged,
+    load_data_clients,
+    load_data_payments,
+    load_data_products,
+    load_data_orders,
+)
+from .aggregates import order_days, payment_days, refresh_aggregates
+from .archive import FileArchive
+from .cache import ParsedFileCache
+from .fingerprints import FingerprintIndex
+from .journal import (
+    RUN_COMPLETED,
+    RUN_FAILED,
+    STAGE_CHUNK,
+    STAGE_FILE,
+    finish_run,
+    record_checkpoint,
+    start_run,
+)
+from .manifest import STATUS_FAILED, STATUS_LOADED, hash_file, record_files
+from .metrics import file_scope
+from .partitions import FactShards
+from .readers import LEGACY_ENCODING
+from .validation import Rule, staged_rejects, validate_rows
+
+FACT_KEY_MODES = ("pandas", "sql", "star")
+
+
+def load_batch(
+    database: str,
+    transformed_df: pd.DataFrame,
+    conn: Optional[sqlite3.Connection] = None,
+    fact_keys: str = "pandas",
+    order_mode: str = "insert",
+    fingerprint_index: Optional[FingerprintIndex] = None,
+    aggregate_days: Optional[Set[str]] = None,
+    fact_shards: Optional[FactShards] = None,
+) -> int:
+    """Build the dimension and fact tables for one transformed batch and load them.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        transformed_df: A pandas DataFrame returned by `transform_data`.
+        conn: An open connection to load through, e.g. from a LoadSession.
+        fact_keys: How the dimension and fact rows are built: "pandas" merges the
+            batch with the dimension tables read by `create_fact_orders`, "sql"
+            resolves the keys inside SQLite through `load_fact_orders_staged`, and
+            "star" builds all tables from shared factorized codes with
+            `build_star_schema`.
+        order_mode: How orders that are already in fact_orders are treated, see
+            `load_data_orders`.
+        fingerprint_index: If given, rows whose RowFingerprint was loaded by an
+            earlier batch are dropped before any dimension or fact work, and the
+            fingerprints of this batch are added to the index. Requires `conn`.
+        aggregate_days: If given, the days whose aggregates the batch changes are
+            added to this set, to be passed to `aggregates.refresh_aggregates`.
+        fact_shards: If given, the fact rows are loaded into these per-period
+            shard files instead of the core fact_orders table.
+
+    Returns:
+        The number of fact rows inserted or updated.
+    """
+    if fact_keys not in FACT_KEY_MODES:
+        raise ValueError(f"fact_keys must be one of {FACT_KEY_MODES}, got {fact_keys!r}")
+    if fact_shards is not None and fact_keys == "sql":
+        raise ValueError("fact_keys='sql' loads into the core fact_orders table, it cannot be sharded")
+    if fact_shards is not None and aggregate_days is not None:
+        raise ValueError("The aggregate tables are computed from the core fact_orders table, not from shards")
+
+    if fingerprint_index is not None:
+        fingerprints = transformed_df["RowFingerprint"].to_numpy()
+        new_rows = fingerprint_index.new_rows_mask(fingerprints, conn)
+        logging.info(f"Dropping {len(new_rows) - new_rows.sum()} previously seen rows")
+        transformed_df = transformed_df[new_rows]
+        fingerprint_index.add(fingerprints[new_rows], conn)
+
+    # an upsert may move orders away from the days they were loaded on
+    if aggregate_days is not None and order_mode == "upsert":
+        aggregate_days.update(
+            order_days(database, transformed_df["OrderNumber"].unique(), conn=conn)
+        )
+
+    loaded_rows = _load_dimensions_and_facts(
+        database, transformed_df, conn, fact_keys, order_mode, fact_shards
+    )
+
+    if aggregate_days is not None:
+        aggregate_days.update(
+            payment_days(database, transformed_df["PaymentBillingCode"].unique(), conn=conn)
+        )
+
+    # tell the readers caching query results that the warehouse changed
+    bump_load_generation(database, conn=conn)
+    return loaded_rows
+
+
+def _load_dimensions_and_facts(
+    database: str,
+    transformed_df: pd.DataFrame,
+    conn: Optional[sqlite3.Connection],
+    fact_keys: str,
+    order_mode: str,
+    fact_shards: Optional[FactShards],
+) -> int:
+    if fact_keys == "star":
+        star = build_star_schema(transformed_df)
+        load_data_clients(database, star.dim_client, conn=conn)
+        load_data_payments(database, star.dim_payment, conn=conn)
+        load_data_products(database, star.dim_product, conn=conn)
+        fact_orders_df = create_fact_orders_from_star(database, star, conn=conn)
+        return _load_facts(
+            database, fact_orders_df, transformed_df, conn, order_mode, fact_shards
+        )
+
+    # Create dimension tables
+    dim_client_df = create_dimension_client(transformed_df)
+    dim_payment_df = create_dimension_payment(transformed_df)
+    dim_product_df = create_dimension_product(transformed_df)
+
+    # Convert the PaymentDate column to a string
+    dim_payment_df["PaymentDate"] = dim_payment_df["PaymentDate"].astype(str)
+
+    # Load the dimension tables into the database
+    load_data_clients(database, dim_client_df, conn=conn)
+    load_data_payments(database, dim_payment_df, conn=conn)
+    load_data_products(database, dim_product_df, conn=conn)
+
+    if fact_keys == "sql":
+        return load_fact_orders_staged(
+            database, transformed_df, conn=conn, order_mode=order_mode
+        )
+
+    # Create the fact table with foreign keys to dimension tables
+    fact_orders_df = create_fact_orders(database, transformed_df, conn=conn)
+
+    # Load the fact table into the database
+    return _load_facts(
+        database, fact_orders_df, transformed_df, conn, order_mode, fact_shards
+    )
+
+
+def _load_facts(
+    database: str,
+    fact_orders_df: pd.DataFrame,
+    transformed_df: pd.DataFrame,
+    conn: Optional[sqlite3.Connection],
+    order_mode: str,
+    fact_shards: Optional[FactShards],
+) -> int:
+    if fact_shards is not None:
+        return fact_shards.load(fact_orders_df, transformed_df, conn, order_mode=order_mode)
+    return load_data_orders(database, fact_orders_df, conn=conn, order_mode=order_mode)
+
+
+def shard_transaction(fact_shards: Optional[FactShards], conn: sqlite3.Connection):
+    """Return the transaction of `fact_shards` on `conn`, or a no-op context if there are none."""
+    return nullcontext() if fact_shards is None else fact_shards.transaction(conn)
+
+
+def batch_file(batch_df: pd.DataFrame) -> Optional[str]:
+    """Return the source file of a batch read from a single file, None if it is empty."""
+    return batch_df["file"].iat[0] if len(batch_df) > 0 else None
+
+
+def file_row_counts(transformed_df: pd.DataFrame) -> Dict[str, int]:
+    """Return the number of rows per source file, keyed by the `file` column."""
+    return transformed_df["file"].value_counts().to_dict()
+
+
+def record_batch_files(
+    database: str,
+    files: List[Path],
+    failed_files: List[Path],
+    row_counts: Dict[str, int],
+    conn: Optional[sqlite3.Connection] = None,
+) -> None:
+    """Record the files of a batch in the manifest, as failed if they could not be extracted.
+
+    A file that could not be extracted contributed no rows to the batch, so it is
+    not recorded as loaded and is picked up again by the next run.
+    """
+    loaded_files = [f for f in files if f not in failed_files]
+    if loaded_files:
+        record_files(database, loaded_files, row_counts, STATUS_LOADED, conn=conn)
+    if failed_files:
+        record_files(database, failed_files, row_counts, STATUS_FAILED, conn=conn)
+
+
+def run_pipeline(
+    database: str,
+    files: List[Path],
+    workers: Optional[int] = None,
+    fact_keys: str = "pandas",
+    order_mode: str = "insert",
+    track_files: bool = False,
+    fingerprint_index: Optional[FingerprintIndex] = None,
+    compact: bool = False,
+    date_formats: Optional[List[str]] = None,
+    engine: str = "pandas",
+    encoding: str = LEGACY_ENCODING,
+    cache: Optional[ParsedFileCache] = None,
+    validation_rules: Optional[List[Rule]] = None,
+    reject_dir: Optional[str] = None,
+    aggregates: bool = False,
+    fact_shards: Optional[FactShards] = None,
+    session: Optional[LoadSession] = None,
+) -> int:
+    """Extract, transform and load all files as a single in-memory batch.
+
+    The dimensions and facts are loaded in one transaction of a LoadSession, so a
+    failure leaves the warehouse as it was before the run.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        files: A list of Path objects representing the CSV files to process.
+        workers: If set, extract and transform the files across this many worker
+            processes instead of in the current process.
+        fact_keys: How the fact rows get their dimension keys, see `load_batch`.
+        order_mode: How orders that are already in fact_orders are treated, see
+            `load_data_orders`.
+        track_files: Record the files and their row counts in the file manifest,
+            in the load transaction if it succeeds, as failed otherwise. Files
+            that could not be extracted are recorded as failed either way.
+        fingerprint_index: If given, drop rows already loaded by earlier runs, see
+            `load_batch`.
+        compact: Hold the extracted text columns in the compact categorical and
+            arrow-backed representation, see `input_schema`.
+        date_formats: The formats PaymentDate is parsed with, see `parse_dates`.
+        engine: The CSV reader backend, see `readers.read_csv`.
+        encoding: The encoding the files are decoded with, or "auto" to detect it
+            per file.
+        cache: If given, parsed files are read from and stored in this cache, so
+            a rerun after a failed load skips CSV parsing.
+        validation_rules: If given, rows failing these rules are quarantined
+            before the transform, see `validation.validate_rows`.
+        reject_dir: The folder the rejected rows, and the lines skipped by the
+            CSV reader, are written to once the load commits, one reject file per
+            input file, see `validation.staged_rejects`.
+        aggregates: Refresh the aggregate tables for the days the loaded facts
+            fall on, in the load transaction, see `aggregates.refresh_aggregates`.
+        fact_shards: If given, load the facts into these per-period shard files,
+            committed just before the core database, see `partitions.FactShards`.
+        session: If given, load through this open LoadSession instead of opening
+            a new one, e.g. to keep one warm connection across the micro-batches
+            of `watch.watch_folder`.
+
+    Returns:
+        The number of fact rows inserted or updated.
+    """
+    with staged_rejects(reject_dir, files) as reject_staging:
+        failed_files = []
+        if workers:
+            transformed_df = extract_transform_files_parallel(
+                files,
+                workers,
+                compact=compact,
+                date_formats=date_formats,
+                engine=engine,
+                encoding=encoding,
+                cache=cache,
+                validation_rules=validation_rules,
+                reject_dir=reject_staging,
+                failed_files=failed_files,
+            )
+        else:
+            # Extract data from all CSV files
+            raw_df = extract_all_files(
+                files,
+                compact=compact,
+                engine=engine,
+                encoding=encoding,
+                cache=cache,
+                failed_files=failed_files,
+                reject_dir=reject_staging,
+            )
+            transformed_df = None
+            if raw_df is not None:
+                # Quarantine the rows failing validation
+                if validation_rules is not None:
+                    raw_df = validate_rows(raw_df, validation_rules, reject_staging)
+
+                # Transform the data
+                transformed_df = transform_data(raw_df, date_formats=date_formats)
+
+        if transformed_df is None:
+            if track_files:
+                record_files(database, failed_files, {}, STATUS_FAILED)
+            return 0
+
+        row_counts = file_row_counts(transformed_df)
+        aggregate_days = set() if aggregates else None
+        try:
+            with session_for(database, session) as session:
+                with session.transaction(), shard_transaction(fact_shards, session.conn):
+                    loaded_rows = load_batch(
+                        database,
+                        transformed_df,
+                        conn=session.conn,
+                        fact_keys=fact_keys,
+                        order_mode=order_mode,
+                        fingerprint_index=fingerprint_index,
+                        aggregate_days=aggregate_days,
+                        fact_shards=fact_shards,
+                    )
+                    if aggregates:
+                        refresh_aggregates(database, aggregate_days, conn=session.conn)
+                    if track_files:
+                        record_batch_files(
+                            database, files, failed_files, row_counts, conn=session.conn
+                        )
+                if fingerprint_index is not None:
+                    fingerprint_index.save(session.conn)
+        except Exception:
+            if track_files:
+                record_files(database, files, row_counts, STATUS_FAILED)
+            raise
+        return loaded_rows
+
+
+def run_chunked_pipeline(
+    database: str,
+    files: List[Path],
+    chunksize: int,
+    fact_keys: str = "pandas",
+    order_mode: str = "insert",
+    track_files: bool = False,
+    fingerprint_index: Optional[FingerprintIndex] = None,
+    compact: bool = False,
+    date_formats: Optional[List[str]] = None,
+    engine: str = "pandas",
+    encoding: str = LEGACY_ENCODING,
+    validation_rules: Optional[List[Rule]] = None,
+    reject_dir: Optional[str] = None,
+    aggregates: bool = False,
+    fact_shards: Optional[FactShards] = None,
+    session: Optional[LoadSession] = None,
+) -> int:
+    """Extract, transform and load the files one bounded-size chunk at a time.
+
+    Each chunk goes through transform, dimension building and load before the next
+    one is read, so peak memory depends on `chunksize` rather than on the input size.
+    RecordIds continue across chunks, the dimension loads deduplicate against rows
+    from earlier chunks through their ON CONFLICT clauses, and with the default
+    "insert" order mode a fact row already loaded by an earlier chunk with the same
+    values is skipped, as `create_fact_orders` drops it within a chunk, while one
+    with other values fails the run.
+    All chunks are loaded in one transaction of a LoadSession, so a failure leaves
+    the warehouse as it was before the run. A file that cannot be read to its end
+    fails the run, since its first chunks are already loaded by then.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        files: A list of Path objects representing the CSV files to process.
+        chunksize: The maximum number of rows per chunk.
+        fact_keys: How the fact rows get their dimension keys, see `load_batch`.
+        order_mode: How orders that are already in fact_orders are treated, see
+            `load_data_orders`.
+        track_files: Record the files and their row counts in the file manifest,
+            in the load transaction if it succeeds, as failed otherwise.
+        fingerprint_index: If given, drop rows already loaded by earlier runs, see
+            `load_batch`.
+        compact: Hold the extracted text columns in the compact categorical and
+            arrow-backed representation, see `input_schema`.
+        date_formats: The formats PaymentDate is parsed with, see `parse_dates`.
+        engine: The CSV reader backend, see `readers.read_csv`.
+        encoding: The encoding the files are decoded with, or "auto" to detect it
+            per file.
+        validation_rules: If given, rows failing these rules are quarantined
+            before the transform, see `validation.validate_rows`.
+        reject_dir: The folder the rejected rows, and the lines skipped by the
+            CSV reader, are written to once the load commits, one reject file per
+            input file, see `validation.staged_rejects`.
+        aggregates: Refresh the aggregate tables for the days the loaded facts
+            fall on, in the load transaction, see `aggregates.refresh_aggregates`.
+        fact_shards: If given, load the facts into these per-period shard files,
+            committed just before the core database, see `partitions.FactShards`.
+        session: If given, load through this open LoadSession instead of opening
+            a new one, e.g. to keep one warm connection across the micro-batches
+            of `watch.watch_folder`.
+
+    Returns:
+        The number of fact rows inserted or updated.
+    """
+    next_record_id = 0
+    loaded_rows = 0
+    row_counts = Counter()
+    failed_files = []
+    aggregate_days = set() if aggregates else None
+    with staged_rejects(reject_dir, files) as reject_staging:
+        try:
+            with session_for(database, session) as session:
+                with session.transaction(), shard_transaction(fact_shards, session.conn):
+                    chunks = extract_all_files_chunked(
+                        files,
+                        chunksize,
+                        compact=compact,
+                        engine=engine,
+                        encoding=encoding,
+                        failed_files=failed_files,
+                        reject_dir=reject_staging,
+                    )
+                    for chunk_number, chunk in enumerate(chunks):
+                        # chunks never span files, so their stages are attributed to one
+                        with file_scope(batch_file(chunk)):
+                            if validation_rules is not None:
+                                chunk = validate_rows(chunk, validation_rules, reject_staging)
+                            transformed_df = transform_data(
+                                chunk, record_id_start=next_record_id, date_formats=date_formats
+                            )
+                            next_record_id += len(chunk)
+                            row_counts.update(file_row_counts(transformed_df))
+                            loaded_rows += load_batch(
+                                database,
+                                transformed_df,
+                                conn=session.conn,
+                                fact_keys=fact_keys,
+                                order_mode=order_mode,
+                                fingerprint_index=fingerprint_index,
+                                aggregate_days=aggregate_days,
+                                fact_shards=fact_shards,
+                            )
+                        logging.info(f"Loaded chunk {chunk_number} ({len(chunk)} rows)")
+                    if failed_files:
+                        # the chunks read before the error are in this transaction
+                        raise ValueError(
+                            f"Could not extract {', '.join(f.name for f in failed_files)}"
+                        )
+                    if aggregates:
+                        refresh_aggregates(database, aggregate_days, conn=session.conn)
+                    if track_files:
+                        record_files(
+                            database, files, row_counts, STATUS_LOADED, conn=session.conn
+                        )
+                if fingerprint_index is not None:
+                    fingerprint_index.save(session.conn)
+        except Exception:
+            if track_files:
+                record_files(database, files, row_counts, STATUS_FAILED)
+            raise
+
+    if next_record_id == 0:
+        logging.warning("No data extracted from CSV files")
+    return loaded_rows
+
+
+
+def run_checkpointed_pipeline(
+    database: str,
+    files: List[Path],
+    chunksize: int,
+    fact_keys: str = "pandas",
+    order_mode: str = "insert",
+    track_files: bool = False,
+    fingerprint_index: Optional[FingerprintIndex] = None,
+    compact: bool = False,
+    date_formats: Optional[List[str]] = None,
+    engine: str = "pandas",
+    encoding: str = LEGACY_ENCODING,
+    validation_rules: Optional[List[Rule]] = None,
+    reject_dir: Optional[str] = None,
+    aggregates: bool = False,
+    fact_shards: Optional[FactShards] = None,
+    session: Optional[LoadSession] = None,
+    resume: bool = True,
+) -> int:
+    """Extract, transform and load the files in chunks, committing each chunk on its own.
+
+    Unlike `run_chunked_pipeline`, every chunk is loaded in its own transaction,
+    together with a checkpoint in the run journal, and each file is recorded in
+    the manifest once all its chunks are committed. If the run fails or the
+    process is killed, the next run resumes the latest incomplete run: finished
+    files are skipped, and the chunks of a partly loaded file that were already
+    committed are read but not transformed or loaded again, so no fact is loaded
+    twice. Checkpoints are keyed by the content hash of the file, so a file that
+    was modified in between is loaded from its start.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        files: A list of Path objects representing the CSV files to process.
+        chunksize: The maximum number of rows per chunk. A run is only resumed
+            with the chunk size it was started with.
+        fact_keys: How the fact rows get their dimension keys, see `load_batch`.
+        order_mode: How orders that are already in fact_orders are treated, see
+            `load_data_orders`.
+        track_files: Record each file and its row count in the file manifest once
+            all its chunks are committed, and the unfinished files as failed if
+            the run fails.
+        fingerprint_index: If given, drop rows already loaded by earlier runs, see
+            `load_batch`.
+        compact: Hold the extracted text columns in the compact categorical and
+            arrow-backed representation, see `input_schema`.
+        date_formats: The formats PaymentDate is parsed with, see `parse_dates`.
+        engine: The CSV reader backend, see `readers.read_csv`.
+        encoding: The encoding the files are decoded with, or "auto" to detect it
+            per file.
+        validation_rules: If given, rows failing these rules are quarantined
+            before the transform, see `validation.validate_rows`.
+        reject_dir: The folder the rejected rows, and the lines skipped by the
+            CSV reader, are written to once all chunks of their file are
+            committed, one reject file per input file, see
+            `validation.staged_rejects`.
+        aggregates: Refresh the aggregate tables for the days each chunk's facts
+            fall on, in the chunk's transaction, see `aggregates.refresh_aggregates`.
+        fact_shards: If given, load the facts into these per-period shard files,
+            committed just before the core database with each chunk, see
+            `partitions.FactShards`.
+        session: If given, load through this open LoadSession instead of opening
+            a new one.
+        resume: Resume the latest incomplete run, see `journal.start_run`.
+
+    Returns:
+        The number of fact rows inserted or updated by this call.
+    """
+    next_record_id = 0
+    loaded_rows = 0
+    row_counts = Counter()
+    finished = set()
+    failed_files = []
+    with session_for(database, session) as session:
+        checkpoint = start_run(database, chunksize, resume=resume, conn=session.conn)
+        try:
+            for f in files:
+                content_hash = hash_file(f)
+                if content_hash in checkpoint.files:
+                    logging.info(f"Skipping {f.name}, loaded by run {checkpoint.run_id}")
+                    finished.add(f)
+                    continue
+
+                with staged_rejects(reject_dir, [f]) as reject_staging:
+                    committed_chunks = checkpoint.chunks.get(content_hash, 0)
+                    row_counts[f.stem] = checkpoint.rows.get(content_hash, 0)
+                    chunk_count = 0
+                    chunks = extract_file_chunks(
+                        f,
+                        chunksize,
+                        compact=compact,
+                        engine=engine,
+                        encoding=encoding,
+                        failed_files=failed_files,
+                        reject_dir=reject_staging,
+                    )
+                    for chunk_number, chunk in enumerate(chunks):
+                        chunk_count = chunk_number + 1
+                        if chunk_number < committed_chunks:
+                            # the rejects staged by the failed run were discarded with it
+                            if validation_rules is not None and reject_staging is not None:
+                                chunk["file"] = f.stem
+                                validate_rows(
+                                    chunk.reset_index(drop=True), validation_rules, reject_staging
+                                )
+                            next_record_id += len(chunk)
+                            continue
+
+                        chunk["file"] = f.stem
+                        chunk = chunk.reset_index(drop=True)
+                        with file_scope(f.stem):
+                            if validation_rules is not None:
+                                chunk = validate_rows(chunk, validation_rules, reject_staging)
+                            transformed_df = transform_data(
+                                chunk, record_id_start=next_record_id, date_formats=date_formats
+                            )
+                            next_record_id += len(chunk)
+                            aggregate_days = set() if aggregates else None
+                            with session.transaction(), shard_transaction(fact_shards, session.conn):
+                                chunk_rows = load_batch(
+                                    database,
+                                    transformed_df,
+                                    conn=session.conn,
+                                    fact_keys=fact_keys,
+                                    order_mode=order_mode,
+                                    fingerprint_index=fingerprint_index,
+                                    aggregate_days=aggregate_days,
+                                    fact_shards=fact_shards,
+                                )
+                                if aggregates:
+                                    refresh_aggregates(database, aggregate_days, conn=session.conn)
+                                record_checkpoint(
+                                    database,
+                                    checkpoint.run_id,
+                                    f,
+                                    STAGE_CHUNK,
+                                    chunk_number,
+                                    len(transformed_df),
+                                    conn=session.conn,
+                                )
+                        loaded_rows += chunk_rows
+                        row_counts[f.stem] += len(transformed_df)
+                        logging.info(f"Committed chunk {chunk_number} of {f.name} ({len(chunk)} rows)")
+                    if failed_files:
+                        # the file is not finished, so the next run resumes it
+                        raise ValueError(f"Could not extract {f.name}")
+
+                    with session.transaction():
+                        if track_files:
+                            record_files(database, [f], row_counts, STATUS_LOADED, conn=session.conn)
+                        record_checkpoint(
+                            database,
+                            checkpoint.run_id,
+                            f,
+                            STAGE_FILE,
+                            chunk_count,
+                            row_counts[f.stem],
+                            conn=session.conn,
+                        )
+                    finished.add(f)
+            finish_run(database, checkpoint.run_id, RUN_COMPLETED, conn=session.conn)
+        except Exception:
+            finish_run(database, checkpoint.run_id, RUN_FAILED, conn=session.conn)
+            if track_files:
+                unfinished = [f for f in files if f not in finished]
+                record_files(database, unfinished, row_counts, STATUS_FAILED, conn=session.conn)
+            raise
+        finally:
+            if fingerprint_index is not None:
+                fingerprint_index.save(session.conn)
+
+    if next_record_id == 0:
+        logging.warning("No data extracted from CSV files")
+    return loaded_rows
+
+
+def replay_archive(
+    database: str,
+    archive: FileArchive,
+    first: Optional[str] = None,
+    last: Optional[str] = None,
+    chunksize: int = 100000,
+    fact_keys: str = "pandas",
+    order_mode: str = "append",
+    date_formats: Optional[List[str]] = None,
+    encoding: str = LEGACY_ENCODING,
+    aggregates: bool = False,
+    fact_shards: Optional[FactShards] = None,
+    session: Optional[LoadSession] = None,
+) -> int:
+    """Load the rows of a date range from the compressed archive back into the warehouse.
+
+    The archived files holding payments in the range are read compressed, in
+    chunks, and go through the same `transform_data` and `load_batch` steps as
+    `run_chunked_pipeline`; only the rows whose PaymentDate falls in the range are
+    loaded. Each archived file is loaded in its own transaction, so an interrupted
+    backfill keeps the files it finished, and running it again with the "append"
+    order mode skips their orders. Replayed files are not recorded in the file
+    manifest again.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        archive: The FileArchive to read the files from.
+        first: The first day to load, as yyyy-mm-dd. Defaults to the earliest.
+        last: The last day to load, as yyyy-mm-dd. Defaults to the latest.
+        chunksize: The maximum number of rows read per chunk.
+        fact_keys: How the fact rows get their dimension keys, see `load_batch`.
+        order_mode: How orders that are already in fact_orders are treated, see
+            `load_data_orders`. Use "upsert" to correct orders loaded before.
+        date_formats: The formats PaymentDate is parsed with, see `parse_dates`.
+        encoding: The encoding the files are decoded with. "auto" is not supported,
+            as the archived files are compressed.
+        aggregates: Refresh the aggregate tables for the days the loaded facts
+            fall on, see `aggregates.refresh_aggregates`.
+        fact_shards: If given, load the facts into these per-period shard files,
+            see `partitions.FactShards`.
+        session: If given, load through this open LoadSession.
+
+    Returns:
+        The number of fact rows inserted or updated.
+    """
+    entries = archive.select(first, last)
+    logging.info(f"Replaying {len(entries)} archived files from {first or 'the start'} to {last or 'the end'}")
+    first_day = pd.Timestamp(first) if first else pd.Timestamp.min
+    last_day = pd.Timestamp(last) if last else pd.Timestamp.max
+    next_record_id = 0
+    loaded_rows = 0
+    with session_for(database, session) as session:
+        for entry in entries:
+            file_name = Path(entry.file_name).stem
+            aggregate_days = set() if aggregates else None
+            with file_scope(file_name), session.transaction(), shard_transaction(fact_shards, session.conn):
+                # pandas decompresses the archived file as it parses it
+                failed_files = []
+                chunks = extract_file_chunks(
+                    archive.path(entry), chunksize, encoding=encoding, failed_files=failed_files
+                )
+                for chunk in chunks:
+                    chunk["file"] = file_name
+                    transformed_df = transform_data(
+                        chunk, record_id_start=next_record_id, date_formats=date_formats
+                    )
+                    next_record_id += len(chunk)
+                    if first or last:
+                        # rows without a parseable PaymentDate are in no range
+                        transformed_df = transformed_df[
+                            transformed_df["PaymentDate"].between(first_day, last_day)
+                        ]
+                    loaded_rows += load_batch(
+                        database,
+                        transformed_df,
+                        conn=session.conn,
+                        fact_keys=fact_keys,
+                        order_mode=order_mode,
+                        aggregate_days=aggregate_days,
+                        fact_shards=fact_shards,
+                    )
+                if failed_files:
+                    raise ValueError(f"Could not extract {entry.archive_path}")
+                if aggregates:
+                    refresh_aggregates(database, aggregate_days, conn=session.conn)
+            logging.info(f"Replayed {entry.archive_path}")
+    return loaded_rows
+
+
+# marks the end of a stage's output on its queue
+_END_OF_STAGE = object()
+
+
+class _StageFailed:
+    """Passed downstream in place of a batch when a stage raised."""
+
+    def __init__(self, error: Exception) -> None:
+        self.error = error
+
+
+def _put(stage_queue: queue.Queue, item, stop: threading.Event) -> bool:
+    # block while the queue is full, but give up once the run is stopped
+    while not stop.is_set():
+        try:
+            stage_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _run_stage(
+    name: str,
+    batches: Callable[[], Iterator[pd.DataFrame]],
+    out_queue: queue.Queue,
+    stop: threading.Event,
+) -> threading.Thread:
+    def target() -> None:
+        try:
+            for batch in batches():
+                if not _put(out_queue, batch, stop):
+                    return
+        except Exception as e:
+            _put(out_queue, _StageFailed(e), stop)
+            return
+        _put(out_queue, _END_OF_STAGE, stop)
+
+    thread = threading.Thread(target=target, name=f"pipeline-{name}", daemon=True)
+    thread.start()
+    return thread
+
+
+def _drain(stage_queue: queue.Queue, stop: threading.Event) -> Iterator[pd.DataFrame]:
+    while not stop.is_set():
+        try:
+            item = stage_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _END_OF_STAGE:
+            return
+        if isinstance(item, _StageFailed):
+            raise item.error
+        yield item
+
+
+def run_pipelined(
+    database: str,
+    files: List[Path],
+    chunksize: Optional[int] = None,
+    queue_size: int = 2,
+    fact_keys: str = "pandas",
+    order_mode: str = "insert",
+    track_files: bool = False,
+    fingerprint_index: Optional[FingerprintIndex] = None,
+    compact: bool = False,
+    date_formats: Optional[List[str]] = None,
+    engine: str = "pandas",
+    encoding: str = LEGACY_ENCODING,
+    cache: Optional[ParsedFileCache] = None,
+    validation_rules: Optional[List[Rule]] = None,
+    reject_dir: Optional[str] = None,
+    aggregates: bool = False,
+    fact_shards: Optional[FactShards] = None,
+    session: Optional[LoadSession] = None,
+) -> int:
+    """Extract, transform and load the files with the three stages overlapping.
+
+    Extraction and transformation each run in their own thread and hand batches,
+    one per file or per chunk, to the next stage through queues of at most
+    `queue_size` batches. The load runs in the calling thread. While a batch is
+    being written to SQLite the next ones are parsed and transformed, so the run
+    takes about as long as its slowest stage rather than the sum of all three;
+    the CSV parser, pyarrow and SQLite release the GIL for most of their work.
+    The bounded queues keep at most a few batches in memory.
+
+    As in `run_chunked_pipeline`, RecordIds continue across batches and all
+    batches are loaded in one transaction of a LoadSession. As there, the default
+    "insert" order mode skips the exact duplicates of fact rows loaded by an earlier
+    batch and fails on conflicting ones. If any stage
+    fails, the others are stopped and the transaction is rolled back. A file that
+    cannot be extracted is recorded as failed, or fails the run with `chunksize`.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        files: A list of Path objects representing the CSV files to process.
+        chunksize: If set, the batches are chunks of at most this many rows
+            rather than whole files.
+        queue_size: The maximum number of batches waiting between two stages.
+        fact_keys: How the fact rows get their dimension keys, see `load_batch`.
+        order_mode: How orders that are already in fact_orders are treated, see
+            `load_data_orders`.
+        track_files: Record the files and their row counts in the file manifest,
+            in the load transaction if it succeeds, as failed otherwise.
+        fingerprint_index: If given, drop rows already loaded by earlier runs, see
+            `load_batch`.
+        compact: Hold the extracted text columns in the compact categorical and
+            arrow-backed representation, see `input_schema`.
+        date_formats: The formats PaymentDate is parsed with, see `parse_dates`.
+        engine: The CSV reader backend, see `readers.read_csv`.
+        encoding: The encoding the files are decoded with, or "auto" to detect it
+            per file.
+        cache: If given, whole files are read from and stored in this parsed-file
+            cache. Not used with `chunksize`.
+        validation_rules: If given, rows failing these rules are quarantined
+            before the transform, see `validation.validate_rows`.
+        reject_dir: The folder the rejected rows, and the lines skipped by the
+            CSV reader, are written to once the load commits, one reject file per
+            input file, see `validation.staged_rejects`.
+        aggregates: Refresh the aggregate tables for the days the loaded facts
+            fall on, in the load transaction, see `aggregates.refresh_aggregates`.
+        fact_shards: If given, load the facts into these per-period shard files,
+            committed just before the core database, see `partitions.FactShards`.
+        session: If given, load through this open LoadSession instead of opening
+            a new one, e.g. to keep one warm connection across the micro-batches
+            of `watch.watch_folder`.
+
+    Returns:
+        The number of fact rows inserted or updated.
+    """
+    load_date = current_load_date()
+    failed_files = []
+    stop = threading.Event()
+    extracted = queue.Queue(maxsize=queue_size)
+    transformed = queue.Queue(maxsize=queue_size)
+
+    def extract_batches() -> Iterator[pd.DataFrame]:
+        for f in files:
+            if chunksize:
+                batches = extract_file_chunks(
+                    f,
+                    chunksize,
+                    compact=compact,
+                    engine=engine,
+                    encoding=encoding,
+                    failed_files=failed_files,
+                    reject_dir=reject_staging,
+                )
+            else:
+                data = extract_file(
+                    f,
+                    compact=compact,
+                    engine=engine,
+                    encoding=encoding,
+                    cache=cache,
+                    reject_dir=reject_staging,
+                )
+                if data is None:
+                    failed_files.append(f)
+                batches = [] if data is None else [data]
+            for batch in batches:
+                batch["file"] = f.stem
+                yield batch.reset_index(drop=True)
+
+    def transform_batches() -> Iterator[pd.DataFrame]:
+        next_record_id = 0
+        for batch in _drain(extracted, stop):
+            with file_scope(batch_file(batch)):
+                if validation_rules is not None:
+                    batch = validate_rows(batch, validation_rules, reject_staging)
+                yield transform_data(
+                    batch,
+                    record_id_start=next_record_id,
+                    load_date=load_date,
+                    date_formats=date_formats,
+                )
+            next_record_id += len(batch)
+
+    loaded_rows = 0
+    row_counts = Counter()
+    aggregate_days = set() if aggregates else None
+    with staged_rejects(reject_dir, files) as reject_staging:
+        threads = [
+            _run_stage("extract", extract_batches, extracted, stop),
+            _run_stage("transform", transform_batches, transformed, stop),
+        ]
+        try:
+            with session_for(database, session) as session:
+                with session.transaction(), shard_transaction(fact_shards, session.conn):
+                    for batch_number, transformed_df in enumerate(_drain(transformed, stop)):
+                        row_counts.update(file_row_counts(transformed_df))
+                        with file_scope(batch_file(transformed_df)):
+                            loaded_rows += load_batch(
+                                database,
+                                transformed_df,
+                                conn=session.conn,
+                                fact_keys=fact_keys,
+                                order_mode=order_mode,
+                                fingerprint_index=fingerprint_index,
+                                aggregate_days=aggregate_days,
+                                fact_shards=fact_shards,
+                            )
+                        logging.info(f"Loaded batch {batch_number} ({len(transformed_df)} rows)")
+                    if chunksize and failed_files:
+                        # the chunks read before the error are in this transaction
+                        raise ValueError(
+                            f"Could not extract {', '.join(f.name for f in failed_files)}"
+                        )
+                    if aggregates:
+                        refresh_aggregates(database, aggregate_days, conn=session.conn)
+                    if track_files:
+                        record_batch_files(
+                            database, files, failed_files, row_counts, conn=session.conn
+                        )
+                if fingerprint_index is not None:
+                    fingerprint_index.save(session.conn)
+        except Exception:
+            if track_files:
+                record_files(database, files, row_counts, STATUS_FAILED)
+            raise
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    if not row_counts:
+        logging.warning("No data extracted from CSV files")
+    return loaded_rows
@@ -0,0 +1,400 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+from urllib.parse import parse_qsl, urlsplit
+
+from .db_helper import get_load_generation
+from .partitions import attach_shards
+
+# the pragmas of the pooled read-only connections
+READ_PRAGMAS = {
+    "cache_size": -16000,  # negative values are in KiB, i.e. 16 MiB per connection
+    "temp_store": "MEMORY",
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+
+class CannedQuery(NamedTuple):
+    """A parameterized query the service runs on request.
+
+    Args:
+        sql: The query, with :name placeholders. `{facts}` is replaced by the
+            fact table, or by the view over the shards of a partitioned warehouse.
+        params: The parameters with their default values. A value passed as a
+            string, e.g. from a URL, is converted to the type of its default.
+        description: What the query returns.
+    """
+
+    sql: str
+    params: Dict[str, Any]
+    description: str
+
+
+CANNED_QUERIES = {
+    "daily_revenue": CannedQuery(
+        """
+        SELECT sale_date, product_type, currency, order_count, units, revenue
+        FROM agg_daily_revenue
+        WHERE sale_date BETWEEN :first AND :last
+        ORDER BY sale_date, product_type, currency
+        """,
+        {"first": "1900-01-01", "last": "2999-12-31"},
+        "Orders, units and revenue per day, product type and currency.",
+    ),
+    "monthly_revenue_by_country": CannedQuery(
+        """
+        SELECT sale_month, delivery_country, currency, order_count, units, revenue
+        FROM agg_monthly_revenue_by_country
+        WHERE sale_month BETWEEN :first AND :last
+        ORDER BY sale_month, delivery_country, currency
+        """,
+        {"first": "1900-01", "last": "2999-12"},
+        "Orders, units and revenue per month, client country and currency.",
+    ),
+    "top_products": CannedQuery(
+        """
+        SELECT pr.product_name, pr.product_type, p.currency,
+               COUNT(*) AS order_count, SUM(f.product_quantity) AS units, SUM(f.total_price) AS revenue
+        FROM dim_payment p
+        CROSS JOIN {facts} f ON f.payment_key = p.payment_key
+        JOIN dim_products pr ON pr.product_key = f.product_key
+        WHERE p.payment_date >= :first AND p.payment_date < date(:last, '+1 day')
+        GROUP BY pr.product_key, p.currency
+        ORDER BY revenue DESC
+        LIMIT :limit
+        """,
+        {"first": "1900-01-01", "last": "2999-12-31", "limit": 10},
+        "The products with the highest revenue between two payment dates.",
+    ),
+    "top_clients": CannedQuery(
+        """
+        SELECT c.client_name, c.delivery_country, p.currency,
+               COUNT(*) AS order_count, SUM(f.total_price) AS revenue
+        FROM dim_payment p
+        CROSS JOIN {facts} f ON f.payment_key = p.payment_key
+        JOIN dim_clients c ON c.client_key = f.client_key
+        WHERE p.payment_date >= :first AND p.payment_date < date(:last, '+1 day')
+        GROUP BY c.client_key, p.currency
+        ORDER BY revenue DESC
+        LIMIT :limit
+        """,
+        {"first": "1900-01-01", "last": "2999-12-31", "limit": 10},
+        "The clients with the highest revenue between two payment dates.",
+    ),
+    "order": CannedQuery(
+        """
+        SELECT f.order_number, c.client_name, pr.product_name, pr.product_type,
+               f.unit_price, f.product_quantity, f.total_price, p.currency,
+               p.payment_type, p.payment_billing_code, p.payment_date
+        FROM {facts} f
+        JOIN dim_clients c ON c.client_key = f.client_key
+        JOIN dim_products pr ON pr.product_key = f.product_key
+        JOIN dim_payment p ON p.payment_key = f.payment_key
+        WHERE f.order_number = :order_number
+        """,
+        {"order_number": ""},
+        "One order with its client, product and payment.",
+    ),
+}
+
+
+class QueryResult(NamedTuple):
+    """The result of a canned query.
+
+    Args:
+        columns: The column names.
+        rows: The rows, as tuples.
+        generation: The load generation the rows were read at.
+        cached: Whether the rows came from the result cache.
+    """
+
+    columns: List[str]
+    rows: List[tuple]
+    generation: int
+    cached: bool
+
+
+class ReadOnlyPool:
+    """A fixed-size pool of read-only connections to a warehouse.
+
+    The connections are opened with mode=ro and query_only, so a bug in a query
+    can never write to the warehouse. In WAL mode readers do not block the loader
+    and the loader does not block readers; each query sees the last committed
+    load. Connections are opened on first use and can be borrowed from any thread.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        size: The maximum number of open connections.
+        shard_dir: If given, the fact shards in this folder are attached to each
+            connection as the fact_orders_all view, see `partitions.attach_shards`.
+        shard_range: The (first, last) shard keys to attach, e.g. to stay within
+            SQLite's limit on attached databases.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        size: int = 4,
+        shard_dir: Optional[Union[str, Path]] = None,
+        shard_range: Tuple[Optional[str], Optional[str]] = (None, None),
+    ) -> None:
+        self.database = database
+        self.size = size
+        self.shard_dir = shard_dir
+        self.shard_range = shard_range
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        # connections opened before the last reset are closed when returned
+        self.epoch = 0
+        self.epochs = {}
+        self.lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        uri = f"{Path(self.database).resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        for name, value in READ_PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        if self.shard_dir is not None:
+            first, last = self.shard_range
+            attach_shards(conn, self.shard_dir, first=first, last=last)
+        # set last, as the shard view is a TEMP view
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection, waiting for one to be returned if all are in use."""
+        conn = None
+        while conn is None:
+            try:
+                conn = self.idle.get_nowait()
+                continue
+            except queue.Empty:
+                pass
+            with self.lock:
+                can_open = self.opened < self.size
+                self.opened += can_open
+            if can_open:
+                try:
+                    conn = self._open()
+                except BaseException:
+                    with self.lock:
+                        self.opened -= 1
+                    raise
+                with self.lock:
+                    self.epochs[conn] = self.epoch
+            else:
+                # also wakes up when a connection of an earlier epoch was discarded
+                try:
+                    conn = self.idle.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        try:
+            yield conn
+        finally:
+            if self.epochs.get(conn) == self.epoch:
+                self.idle.put(conn)
+            else:
+                self._discard(conn)
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        conn.close()
+        with self.lock:
+            self.epochs.pop(conn, None)
+            self.opened -= 1
+
+    def reset(self) -> None:
+        """Replace all connections, e.g. so newly created shards get attached.
+
+        Idle connections are closed now, borrowed ones when they are returned.
+        """
+        with self.lock:
+            self.epoch += 1
+        self.close()
+
+    def close(self) -> None:
+        """Close the idle connections; the pool opens new ones when used again."""
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+class QueryService:
+    """Run canned queries over the warehouse, caching results until the next load.
+
+    Results are cached per query and parameters. Every load bumps the load
+    generation in the load transaction, see `db_helper.bump_load_generation`;
+    a lookup first reads the current generation, a single-row query, and the
+    whole cache is dropped once it moved, so a result is never older than the
+    last committed load. Repeated dashboard queries are answered from memory
+    between loads.
+
+    Example:
+        service = QueryService(database)
+        service.run("top_products", first="2021-01-01", last="2021-03-31", limit=5).rows
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        pool_size: The number of read-only connections, see ReadOnlyPool.
+        cache_entries: The maximum number of cached results, least recently used
+            dropped first.
+        shard_dir: If given, the canned queries read the facts from the shards in
+            this folder, see ReadOnlyPool.
+        shard_range: The (first, last) shard keys to attach.
+        queries: The canned queries offered. Defaults to CANNED_QUERIES.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        pool_size: int = 4,
+        cache_entries: int = 256,
+        shard_dir: Optional[Union[str, Path]] = None,
+        shard_range: Tuple[Optional[str], Optional[str]] = (None, None),
+        queries: Optional[Dict[str, CannedQuery]] = None,
+    ) -> None:
+        self.pool = ReadOnlyPool(database, pool_size, shard_dir, shard_range)
+        self.cache_entries = cache_entries
+        self.queries = CANNED_QUERIES if queries is None else queries
+        self.facts = "fact_orders" if shard_dir is None else "fact_orders_all"
+        self.cache = OrderedDict()
+        self.generation = None
+        self.lock = threading.Lock()
+
+    def bind(self, name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the parameters of a canned query, with defaults and converted types.
+
+        Raises:
+            KeyError: If there is no such query.
+            ValueError: If a parameter is unknown or cannot be converted.
+        """
+        query = self.queries[name]
+        unknown = set(params) - set(query.params)
+        if unknown:
+            raise ValueError(f"Unknown parameters for {name}: {sorted(unknown)}")
+        bound = dict(query.params)
+        for param, value in params.items():
+            default = query.params[param]
+            bound[param] = type(default)(value) if isinstance(value, str) else value
+        return bound
+
+    def run(self, name: str, **params) -> QueryResult:
+        """Run a canned query, from the cache if the warehouse did not change since.
+
+        Args:
+            name: The name of the query in `queries`.
+            **params: The query's parameters; the others take their default.
+
+        Returns:
+            A QueryResult.
+        """
+        bound = self.bind(name, params)
+        key = (name, tuple(sorted(bound.items())))
+        with self.pool.connection() as conn:
+            generation = get_load_generation(conn)
+            with self.lock:
+                if generation != self.generation:
+                    if self.generation is not None:
+                        logging.info(f"Load generation {generation}, query cache cleared")
+                        if self.pool.shard_dir is not None:
+                            # new shards are attached by the connections opened next
+                            self.pool.reset()
+                    self.cache.clear()
+                    self.generation = generation
+                elif key in self.cache:
+                    self.cache.move_to_end(key)
+                    columns, rows = self.cache[key]
+                    return QueryResult(columns, rows, generation, True)
+
+            started = time.perf_counter()
+            cursor = conn.execute(self.queries[name].sql.format(facts=self.facts), bound)
+            rows = cursor.fetchall()
+            columns = [column[0] for column in cursor.description]
+            logging.info(
+                f"Query {name} returned {len(rows)} rows in "
+                f"{time.perf_counter() - started:.3f}s"
+            )
+
+        with self.lock:
+            # a load may have committed meanwhile; only cache rows of the current generation
+            if generation == self.generation:
+                self.cache[key] = (columns, rows)
+                while len(self.cache) > self.cache_entries:
+                    self.cache.popitem(last=False)
+        return QueryResult(columns, rows, generation, False)
+
+    def close(self) -> None:
+        """Close the pooled connections."""
+        self.pool.close()
+
+
+def make_handler(service: QueryService) -> type:
+    """Return an HTTP request handler class answering from `service`.
+
+    GET /queries lists the canned queries with their parameters, and
+    GET /query/<name>?param=value runs one and returns its result as JSON.
+    """
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+            payload = json.dumps(body, default=str).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self) -> None:
+            url = urlsplit(self.path)
+            parts = [part for part in url.path.split("/") if part]
+            if parts == ["queries"]:
+                self._send_json(
+                    200,
+                    {
+                        name: {"params": query.params, "description": query.description}
+                        for name, query in service.queries.items()
+                    },
+                )
+                return
+            if len(parts) != 2 or parts[0] != "query" or parts[1] not in service.queries:
+                self._send_json(404, {"error": f"No such query: {url.path}"})
+                return
+            try:
+                result = service.run(parts[1], **dict(parse_qsl(url.query)))
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            except sqlite3.Error as e:
+                logging.error(f"Query {parts[1]} failed: {e}", exc_info=True)
+                self._send_json(500, {"error": str(e)})
+                return
+            self._send_json(200, result._asdict())
+
+        def log_message(self, format: str, *args) -> None:
+            logging.info(f"{self.address_string()} {format % args}")
+
+    return QueryHandler
+
+
+def make_server(
+    service: QueryService, host: str = "127.0.0.1", port: int = 8765
+) -> ThreadingHTTPServer:
+    """Create the HTTP server of the query service, bound to localhost by default.
+
+    Each request is handled in its own thread, borrowing a pooled connection.
+    Call `serve_forever` on the result to serve requests.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    logging.info(f"Serving queries on http://{host}:{server.server_address[1]}")
+    return server
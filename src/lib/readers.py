@@ -0,0 +1,365 @@
+import codecs
+import csv
+import itertools
+import logging
+from importlib.util import find_spec
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .schema import LEGACY_ENCODING, PANDAS_NA_VALUES
+
+CSV_ENGINES = ("pandas", "pyarrow")
+
+
+# pick the encoding of each file from its content, see `detect_encoding`
+AUTO_ENCODING = "auto"
+
+DETECT_BLOCK_SIZE = 1024 * 1024
+
+# the pyarrow engine and arrow-backed strings need the optional pyarrow package
+HAS_PYARROW = find_spec("pyarrow") is not None
+
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+class ShortRowsError(ValueError):
+    """Raised by the pyarrow engine for rows with fewer fields than the header."""
+
+
+def detect_encoding(file_path: Path) -> str:
+    """Pick the encoding to read a CSV file with.
+
+    A file that starts with a byte order mark is read with the matching Unicode
+    encoding. A file of plain ASCII without backslashes decodes the same under
+    every candidate, so it is read as UTF-8, which the fast parsers handle
+    natively. Other valid UTF-8 files are read as UTF-8 too, which decodes their
+    accented characters correctly where the legacy decoding produced mojibake.
+    Anything else keeps the legacy "unicode_escape" decoding.
+
+    Args:
+        file_path: A Path object representing the file path.
+
+    Returns:
+        The name of a Python codec.
+    """
+    with open(file_path, "rb") as f:
+        head = f.read(4)
+        for bom, encoding in BOMS:
+            if head.startswith(bom):
+                return encoding
+
+        f.seek(0)
+        ascii_only = True
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        for block in iter(lambda: f.read(DETECT_BLOCK_SIZE), b""):
+            if b"\\" in block:
+                # backslash escapes are decoded by the legacy decoding only
+                return LEGACY_ENCODING
+            if ascii_only and block.isascii():
+                continue
+            ascii_only = False
+            try:
+                decoder.decode(block)
+            except UnicodeDecodeError:
+                return LEGACY_ENCODING
+        try:
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return LEGACY_ENCODING
+    return "utf-8"
+
+
+def resolve_encoding(file_path: Path, encoding: str) -> str:
+    """Return `encoding`, or the detected encoding of the file if it is "auto"."""
+    if encoding == AUTO_ENCODING:
+        encoding = detect_encoding(file_path)
+        logging.info(f"Reading {Path(file_path).name} as {encoding}")
+    return encoding
+
+
+def _read_csv_pandas(
+    file_path: Path,
+    dtype: Dict[str, object],
+    encoding: str,
+    bad_lines: Optional[List[List[str]]] = None,
+    **kwargs,
+):
+    options = dict(on_bad_lines="skip")
+    if bad_lines is not None:
+        # only the python parser hands the lines it skips to a callable
+        options.update(engine="python", on_bad_lines=bad_lines.append)
+    options.update(kwargs)
+    return pd.read_csv(file_path, dtype=dtype, encoding=encoding, header=[0], **options)
+
+
+def _read_whole_csv_pandas(
+    file_path: Path,
+    dtype: Dict[str, object],
+    encoding: str,
+    bad_lines: Optional[List[List[str]]] = None,
+) -> pd.DataFrame:
+    if bad_lines is None:
+        return _read_csv_pandas(file_path, dtype, encoding)
+    # the C parser stops at the first line with too many fields; only a file
+    # that has one is read again with the much slower python parser
+    try:
+        return _read_csv_pandas(file_path, dtype, encoding, on_bad_lines="error")
+    except pd.errors.ParserError:
+        df = _read_csv_pandas(file_path, dtype, encoding, bad_lines)
+    _log_bad_lines(file_path, bad_lines)
+    return df
+
+
+def _read_csv_chunks_pandas(
+    file_path: Path,
+    dtype: Dict[str, object],
+    chunksize: int,
+    encoding: str,
+    bad_lines: Optional[List[List[str]]] = None,
+) -> Iterator[pd.DataFrame]:
+    if bad_lines is None:
+        with _read_csv_pandas(file_path, dtype, encoding, chunksize=chunksize) as reader:
+            yield from reader
+        return
+
+    # as in `_read_whole_csv_pandas`, but the C parser has already yielded the
+    # rows before the first bad line, which the python parser then skips
+    start = 0
+    try:
+        with _read_csv_pandas(
+            file_path, dtype, encoding, chunksize=chunksize, on_bad_lines="error"
+        ) as reader:
+            for chunk in reader:
+                yield chunk
+                start += len(chunk)
+        return
+    except pd.errors.ParserError:
+        pass
+    with _read_csv_pandas(
+        file_path, dtype, encoding, bad_lines, chunksize=chunksize
+    ) as reader:
+        for chunk in reader:
+            chunk = chunk[chunk.index >= start]
+            if len(chunk) > 0:
+                yield chunk
+    _log_bad_lines(file_path, bad_lines)
+
+
+def _log_bad_lines(file_path: Path, bad_lines: List[List[str]]) -> None:
+    if bad_lines:
+        logging.warning(
+            f"Skipped {len(bad_lines)} lines with more fields than the header in {Path(file_path).name}"
+        )
+
+
+def _arrow_type(dtype: object):
+    import pyarrow as pa
+
+    if dtype is float or dtype == "float64":
+        return pa.float64()
+    if dtype == "int64":
+        return pa.int64()
+    # text columns, including the compact categorical and arrow-backed ones
+    return pa.string()
+
+
+def _pyarrow_csv_options(
+    dtype: Dict[str, object],
+    encoding: str,
+    short_rows: List[int],
+    long_rows: Optional[List[List[str]]] = None,
+) -> dict:
+    import pyarrow.csv as pv
+
+    def skip_invalid_row(row) -> str:
+        # pandas pads short rows with NaN, which pyarrow cannot do; record them
+        # so the caller can fall back to the pandas engine
+        if row.actual_columns < row.expected_columns:
+            short_rows.append(row.actual_columns)
+        elif long_rows is not None:
+            long_rows.append(next(csv.reader([row.text])))
+        return "skip"
+
+    # pyarrow decodes UTF-8 natively and transcodes other encodings through Python
+    codec = codecs.lookup(encoding).name
+    return dict(
+        read_options=pv.ReadOptions(encoding="utf8" if codec == "utf-8" else encoding),
+        parse_options=pv.ParseOptions(invalid_row_handler=skip_invalid_row),
+        convert_options=pv.ConvertOptions(
+            column_types={column: _arrow_type(t) for column, t in dtype.items()},
+            null_values=PANDAS_NA_VALUES,
+            strings_can_be_null=True,
+        ),
+    )
+
+
+def _resolve_engine(engine: str) -> str:
+    if engine not in CSV_ENGINES:
+        raise ValueError(f"engine must be one of {CSV_ENGINES}, got {engine!r}")
+    if engine == "pyarrow" and not HAS_PYARROW:
+        logging.warning("pyarrow is not installed, reading with the pandas engine")
+        return "pandas"
+    return engine
+
+
+def arrow_to_pandas(table, dtype: Dict[str, object]) -> pd.DataFrame:
+    """Convert a pyarrow Table to a DataFrame with the same dtypes as the pandas engine.
+
+    Args:
+        table: A pyarrow Table read by the pyarrow engine or from the parsed-file cache.
+        dtype: The dtypes the columns were read with, see `etl.input_schema`.
+
+    Returns:
+        A pandas DataFrame.
+    """
+    df = table.to_pandas()
+    for column in df.columns:
+        if column not in dtype:
+            continue
+        if dtype[column] is str:
+            # pyarrow leaves None in missing text fields where pandas puts NaN;
+            # patch the object array in place, through arrow's own null mask
+            if table.column(column).null_count > 0:
+                values = df[column].to_numpy()
+                values[table.column(column).is_null().to_numpy(zero_copy_only=False)] = np.nan
+        else:
+            # integer columns with missing values come back as float and fail
+            # here, as they do in pandas
+            df[column] = df[column].astype(dtype[column])
+    return df
+
+
+def read_csv(
+    file_path: Path,
+    dtype: Dict[str, object],
+    engine: str = "pandas",
+    encoding: str = LEGACY_ENCODING,
+    bad_lines: Optional[List[List[str]]] = None,
+) -> pd.DataFrame:
+    """Read a whole CSV file with the given reader backend.
+
+    Both engines read the header from the first line, apply `dtype` and skip rows
+    with more fields than the header, which can be collected in `bad_lines`. The "pyarrow" engine parses the
+    memory-mapped file with pyarrow.csv on several threads, which is much faster
+    on wide files, especially once they are read as UTF-8. Its output is
+    converted to the same dtypes as the "pandas" engine's. Rows with fewer fields
+    than the header, which pandas pads with NaN, are not supported by pyarrow, so
+    a file that has any is read again with the pandas engine.
+
+    Args:
+        file_path: A Path object representing the file path.
+        dtype: The dtypes to read the columns with, see `etl.input_schema`.
+        engine: One of CSV_ENGINES.
+        encoding: A Python codec name, or "auto" to pick one per file with
+            `detect_encoding`.
+        bad_lines: If given, the fields of the skipped rows are appended to this
+            list. With the pandas engine, a file that has any is parsed a second
+            time, with pandas' slower python parser.
+
+    Returns:
+        A pandas DataFrame.
+    """
+    engine = _resolve_engine(engine)
+    encoding = resolve_encoding(file_path, encoding)
+    if engine == "pandas":
+        return _read_whole_csv_pandas(file_path, dtype, encoding, bad_lines)
+
+    import pyarrow as pa
+    import pyarrow.csv as pv
+
+    short_rows, long_rows = [], []
+    table = pv.read_csv(
+        pa.memory_map(str(file_path)),
+        **_pyarrow_csv_options(dtype, encoding, short_rows, long_rows),
+    )
+    if short_rows:
+        logging.info(
+            f"{len(short_rows)} short rows in {Path(file_path).name}, reading it with the pandas engine"
+        )
+        return _read_whole_csv_pandas(file_path, dtype, encoding, bad_lines)
+    _log_bad_lines(file_path, long_rows)
+    if bad_lines is not None:
+        bad_lines.extend(long_rows)
+    return arrow_to_pandas(table, dtype)
+
+
+def read_csv_chunks(
+    file_path: Path,
+    dtype: Dict[str, object],
+    chunksize: int,
+    engine: str = "pandas",
+    encoding: str = LEGACY_ENCODING,
+    bad_lines: Optional[List[List[str]]] = None,
+) -> Iterator[pd.DataFrame]:
+    """Read a CSV file in chunks of at most `chunksize` rows.
+
+    See `read_csv` for the engines. The pyarrow engine streams the file in
+    blocks. Short rows found before the first chunk is yielded switch the file to
+    the pandas engine as in `read_csv`; found later, they raise a ShortRowsError.
+
+    Args:
+        file_path: A Path object representing the file path.
+        dtype: The dtypes to read the columns with, see `etl.input_schema`.
+        chunksize: The maximum number of rows per chunk.
+        engine: One of CSV_ENGINES.
+        encoding: A Python codec name, or "auto" to pick one per file.
+        bad_lines: If given, the fields of the skipped rows are appended to this
+            list, at the latest when the chunk after them is yielded, see `read_csv`.
+
+    Yields:
+        pandas DataFrames with an index continuing across chunks, as pandas' own
+        chunked reader produces.
+    """
+    engine = _resolve_engine(engine)
+    encoding = resolve_encoding(file_path, encoding)
+    if engine == "pandas":
+        yield from _read_csv_chunks_pandas(file_path, dtype, chunksize, encoding, bad_lines)
+        return
+
+    import pyarrow as pa
+    import pyarrow.csv as pv
+
+    short_rows, long_rows = [], []
+    reader = pv.open_csv(
+        pa.memory_map(str(file_path)),
+        **_pyarrow_csv_options(dtype, encoding, short_rows, long_rows),
+    )
+    buffered, buffered_rows, start, reported = [], 0, 0, 0
+    for batch in itertools.chain(reader, [None]):
+        if short_rows:
+            if start > 0:
+                raise ShortRowsError(
+                    f"{len(short_rows)} rows with missing fields in {file_path}"
+                )
+            logging.info(
+                f"Short rows in {Path(file_path).name}, reading it with the pandas engine"
+            )
+            yield from read_csv_chunks(file_path, dtype, chunksize, "pandas", encoding, bad_lines)
+            return
+        if bad_lines is not None:
+            # hand the skipped rows over before the chunks that follow them
+            bad_lines.extend(long_rows[reported:])
+            reported = len(long_rows)
+        if batch is not None:
+            buffered.append(batch)
+            buffered_rows += batch.num_rows
+
+        # cut full chunks, and the remainder once the file is exhausted
+        while buffered_rows >= chunksize or (batch is None and buffered_rows > 0):
+            table = pa.Table.from_batches(buffered, schema=reader.schema)
+            chunk = arrow_to_pandas(table.slice(0, chunksize), dtype)
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            yield chunk
+            start += len(chunk)
+            buffered = table.slice(chunksize).to_batches()
+            buffered_rows -= len(chunk)
+    _log_bad_lines(file_path, long_rows)
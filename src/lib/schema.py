@@ -0,0 +1,49 @@
+# The input format shared by the pandas pipeline and the small-batch path. Kept
+# free of heavy imports, so the command line starts fast.
+
+INPUT_SCHEMA = {
+    "OrderNumber": str,
+    "ClientName": str,
+    "ProductName": str,
+    "ProductType": str,
+    "UnitPrice": float,
+    "ProductQuantity": "int64",
+    "TotalPrice": float,
+    "Currency": str,
+    "DeliveryAddress": str,
+    "DeliveryCity": str,
+    "DeliveryPostcode": str,
+    "DeliveryCountry": str,
+    "DeliveryContactNumber": str,
+    "PaymentType": str,
+    "PaymentBillingCode": str,
+    "PaymentDate": str,
+}
+
+# formats tried in order when parsing PaymentDate; the source files use dd/mm/yyyy
+PAYMENT_DATE_FORMATS = ["%d/%m/%Y", "%Y-%m-%d"]
+
+# the decoding the CSV files have always been read with
+LEGACY_ENCODING = "unicode_escape"
+
+# the values pandas reads as missing by default, so the pyarrow engine agrees
+PANDAS_NA_VALUES = [
+    "",
+    "#N/A",
+    "#N/A N/A",
+    "#NA",
+    "-1.#IND",
+    "-1.#QNAN",
+    "-NaN",
+    "-nan",
+    "1.#IND",
+    "1.#QNAN",
+    "<NA>",
+    "N/A",
+    "NA",
+    "NULL",
+    "NaN",
+    "n/a",
+    "nan",
+    "null",
+]
@@ -0,0 +1,267 @@
+import csv
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .aggregates import order_days, payment_days, refresh_aggregates
+from .db_helper import (
+    CLIENT_INSERT_QUERY,
+    PAYMENT_INSERT_QUERY,
+    PRODUCT_INSERT_QUERY,
+    LoadSession,
+    bump_load_generation,
+    insert_mode_condition,
+    order_conflict_clause,
+    session_for,
+)
+from .manifest import STATUS_FAILED, STATUS_LOADED, record_files
+from .metrics import instrument
+from .schema import INPUT_SCHEMA, LEGACY_ENCODING, PANDAS_NA_VALUES, PAYMENT_DATE_FORMATS
+
+# batches of files adding up to less than this many bytes are loaded without pandas
+SMALL_BATCH_BYTES = 1024 * 1024
+
+NA_VALUES = frozenset(PANDAS_NA_VALUES)
+
+CLIENT_COLUMNS = [
+    "ClientName",
+    "DeliveryAddress",
+    "DeliveryCity",
+    "DeliveryPostcode",
+    "DeliveryCountry",
+    "DeliveryContactNumber",
+]
+
+# in the order of the FACT_INSERT_QUERY parameters; the first four are the key
+# `create_fact_orders` drops duplicates on
+FACT_COLUMNS = [
+    "OrderNumber",
+    "UnitPrice",
+    "ProductQuantity",
+    "TotalPrice",
+    "ClientName",
+    "ProductName",
+    "PaymentBillingCode",
+]
+
+# the fact rows get their dimension keys from the natural keys, like `load_fact_orders_staged`;
+# rows whose dimensions are missing select nothing, as the inner merges of `create_fact_orders`
+FACT_INSERT_QUERY = """
+INSERT INTO fact_orders (order_number, client_key, product_key, payment_key, unit_price, product_quantity, total_price)
+SELECT ?, c.client_key, p.product_key, pay.payment_key, ?, ?, ?
+FROM dim_clients c, dim_products p, dim_payment pay
+WHERE c.client_name = ? AND p.product_name = ? AND pay.payment_billing_code = ?
+{conflict_clause}
+"""
+
+
+def is_small_batch(files: List[Path], max_bytes: int = SMALL_BATCH_BYTES) -> bool:
+    """Return whether the files are small enough in total for `load_small_files`."""
+    return sum(os.path.getsize(f) for f in files) < max_bytes
+
+
+def iter_rows(
+    file_path: Path, encoding: str = LEGACY_ENCODING, on_bad_lines: str = "skip"
+) -> Iterator[Dict[str, Optional[str]]]:
+    """Stream the rows of a CSV file as dicts with the csv module, the way pandas reads it.
+
+    As with `readers.read_csv`, blank lines and rows with more fields than the
+    header are skipped, short rows are padded, and the values pandas treats as
+    missing are read as None.
+
+    Args:
+        file_path: A Path object representing the file path.
+        encoding: The encoding the file is decoded with.
+        on_bad_lines: "skip" to skip the rows with more fields than the header,
+            "error" to raise a ValueError for them.
+
+    Raises:
+        ValueError: If a column of INPUT_SCHEMA is missing or the file is not
+            valid CSV.
+    """
+    with open(file_path, newline="", encoding=encoding) as f:
+        reader = csv.reader(f)
+        try:
+            header = next(reader, [])
+            missing = [column for column in INPUT_SCHEMA if column not in header]
+            if missing:
+                raise ValueError(f"{Path(file_path).name} has no columns {missing}")
+            for fields in reader:
+                if len(fields) > len(header) and on_bad_lines == "error":
+                    raise ValueError(
+                        f"{Path(file_path).name} has lines with more fields than the header"
+                    )
+                if not fields or len(fields) > len(header):
+                    continue
+                fields += [""] * (len(header) - len(fields))
+                yield {
+                    column: None if value in NA_VALUES else value
+                    for column, value in zip(header, fields)
+                }
+        except csv.Error as e:
+            raise ValueError(f"Could not parse {Path(file_path).name}: {e}") from e
+
+
+def read_rows(file_path: Path, encoding: str = LEGACY_ENCODING) -> List[Dict[str, Optional[str]]]:
+    """Read all rows of a CSV file into a list of dicts, see `iter_rows`.
+
+    Rows with more fields than the header raise a ValueError rather than being
+    skipped, so such files fall back to the pandas path, which rejects them.
+    """
+    return list(iter_rows(file_path, encoding, on_bad_lines="error"))
+
+
+def parse_payment_date(value: Optional[str], formats: List[str]) -> Optional[str]:
+    """Parse a PaymentDate string into the yyyy-mm-dd form the loads store.
+
+    Returns:
+        The formatted date, or None if the value is missing or no format matches.
+    """
+    for date_format in formats:
+        try:
+            return datetime.strptime(value, date_format).strftime("%Y-%m-%d")
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def transform_rows(
+    rows: List[Dict[str, Optional[str]]], date_formats: Optional[List[str]] = None
+) -> List[Dict[str, object]]:
+    """Apply the row-wise part of `etl.transform_data` to rows from `read_rows`.
+
+    The numeric columns are converted as the INPUT_SCHEMA dtypes would be,
+    PaymentDate is parsed, each distinct string once, and ClientName is lowercased.
+    As in `etl.transform_data`, the rows whose PaymentDate matches none of the
+    formats are dropped, and a missing PaymentDate is kept as "NaT".
+
+    Raises:
+        ValueError: If a number cannot be converted, e.g. a missing
+            ProductQuantity, which the int64 dtype rejects too.
+    """
+    formats = date_formats or PAYMENT_DATE_FORMATS
+    parsed_dates = {}
+    transformed, malformed = [], []
+    for row in rows:
+        row["UnitPrice"] = None if row["UnitPrice"] is None else float(row["UnitPrice"])
+        if row["ProductQuantity"] is None:
+            raise ValueError("ProductQuantity has missing values, which the int64 dtype cannot hold")
+        row["ProductQuantity"] = int(row["ProductQuantity"])
+        row["TotalPrice"] = None if row["TotalPrice"] is None else float(row["TotalPrice"])
+        payment_date = row["PaymentDate"]
+        if payment_date not in parsed_dates:
+            parsed_dates[payment_date] = parse_payment_date(payment_date, formats)
+        if parsed_dates[payment_date] is None and payment_date is not None:
+            malformed.append(payment_date)
+            continue
+        # pandas stores a missing date as NaT
+        row["PaymentDate"] = parsed_dates[payment_date] or "NaT"
+        if row["ClientName"] is not None:
+            row["ClientName"] = row["ClientName"].lower()
+        transformed.append(row)
+    if malformed:
+        logging.warning(
+            f"Dropped {len(malformed)} rows whose PaymentDate matches none of the formats "
+            f"{formats}, e.g. {sorted(set(malformed))[:5]}"
+        )
+    return transformed
+
+
+def _unique(rows: List[Dict[str, object]], columns: List[str], key: List[str]) -> List[Tuple]:
+    # the first row of each key, in order, as the drop_duplicates of the dimension builders
+    seen = {}
+    for row in rows:
+        row_key = tuple(row[column] for column in key)
+        if row_key not in seen:
+            seen[row_key] = tuple(row[column] for column in columns)
+    return list(seen.values())
+
+
+@instrument
+def load_small_files(
+    database: str,
+    files: List[Path],
+    order_mode: str = "insert",
+    track_files: bool = False,
+    date_formats: Optional[List[str]] = None,
+    encoding: str = LEGACY_ENCODING,
+    aggregates: bool = False,
+    session: Optional[LoadSession] = None,
+) -> int:
+    """Load a batch of small files with the csv module and executemany, without pandas.
+
+    For files of a few hundred rows, importing pandas and building DataFrames
+    costs far more than the load itself. This path reads the rows with the csv
+    module and loads the same dimension and fact rows as `pipeline.run_pipeline`
+    with its default options, in one transaction of a LoadSession. Validation,
+    row deduplication and fact shards are not supported; use `run_pipeline` for
+    those.
+
+    All files are read and converted before anything is written, so a ValueError
+    leaves the warehouse untouched and the caller can fall back to `run_pipeline`.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        files: A list of Path objects representing the CSV files to process.
+        order_mode: How orders that are already in fact_orders are treated, see
+            `load_data_orders`.
+        track_files: Record the files and their row counts in the file manifest,
+            in the load transaction if it succeeds, as failed otherwise.
+        date_formats: The formats PaymentDate is parsed with, see `etl.parse_dates`.
+        encoding: The encoding the files are decoded with. "auto" is not supported.
+        aggregates: Refresh the aggregate tables for the days the loaded facts
+            fall on, see `aggregates.refresh_aggregates`.
+        session: If given, load through this open LoadSession.
+
+    Returns:
+        The number of fact rows inserted or updated.
+
+    Raises:
+        ValueError: If a file cannot be loaded by this path.
+    """
+    if encoding == "auto":
+        raise ValueError("the small-batch path does not detect encodings")
+
+    rows, row_counts = [], {}
+    for f in files:
+        file_rows = transform_rows(read_rows(f, encoding), date_formats)
+        row_counts[f.stem] = len(file_rows)
+        rows.extend(file_rows)
+
+    clients = _unique(rows, CLIENT_COLUMNS, CLIENT_COLUMNS)
+    payments = _unique(
+        rows, ["PaymentDate", "PaymentType", "PaymentBillingCode", "Currency"], ["PaymentBillingCode"]
+    )
+    products = _unique(rows, ["ProductName", "ProductType"], ["ProductName", "ProductType"])
+    facts = _unique(rows, FACT_COLUMNS, FACT_COLUMNS[:4])
+    conflict_clause = order_conflict_clause(order_mode)
+    if order_mode == "insert":
+        # ?1 to ?4 are the first four FACT_COLUMNS, numbered after the parameters before them
+        conflict_clause = "AND " + insert_mode_condition("?1", "?2", "?3", "?4")
+    fact_query = FACT_INSERT_QUERY.format(conflict_clause=conflict_clause)
+
+    try:
+        with session_for(database, session) as session, session.transaction():
+            conn = session.conn
+            aggregate_days = set()
+            if aggregates and order_mode == "upsert":
+                aggregate_days.update(order_days(database, {fact[0] for fact in facts}, conn=conn))
+            conn.executemany(CLIENT_INSERT_QUERY, clients)
+            conn.executemany(PAYMENT_INSERT_QUERY, payments)
+            conn.executemany(PRODUCT_INSERT_QUERY, products)
+            loaded_rows = conn.executemany(fact_query, facts).rowcount
+            if aggregates:
+                aggregate_days.update(payment_days(database, {fact[6] for fact in facts}, conn=conn))
+                refresh_aggregates(database, aggregate_days, conn=conn)
+            bump_load_generation(database, conn=conn)
+            if track_files:
+                record_files(database, files, row_counts, STATUS_LOADED, conn=conn)
+    except Exception:
+        if track_files:
+            record_files(database, files, row_counts, STATUS_FAILED)
+        raise
+
+    logging.info(f"Loaded {loaded_rows} fact rows from {len(files)} small files")
+    return loaded_rows
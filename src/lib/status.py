@@ -0,0 +1,124 @@
+import sqlite3
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from .workqueue import LEASE_DATABASE, default_work_dir
+
+
+class WarehouseStatus(NamedTuple):
+    """A summary of a warehouse database and its inbox, see `warehouse_status`."""
+
+    database: str
+    exists: bool
+    schema_version: int
+    load_generation: int
+    last_loaded_at: Optional[str]
+    fact_rows: int
+    files_loaded: int
+    files_failed: int
+    pending_files: int
+    incomplete_run: Optional[int]
+    active_leases: int
+    archived_files: int
+    archived_bytes: int
+
+
+def _has_table(conn: sqlite3.Connection, table: str) -> bool:
+    return (
+        conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        is not None
+    )
+
+
+def _scalar(conn: sqlite3.Connection, table: str, query: str, default=0):
+    # a database that predates a migration simply reports the default
+    if not _has_table(conn, table):
+        return default
+    value = conn.execute(query).fetchone()
+    return default if value is None or value[0] is None else value[0]
+
+
+def _active_leases(inbox: Optional[str]) -> int:
+    # the leases are kept next to the inbox rather than in the warehouse
+    lease_database = default_work_dir(inbox) / LEASE_DATABASE if inbox else None
+    if lease_database is None or not lease_database.exists():
+        return 0
+    conn = sqlite3.connect(f"{lease_database.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        return _scalar(conn, "file_leases", "SELECT COUNT(*) FROM file_leases")
+    finally:
+        conn.close()
+
+
+def warehouse_status(database: str, inbox: Optional[str] = None) -> WarehouseStatus:
+    """Summarize the state of a warehouse without writing to it or importing pandas.
+
+    The database is opened read-only, so the status can be checked while a load
+    or a worker is running.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        inbox: If given, the folder of CSV files waiting to be loaded, whose work
+            folder holds the workers' leases.
+
+    Returns:
+        A WarehouseStatus.
+    """
+    pending_files = len(list(Path(inbox).glob("*.csv"))) if inbox and Path(inbox).is_dir() else 0
+    if not Path(database).exists():
+        return WarehouseStatus(
+            str(database), False, 0, 0, None, 0, 0, 0, pending_files, None, _active_leases(inbox), 0, 0
+        )
+
+    conn = sqlite3.connect(f"{Path(database).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        return WarehouseStatus(
+            database=str(database),
+            exists=True,
+            schema_version=_scalar(conn, "schema_migrations", "SELECT MAX(version) FROM schema_migrations"),
+            load_generation=_scalar(conn, "load_generation", "SELECT generation FROM load_generation WHERE id = 1"),
+            last_loaded_at=_scalar(
+                conn, "load_generation", "SELECT loaded_at FROM load_generation WHERE id = 1", None
+            ),
+            fact_rows=_scalar(conn, "fact_orders", "SELECT COUNT(*) FROM fact_orders"),
+            files_loaded=_scalar(
+                conn, "file_manifest", "SELECT COUNT(*) FROM file_manifest WHERE status = 'loaded'"
+            ),
+            files_failed=_scalar(
+                conn, "file_manifest", "SELECT COUNT(*) FROM file_manifest WHERE status = 'failed'"
+            ),
+            pending_files=pending_files,
+            incomplete_run=_scalar(
+                conn,
+                "load_runs",
+                "SELECT run_id FROM load_runs WHERE status != 'completed' ORDER BY run_id DESC LIMIT 1",
+                None,
+            ),
+            active_leases=_active_leases(inbox),
+            archived_files=_scalar(conn, "file_archive", "SELECT COUNT(*) FROM file_archive"),
+            archived_bytes=_scalar(conn, "file_archive", "SELECT SUM(archived_size) FROM file_archive"),
+        )
+    finally:
+        conn.close()
+
+
+def format_status(status: WarehouseStatus) -> str:
+    """Render a WarehouseStatus as the lines printed by the status command."""
+    if not status.exists:
+        return f"database:        {status.database} (not created yet)\npending files:   {status.pending_files}"
+    lines = [
+        f"database:        {status.database}",
+        f"schema version:  {status.schema_version}",
+        f"loads:           {status.load_generation} (last at {status.last_loaded_at or 'never'})",
+        f"fact rows:       {status.fact_rows}",
+        f"files loaded:    {status.files_loaded}",
+        f"files failed:    {status.files_failed}",
+        f"pending files:   {status.pending_files}",
+        f"active leases:   {status.active_leases}",
+        f"archived files:  {status.archived_files} ({status.archived_bytes / 1024 / 1024:.1f} MiB)",
+    ]
+    if status.incomplete_run is not None:
+        lines.append(f"incomplete run:  {status.incomplete_run} (resumed by the next --checkpoint run)")
+    return "\n".join(lines)
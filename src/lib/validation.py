@@ -0,0 +1,301 @@
+import logging
+import os
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .manifest import hash_file
+from .metrics import instrument
+
+# the columns that end up in NOT NULL warehouse columns
+REQUIRED_COLUMNS = [
+    "OrderNumber",
+    "ClientName",
+    "ProductName",
+    "ProductType",
+    "UnitPrice",
+    "ProductQuantity",
+    "TotalPrice",
+    "Currency",
+    "DeliveryAddress",
+    "DeliveryCity",
+    "DeliveryPostcode",
+    "DeliveryCountry",
+    "PaymentType",
+    "PaymentBillingCode",
+    "PaymentDate",
+]
+
+# the column listing the reason codes of a rejected row in the reject files
+REJECT_REASONS_COLUMN = "RejectReasons"
+
+REJECT_FILE_SUFFIX = ".rejects.csv"
+
+# the reason code of the lines the CSV reader skipped for having too many fields
+EXTRA_FIELDS = "EXTRA_FIELDS"
+
+
+class Rule(NamedTuple):
+    """A validation rule, evaluated on a whole batch at once.
+
+    Args:
+        code: The reason code recorded for the rows failing the rule.
+        columns: The columns the rule reads. It is skipped for batches that do
+            not have all of them.
+        check: A function taking the batch and returning a boolean array that is
+            True for the rows passing the rule. It must work column-wise, without
+            a Python loop over the rows.
+    """
+
+    code: str
+    columns: Sequence[str]
+    check: Callable[[pd.DataFrame], np.ndarray]
+
+
+class ValidationResult(NamedTuple):
+    """The outcome of `validate`: the passing rows, the rejected rows and counts per code."""
+
+    valid: pd.DataFrame
+    rejects: pd.DataFrame
+    counts: Dict[str, int]
+
+
+def _reason_code(column: str) -> str:
+    # "DeliveryCity" -> "DELIVERY_CITY"
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", column).upper()
+
+
+def _not_null(column: str, df: pd.DataFrame) -> np.ndarray:
+    return df[column].notna().to_numpy()
+
+
+def _total_matches(tolerance: float, df: pd.DataFrame) -> np.ndarray:
+    unit_price = df["UnitPrice"].to_numpy(dtype=float)
+    quantity = df["ProductQuantity"].to_numpy(dtype=float)
+    total = df["TotalPrice"].to_numpy(dtype=float)
+    # rows with a missing price are left to the not_null rules
+    missing = np.isnan(unit_price) | np.isnan(quantity) | np.isnan(total)
+    return missing | (np.abs(unit_price * quantity - total) <= tolerance)
+
+
+def _positive(column: str, df: pd.DataFrame) -> np.ndarray:
+    return ~(df[column].to_numpy(dtype=float) <= 0)
+
+
+def _parses_as_date(column: str, formats: List[str], df: pd.DataFrame) -> np.ndarray:
+    # imported here, etl imports this module
+    from .etl import parse_dates
+
+    parsed = parse_dates(df[column], formats, errors="coerce")
+    return (parsed.notna() | df[column].isna()).to_numpy()
+
+
+# the rules are built from module-level functions with functools.partial rather
+# than lambdas, so they can be pickled to the worker processes of
+# `etl.extract_transform_files_parallel`
+
+
+def not_null(column: str) -> Rule:
+    """A rule rejecting rows where `column` is missing."""
+    return Rule(f"MISSING_{_reason_code(column)}", [column], partial(_not_null, column))
+
+
+def total_matches_unit_price(tolerance: float = 0.01) -> Rule:
+    """A rule rejecting rows whose TotalPrice is not UnitPrice * ProductQuantity."""
+    return Rule(
+        "TOTAL_PRICE_MISMATCH",
+        ["UnitPrice", "ProductQuantity", "TotalPrice"],
+        partial(_total_matches, tolerance),
+    )
+
+
+def positive(column: str) -> Rule:
+    """A rule rejecting rows where `column` is zero or negative; missing values pass."""
+    return Rule(f"NON_POSITIVE_{_reason_code(column)}", [column], partial(_positive, column))
+
+
+def parses_as_date(column: str, formats: List[str]) -> Rule:
+    """A rule rejecting rows where `column` matches none of `formats`; missing values pass.
+
+    The distinct values are parsed once each, see `etl.parse_dates`.
+    """
+    return Rule(
+        f"INVALID_{_reason_code(column)}", [column], partial(_parses_as_date, column, formats)
+    )
+
+
+def default_rules(date_formats: Optional[List[str]] = None) -> List[Rule]:
+    """Return the default rule set.
+
+    Required columns must be present, TotalPrice must equal UnitPrice *
+    ProductQuantity, quantities and prices must be positive and PaymentDate must
+    match one of `date_formats`.
+
+    Args:
+        date_formats: The formats PaymentDate is parsed with. Defaults to
+            etl.PAYMENT_DATE_FORMATS.
+    """
+    if date_formats is None:
+        from .etl import PAYMENT_DATE_FORMATS
+
+        date_formats = PAYMENT_DATE_FORMATS
+
+    return [not_null(column) for column in REQUIRED_COLUMNS] + [
+        total_matches_unit_price(),
+        positive("ProductQuantity"),
+        positive("UnitPrice"),
+        parses_as_date("PaymentDate", date_formats),
+    ]
+
+
+def validate(input_df: pd.DataFrame, rules: List[Rule]) -> ValidationResult:
+    """Split a batch into the rows passing every rule and the rejected rows.
+
+    Each rule is evaluated once over whole columns. The rejected rows get a
+    RejectReasons column with the codes of all the rules they fail, separated by
+    semicolons, built with vectorized string concatenation over the rejected rows
+    only.
+
+    Args:
+        input_df: A pandas DataFrame returned by the extract functions.
+        rules: The rules to apply, e.g. from `default_rules`.
+
+    Returns:
+        A ValidationResult. The valid rows keep their order and get a fresh index.
+    """
+    failures = []
+    for rule in rules:
+        if not all(column in input_df.columns for column in rule.columns):
+            continue
+        failed = ~np.asarray(rule.check(input_df), dtype=bool)
+        if failed.any():
+            failures.append((rule.code, failed))
+
+    if not failures:
+        return ValidationResult(input_df, input_df.iloc[0:0].assign(**{REJECT_REASONS_COLUMN: ""}), {})
+
+    rejected = np.logical_or.reduce([failed for _, failed in failures])
+    reasons = pd.Series("", index=np.flatnonzero(rejected), dtype=object)
+    for code, failed in failures:
+        reasons = reasons + np.where(failed[rejected], code + ";", "")
+
+    rejects = input_df[rejected].assign(**{REJECT_REASONS_COLUMN: reasons.str.rstrip(";").to_numpy()})
+    counts = {code: int(failed.sum()) for code, failed in failures}
+    return ValidationResult(input_df[~rejected].reset_index(drop=True), rejects, counts)
+
+
+def write_rejects(rejects: pd.DataFrame, reject_dir: str) -> None:
+    """Append rejected rows to one reject CSV per source file.
+
+    The files are named after the `file` column, e.g. data.rejects.csv, and are
+    appended to, so chunks of one file end up in the same reject file. The
+    pipelines write them to the staging folder of `staged_rejects`.
+
+    Args:
+        rejects: The rejected rows of a ValidationResult.
+        reject_dir: The folder the reject files are written to.
+    """
+    if len(rejects) == 0:
+        return
+    Path(reject_dir).mkdir(parents=True, exist_ok=True)
+    for file, file_rejects in rejects.groupby("file", sort=False, observed=True):
+        reject_path = Path(reject_dir) / f"{file}{REJECT_FILE_SUFFIX}"
+        file_rejects.drop(columns="file").to_csv(
+            reject_path, mode="a", header=not reject_path.exists(), index=False
+        )
+
+
+def write_bad_lines(
+    bad_lines: List[List[str]], columns: List[str], file: str, reject_dir: str
+) -> None:
+    """Write the lines the CSV reader skipped to the reject file of their source file.
+
+    Their fields fill the columns in order and the surplus fields are joined into
+    the last column, so no field of the line is lost.
+
+    Args:
+        bad_lines: The fields of the skipped lines, see `readers.read_csv`.
+        columns: The columns of the source file.
+        file: The source file's name without its suffix, as in the `file` column.
+        reject_dir: The folder the reject files are written to.
+    """
+    if not bad_lines:
+        return
+    last = len(columns) - 1
+    rows = [fields[:last] + [",".join(fields[last:])] for fields in bad_lines]
+    rejects = pd.DataFrame(rows, columns=columns).assign(
+        file=file, **{REJECT_REASONS_COLUMN: EXTRA_FIELDS}
+    )
+    write_rejects(rejects, reject_dir)
+
+
+@contextmanager
+def staged_rejects(reject_dir: Optional[str], files: List[Path]) -> Iterator[Optional[str]]:
+    """Collect the reject files of a load and publish them once it has committed.
+
+    The rejects are written to a staging folder inside `reject_dir`, which is
+    yielded. If the block exits normally, each staged file is moved to
+    `<file>.<hash>.rejects.csv`, keyed by the first 12 characters of the source
+    file's content hash. A reload of the same file therefore replaces its rejects
+    rather than duplicating them. If the block raises, the staged files are
+    discarded with the rolled back load.
+
+    Args:
+        reject_dir: The folder the reject files are published to. If None,
+            nothing is staged and None is yielded.
+        files: The files of the load, to look up the source of each reject file.
+    """
+    if reject_dir is None:
+        yield None
+        return
+    Path(reject_dir).mkdir(parents=True, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(prefix=".staging-", dir=reject_dir)
+    try:
+        yield staging_dir
+        sources = {Path(f).stem: Path(f) for f in files}
+        for staged in sorted(Path(staging_dir).glob(f"*{REJECT_FILE_SUFFIX}")):
+            file = staged.name[: -len(REJECT_FILE_SUFFIX)]
+            if file in sources:
+                name = f"{file}.{hash_file(sources[file])[:12]}{REJECT_FILE_SUFFIX}"
+            else:
+                name = staged.name
+            os.replace(staged, Path(reject_dir) / name)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+@instrument
+def validate_rows(
+    input_df: pd.DataFrame, rules: List[Rule], reject_dir: Optional[str] = None
+) -> pd.DataFrame:
+    """Validate an extracted batch, quarantine the failing rows and return the rest.
+
+    This is the validation stage run between extract and transform by the
+    pipeline functions.
+
+    Args:
+        input_df: A pandas DataFrame returned by the extract functions, with a
+            `file` column.
+        rules: The rules to apply, e.g. from `default_rules`.
+        reject_dir: If given, the folder the rejected rows are written to, see
+            `write_rejects`.
+
+    Returns:
+        The rows passing every rule.
+    """
+    result = validate(input_df, rules)
+    if len(result.rejects) > 0:
+        logging.warning(
+            f"Rejected {len(result.rejects)} of {len(input_df)} rows: "
+            + ", ".join(f"{code}={count}" for code, count in sorted(result.counts.items()))
+        )
+        if reject_dir is not None:
+            write_rejects(result.rejects, reject_dir)
+    return result.valid
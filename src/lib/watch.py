@@ -0,0 +1,235 @@
+import logging
+import os
+import signal
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from .db_helper import LoadSession
+from .archive import FileArchive
+from .files import move_processed_files
+from .manifest import filter_unprocessed_files
+from .metrics import stage
+
+
+class BatchPolicy(NamedTuple):
+    """When the files arriving in a watched folder are loaded.
+
+    A micro-batch is loaded as soon as `max_files` files or `max_bytes` bytes are
+    ready, or `max_latency` seconds after its first file became ready, whichever
+    comes first.
+
+    Args:
+        max_files: The maximum number of files per micro-batch.
+        max_bytes: The maximum total size of a micro-batch, except that a single
+            larger file still makes a batch of its own.
+        max_latency: The longest a ready file waits for more files to join its batch.
+        settle_seconds: How long a file's size and mtime must stay unchanged before
+            it is considered completely written.
+        poll_interval: The seconds between two scans of the folder.
+    """
+
+    max_files: int = 50
+    max_bytes: int = 256 * 1024 * 1024
+    max_latency: float = 2.0
+    settle_seconds: float = 1.0
+    poll_interval: float = 0.5
+
+
+class FolderWatcher:
+    """Poll a folder and group the CSV files that stopped changing into micro-batches.
+
+    Polling with os.scandir only stats the folder's entries, which costs little
+    compared to loading a batch, and works on every platform and on network shares
+    where inotify events are not delivered.
+
+    Args:
+        folder: The folder to watch.
+        policy: The BatchPolicy deciding when a batch is due.
+    """
+
+    def __init__(self, folder: str, policy: BatchPolicy = BatchPolicy()) -> None:
+        self.folder = Path(folder)
+        self.policy = policy
+        # path -> (size, mtime_ns, time of the last change)
+        self.seen: Dict[Path, Tuple[int, int, float]] = {}
+        # path -> (size, time it became ready)
+        self.ready: Dict[Path, Tuple[int, float]] = {}
+        # path -> (size, mtime_ns) of files not to offer again until they change
+        self.ignored: Dict[Path, Tuple[int, int]] = {}
+
+    def poll(self, now: Optional[float] = None) -> None:
+        """Scan the folder and update which files are ready."""
+        now = time.monotonic() if now is None else now
+        present = set()
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.endswith(".csv"):
+                    continue
+                path = Path(entry.path)
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime_ns)
+                present.add(path)
+
+                if self.ignored.get(path) == signature:
+                    continue
+                self.ignored.pop(path, None)
+
+                seen = self.seen.get(path)
+                if seen is None or seen[:2] != signature:
+                    # new or still being written
+                    self.seen[path] = signature + (now,)
+                    self.ready.pop(path, None)
+                elif path not in self.ready and now - seen[2] >= self.policy.settle_seconds:
+                    self.ready[path] = (stat.st_size, now)
+
+        for path in set(self.seen) - present:
+            del self.seen[path]
+            self.ready.pop(path, None)
+        for path in set(self.ignored) - present:
+            del self.ignored[path]
+
+    def next_batch(self, now: Optional[float] = None) -> List[Path]:
+        """Return the next micro-batch if one is due, an empty list otherwise.
+
+        The returned files are no longer tracked as ready, so they are only offered
+        once; call `ignore` for the ones that should not be offered again either
+        if they stay in the folder unchanged.
+        """
+        if not self.ready:
+            return []
+        now = time.monotonic() if now is None else now
+        ready = sorted(self.ready.items())
+        total_bytes = sum(size for size, _ in self.ready.values())
+        oldest = min(ready_at for _, ready_at in self.ready.values())
+        due = (
+            len(ready) >= self.policy.max_files
+            or total_bytes >= self.policy.max_bytes
+            or now - oldest >= self.policy.max_latency
+        )
+        if not due:
+            return []
+
+        batch, batch_bytes = [], 0
+        for path, (size, _) in ready:
+            if batch and (
+                len(batch) >= self.policy.max_files
+                or batch_bytes + size > self.policy.max_bytes
+            ):
+                break
+            batch.append(path)
+            batch_bytes += size
+            del self.ready[path]
+            del self.seen[path]
+        return batch
+
+    def ignore(self, files: List[Path]) -> None:
+        """Do not offer these files again until they are modified."""
+        for path in files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            self.ignored[path] = (stat.st_size, stat.st_mtime_ns)
+
+
+def stop_on_signals(stop: threading.Event) -> None:
+    """Set `stop` on SIGINT and SIGTERM, so a watch loop finishes its batch and exits."""
+
+    def handler(signum, frame):
+        logging.info(f"Received signal {signum}, stopping after the current batch")
+        stop.set()
+
+    signal.signal(signal.SIGINT, handler)
+    signal.signal(signal.SIGTERM, handler)
+
+
+def watch_folder(
+    database: str,
+    folder: str,
+    processed_folder: str,
+    load_files: Callable[[List[Path], LoadSession], int],
+    policy: BatchPolicy = BatchPolicy(),
+    stop: Optional[threading.Event] = None,
+    max_batches: Optional[int] = None,
+    archive: Optional[FileArchive] = None,
+) -> int:
+    """Load the files arriving in a folder in micro-batches until stopped.
+
+    The process stays resident, so the interpreter, pandas and the schema are set
+    up once, and one LoadSession, with its connection and page cache, is kept
+    warm across all batches. Files that the manifest records as loaded are moved
+    away without loading them. A batch that fails is logged and its files stay in
+    the folder, ignored until they are modified, as do the files of a loaded batch
+    that the manifest does not record as loaded.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        folder: The folder new CSV files arrive in.
+        processed_folder: The folder loaded files are moved to.
+        load_files: Loads one micro-batch through the given session and returns
+            the number of fact rows loaded, e.g. a `run_pipeline` call with
+            `session` and `track_files=True`. It must record the files it loads
+            in the manifest.
+        policy: When batches are due, see BatchPolicy.
+        stop: An event that ends the loop once set. See `stop_on_signals`.
+        max_batches: If set, return after this many batches were loaded.
+        archive: If given, loaded files are compressed into this FileArchive
+            instead of being moved to `processed_folder`.
+
+    Returns:
+        The number of fact rows loaded.
+    """
+    stop = threading.Event() if stop is None else stop
+    watcher = FolderWatcher(folder, policy)
+    loaded_rows = 0
+    batches = 0
+    logging.info(f"Watching {folder} for new files")
+    with LoadSession(database) as session:
+        while not stop.is_set():
+            watcher.poll()
+            files = watcher.next_batch()
+            if not files:
+                stop.wait(policy.poll_interval)
+                continue
+
+            new_files = filter_unprocessed_files(database, files)
+            already_loaded = [f for f in files if f not in new_files]
+            if already_loaded:
+                move_processed_files(folder, processed_folder, files=already_loaded, archive=archive)
+            if not new_files:
+                continue
+
+            try:
+                with stage("micro_batch") as batch_stage:
+                    batch_rows = load_files(new_files, session)
+                    batch_stage.rows_out = batch_rows
+            except Exception as e:
+                logging.error(
+                    f"Micro-batch of {len(new_files)} files failed, they are left in "
+                    f"{folder} until modified: {e}",
+                    exc_info=True,
+                )
+                watcher.ignore(new_files)
+                continue
+
+            # files that could not be extracted were recorded as failed, not loaded
+            failed_files = filter_unprocessed_files(database, new_files)
+            if failed_files:
+                logging.error(
+                    f"{len(failed_files)} files of the micro-batch could not be loaded, "
+                    f"they are left in {folder} until modified"
+                )
+                watcher.ignore(failed_files)
+            loaded_files = [f for f in new_files if f not in failed_files]
+            move_processed_files(folder, processed_folder, files=loaded_files, archive=archive)
+            loaded_rows += batch_rows
+            batches += 1
+            logging.info(
+                f"Loaded micro-batch {batches}: {len(loaded_files)} files, "
+                f"{batch_rows} fact rows"
+            )
+            if max_batches is not None and batches >= max_batches:
+                break
+    return loaded_rows
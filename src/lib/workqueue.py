@@ -0,0 +1,396 @@
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, TypeVar
+
+from .db_helper import BULK_LOAD_PRAGMAS, LoadSession
+from .archive import FileArchive
+from .files import move_processed_files
+from .manifest import filter_unprocessed_files
+from .metrics import stage
+
+# how long a claimed file's lease lasts without a heartbeat, in seconds
+DEFAULT_LEASE_SECONDS = 60.0
+
+# how long a connection waits for another worker's write lock before failing
+BUSY_TIMEOUT_MS = 30000
+
+# the SQLite database the leases are kept in, inside the work folder. It is separate
+# from the warehouse, so a heartbeat never waits for the write lock of a load
+LEASE_DATABASE = "leases.db"
+
+LEASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_leases (
+  worker_id VARCHAR(255) NOT NULL,
+  file_name VARCHAR(255) NOT NULL,
+  claimed_at REAL NOT NULL,
+  expires_at REAL NOT NULL,
+  PRIMARY KEY (worker_id, file_name)
+);
+CREATE INDEX IF NOT EXISTS idx_file_leases_expires_at ON file_leases (expires_at);
+"""
+
+# the pragmas of the worker sessions; for workers on several hosts sharing a network
+# filesystem, use journal_mode DELETE, as WAL needs shared memory on one host
+WORKER_PRAGMAS = {**BULK_LOAD_PRAGMAS, "busy_timeout": BUSY_TIMEOUT_MS}
+
+T = TypeVar("T")
+
+
+def default_worker_id() -> str:
+    """Return an id unique to this process across the hosts sharing an inbox."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def default_work_dir(inbox: str) -> Path:
+    """Return the work folder of an inbox by default, next to it, see WorkQueue."""
+    return Path(inbox).parent / "inprogress"
+
+
+def is_locked_error(error: Exception) -> bool:
+    """Return whether an error is SQLite giving up on a lock held by another connection."""
+    return isinstance(error, sqlite3.OperationalError) and (
+        "locked" in str(error) or "busy" in str(error)
+    )
+
+
+def retry_locked(
+    action: Callable[[], T], attempts: int = 5, backoff: float = 0.5
+) -> T:
+    """Call `action`, retrying with jittered exponential backoff while the database is locked.
+
+    The busy timeout already makes each statement wait for the lock; this covers
+    the loads that still time out behind a long transaction of another worker.
+    `action` must be safe to repeat, e.g. a run whose transaction was rolled back.
+
+    Args:
+        action: The function to call.
+        attempts: The maximum number of calls.
+        backoff: The delay before the first retry, in seconds, doubled for each
+            further retry.
+
+    Returns:
+        The return value of `action`.
+    """
+    for attempt in range(attempts):
+        try:
+            return action()
+        except sqlite3.OperationalError as e:
+            if not is_locked_error(e) or attempt == attempts - 1:
+                raise
+            delay = backoff * 2**attempt * random.uniform(0.5, 1.5)
+            logging.warning(f"Database locked, retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+
+class WorkQueue:
+    """Let several worker processes share one inbox folder without loading a file twice.
+
+    A worker claims a file by renaming it from the inbox into its own in-progress
+    folder. The rename is atomic, so when two workers race for a file exactly one
+    of them gets it; the others see it vanish and move on. The claim is then
+    recorded as a lease in the file_leases table of the lease database, which
+    the worker renews with heartbeats while it holds the file. Files whose lease
+    expired, because their worker crashed or hung, are renamed back into the
+    inbox by the next worker that calls `reclaim_expired`.
+
+    The lease database is LEASE_DATABASE in the work folder rather than the
+    warehouse, whose write lock is held by the workers' loads for as long as
+    they run.
+
+    Args:
+        inbox: The folder new CSV files arrive in.
+        work_dir: The folder holding the per-worker in-progress folders, the
+            folder of failed files and the lease database. Defaults to
+            `default_work_dir`, so the claimed files are out of the inbox's listing.
+        worker_id: The id of this worker. Defaults to `default_worker_id`.
+        lease_seconds: How long a lease lasts without a heartbeat.
+    """
+
+    def __init__(
+        self,
+        inbox: str,
+        work_dir: Optional[str] = None,
+        worker_id: Optional[str] = None,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    ) -> None:
+        self.inbox = Path(inbox)
+        self.work_dir = default_work_dir(inbox) if work_dir is None else Path(work_dir)
+        self.worker_id = default_worker_id() if worker_id is None else worker_id
+        self.lease_seconds = lease_seconds
+        self.claim_dir = self.work_dir / self.worker_id
+        self.failed_dir = self.work_dir / "failed"
+        self.lease_database = str(self.work_dir / LEASE_DATABASE)
+        self.claim_dir.mkdir(parents=True, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(LEASE_SCHEMA)
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.lease_database, timeout=BUSY_TIMEOUT_MS / 1000)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def claim(self, max_files: int) -> List[Path]:
+        """Claim up to `max_files` CSV files of the inbox, oldest name first.
+
+        Returns:
+            The claimed files, at their path in this worker's in-progress folder.
+
+        Raises:
+            sqlite3.OperationalError: If the leases cannot be recorded. The
+                claimed files are then renamed back into the inbox.
+        """
+        claimed = []
+        for path in sorted(self.inbox.glob("*.csv")):
+            if len(claimed) >= max_files:
+                break
+            target = self.claim_dir / path.name
+            try:
+                os.rename(path, target)
+            except FileNotFoundError:
+                # claimed by another worker in between
+                continue
+            claimed.append(target)
+
+        if claimed:
+            now = time.time()
+            try:
+                with self._connection() as conn:
+                    conn.executemany(
+                        """
+                        INSERT INTO file_leases (worker_id, file_name, claimed_at, expires_at)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT(worker_id, file_name) DO UPDATE
+                        SET claimed_at=excluded.claimed_at, expires_at=excluded.expires_at
+                        """,
+                        [
+                            (self.worker_id, path.name, now, now + self.lease_seconds)
+                            for path in claimed
+                        ],
+                    )
+            except sqlite3.Error:
+                for path in claimed:
+                    os.rename(path, self.inbox / path.name)
+                raise
+            logging.info(f"Worker {self.worker_id} claimed {len(claimed)} files")
+        return claimed
+
+    def renew(self) -> None:
+        """Extend the leases of all files this worker holds."""
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE file_leases SET expires_at = ? WHERE worker_id = ?",
+                (time.time() + self.lease_seconds, self.worker_id),
+            )
+
+    @contextmanager
+    def heartbeat(self) -> Iterator["WorkQueue"]:
+        """Renew this worker's leases from a background thread while the block runs.
+
+        The leases are renewed three times per lease period, so a single late or
+        failed heartbeat does not let them expire.
+        """
+        stop = threading.Event()
+
+        def beat() -> None:
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    self.renew()
+                except sqlite3.Error as e:
+                    logging.warning(f"Could not renew the leases of {self.worker_id}: {e}")
+
+        thread = threading.Thread(target=beat, name=f"heartbeat-{self.worker_id}", daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
+
+    def reclaim_expired(self, now: Optional[float] = None) -> List[Path]:
+        """Put the files of other workers whose lease expired back into the inbox.
+
+        A file found in an in-progress folder without a lease, because its worker
+        died between the rename and recording the lease, is given a lease on that
+        worker's behalf, and is reclaimed once that lease expires too.
+
+        Returns:
+            The reclaimed files, at their path in the inbox.
+        """
+        now = time.time() if now is None else now
+        reclaimed = []
+        with self._connection() as conn:
+            for worker_dir in sorted(self.work_dir.iterdir()):
+                if not worker_dir.is_dir() or worker_dir in (self.claim_dir, self.failed_dir):
+                    continue
+                for path in sorted(worker_dir.glob("*.csv")):
+                    lease = conn.execute(
+                        "SELECT expires_at FROM file_leases WHERE worker_id = ? AND file_name = ?",
+                        (worker_dir.name, path.name),
+                    ).fetchone()
+                    if lease is None:
+                        conn.execute(
+                            """
+                            INSERT OR IGNORE INTO file_leases (worker_id, file_name, claimed_at, expires_at)
+                            VALUES (?, ?, ?, ?)
+                            """,
+                            (worker_dir.name, path.name, now, now + self.lease_seconds),
+                        )
+                        continue
+                    if lease[0] >= now:
+                        continue
+
+                    # the lease is taken over before the file is moved, unless its
+                    # worker renewed it in between
+                    deleted = conn.execute(
+                        "DELETE FROM file_leases WHERE worker_id = ? AND file_name = ? AND expires_at < ?",
+                        (worker_dir.name, path.name, now),
+                    )
+                    if deleted.rowcount == 0:
+                        continue
+                    target = self.inbox / path.name
+                    try:
+                        os.rename(path, target)
+                    except FileNotFoundError:
+                        # reclaimed by another worker in between
+                        continue
+                    logging.warning(f"Reclaimed {path.name}, the lease of {worker_dir.name} expired")
+                    reclaimed.append(target)
+        return reclaimed
+
+    def _release(self, files: List[Path]) -> None:
+        with self._connection() as conn:
+            conn.executemany(
+                "DELETE FROM file_leases WHERE worker_id = ? AND file_name = ?",
+                [(self.worker_id, Path(f).name) for f in files],
+            )
+
+    def complete(
+        self, files: List[Path], processed_folder: str, archive: Optional[FileArchive] = None
+    ) -> None:
+        """Move loaded files to the processed folder, or into `archive`, and release their leases."""
+        move_processed_files(str(self.claim_dir), processed_folder, files=files, archive=archive)
+        self._release(files)
+
+    def fail(self, files: List[Path]) -> None:
+        """Move files that could not be loaded to the failed folder and release their leases.
+
+        They are kept out of the inbox, so the other workers do not retry them
+        forever; move them back once fixed.
+        """
+        self.failed_dir.mkdir(parents=True, exist_ok=True)
+        move_processed_files(str(self.claim_dir), str(self.failed_dir), files=files)
+        self._release(files)
+
+
+def run_worker(
+    database: str,
+    inbox: str,
+    processed_folder: str,
+    load_files: Callable[[List[Path], LoadSession], int],
+    worker_id: Optional[str] = None,
+    work_dir: Optional[str] = None,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    batch_files: int = 10,
+    poll_interval: float = 1.0,
+    stop: Optional[threading.Event] = None,
+    exit_when_idle: bool = False,
+    archive: Optional[FileArchive] = None,
+) -> int:
+    """Claim and load files from a shared inbox until stopped.
+
+    Start one worker per process, on one or several hosts. Extraction and
+    transformation run concurrently across the workers, while their load
+    transactions are serialized by SQLite's write lock: the sessions begin
+    their transactions IMMEDIATE with a busy timeout, and a load that still
+    times out is retried, see `retry_locked`. The leases are kept in their own
+    database, see WorkQueue, and a claim that finds it locked is tried again on
+    the next poll.
+
+    Args:
+        database: A string representing the path to the SQLite database.
+        inbox: The folder new CSV files arrive in.
+        processed_folder: The folder loaded files are moved to.
+        load_files: Loads the claimed files through the given session and returns
+            the number of fact rows loaded, e.g. a `run_pipeline` call with
+            `session` and `track_files=True`. It must record the files it loads
+            in the manifest, the others are moved to the failed folder. It is
+            called again if the database stays locked, so it must roll back
+            completely on failure.
+        worker_id: The id of this worker. Defaults to `default_worker_id`.
+        work_dir: The folder of the in-progress and failed files, see WorkQueue.
+        lease_seconds: How long a lease lasts without a heartbeat.
+        batch_files: The maximum number of files claimed and loaded at once.
+        poll_interval: The seconds to wait when the inbox is empty.
+        stop: An event that ends the loop once set. See `watch.stop_on_signals`.
+        exit_when_idle: Return once the inbox is empty instead of waiting for
+            more files.
+        archive: If given, loaded files are compressed into this FileArchive
+            instead of being moved to `processed_folder`.
+
+    Returns:
+        The number of fact rows loaded.
+    """
+    stop = threading.Event() if stop is None else stop
+    work_queue = WorkQueue(inbox, work_dir, worker_id, lease_seconds)
+    loaded_rows = 0
+    logging.info(f"Worker {work_queue.worker_id} started on {inbox}")
+    with LoadSession(database, pragmas=WORKER_PRAGMAS, immediate=True) as session, work_queue.heartbeat():
+        while not stop.is_set():
+            try:
+                work_queue.reclaim_expired()
+                files = work_queue.claim(batch_files)
+            except sqlite3.OperationalError as e:
+                if not is_locked_error(e):
+                    raise
+                logging.warning(f"Worker {work_queue.worker_id} could not claim files, retrying: {e}")
+                stop.wait(poll_interval)
+                continue
+            if not files:
+                if exit_when_idle:
+                    break
+                stop.wait(poll_interval)
+                continue
+
+            new_files = filter_unprocessed_files(database, files)
+            already_loaded = [f for f in files if f not in new_files]
+            if already_loaded:
+                work_queue.complete(already_loaded, processed_folder, archive)
+            if not new_files:
+                continue
+
+            try:
+                with stage("worker_batch") as batch_stage:
+                    batch_rows = retry_locked(lambda: load_files(new_files, session))
+                    batch_stage.rows_out = batch_rows
+            except Exception as e:
+                logging.error(
+                    f"Worker {work_queue.worker_id} failed to load {len(new_files)} files, "
+                    f"moved to {work_queue.failed_dir}: {e}",
+                    exc_info=True,
+                )
+                work_queue.fail(new_files)
+                continue
+
+            # files that could not be extracted were recorded as failed, not loaded
+            failed_files = filter_unprocessed_files(database, new_files)
+            if failed_files:
+                logging.error(
+                    f"Worker {work_queue.worker_id} could not load {len(failed_files)} files, "
+                    f"moved to {work_queue.failed_dir}"
+                )
+                work_queue.fail(failed_files)
+            loaded_files = [f for f in new_files if f not in failed_files]
+            work_queue.complete(loaded_files, processed_folder, archive)
+            loaded_rows += batch_rows
+    return loaded_rows
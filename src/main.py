@@ -1,67 +1,606 @@
-from lib.etl import get_csv_files_for_processing, extract_all_files, extract_file, transform_data, create_dimension_client, create_dimension_payment, create_dimension_product, create_fact_orders, move_processed_files
-from lib.db_helper import create_connection, create_tables_in_db, load_data_clients, load_data_payments, load_data_products, load_data_orders
+from lib.archive import FileArchive
+from lib.config import default_paths
+from lib.db_helper import create_connection, create_tables_in_db
+from lib.files import get_csv_files_for_processing, move_processed_files
+from lib.manifest import filter_unprocessed_files
+from lib.metrics import MetricsCollector
+from lib.migrations import apply_migrations, build_deferred_indexes
+from lib.smallbatch import SMALL_BATCH_BYTES, is_small_batch, load_small_files
+from lib.watch import BatchPolicy, stop_on_signals, watch_folder
+from lib.workqueue import DEFAULT_LEASE_SECONDS, run_worker
 from lib.logger import setup_logging
-import os
+import argparse
+import sys
 import logging
+import threading
 
-def main():
+# The pandas-based modules are imported inside the functions that need them, so a
+# status check or the load of a few small files does not pay for importing pandas
+
+COMMANDS = ["run", "watch", "worker", "replay", "rebuild", "status", "serve"]
+
+def main(
+    chunksize=None,
+    workers=None,
+    fact_keys="pandas",
+    incremental=None,
+    dedup_rows=False,
+    compact=False,
+    date_formats=None,
+    engine="pandas",
+    encoding="unicode_escape",
+    cache_dir=None,
+    cache_size_mb=2048,
+    pipelined=False,
+    metrics_report=None,
+    metrics_prometheus=None,
+    validate=False,
+    reject_dir=None,
+    aggregates=True,
+    rebuild=False,
+    partition_by=None,
+    shard_dir=None,
+    watch=False,
+    batch_policy=None,
+    checkpoint=False,
+    worker=False,
+    worker_id=None,
+    lease_seconds=DEFAULT_LEASE_SECONDS,
+    small_batch_bytes=SMALL_BATCH_BYTES,
+    archive=False,
+    paths=None,
+):
     """
     The main function of the ETL pipeline for the ABC Musical Data Warehouse project.
 
     This function extracts data from CSV files in a specified directory, transforms the data,
     creates dimension and fact tables, and loads the data into a SQLite database.
 
+    Args:
+        chunksize: If set, stream the files in chunks of at most this many rows, each
+            chunk being transformed and loaded before the next one is read.
+        workers: If set, extract and transform the files across this many worker processes.
+        fact_keys: "pandas" to resolve the fact table's dimension keys with pandas merges,
+            "sql" to resolve them inside SQLite through a staging table, "star" to build
+            the dimensions and facts in a single pass over factorized natural keys.
+        incremental: If set to "append" or "upsert", keep the existing warehouse and only
+            add new orders ("append") or also update orders that changed ("upsert").
+            Otherwise the warehouse is dropped and rebuilt from the input files.
+        dedup_rows: Drop rows whose business content was already loaded by an earlier run,
+            using the persistent row fingerprint index.
+        compact: Hold the extracted text columns as categoricals and arrow-backed strings
+            to cut the memory used per row.
+        date_formats: The strftime formats PaymentDate is parsed with, tried in order.
+            Defaults to dd/mm/yyyy, then yyyy-mm-dd.
+        engine: The CSV reader backend, "pandas" or "pyarrow" (memory-mapped, multithreaded).
+        encoding: The encoding the input files are decoded with, or "auto" to detect it per file.
+        cache_dir: If set, keep the parsed input files in this directory, so a rerun after a
+            failed load reads them back instead of parsing the CSV files again. Not used with
+            chunksize.
+        cache_size_mb: The size the parsed-file cache is trimmed to, least recently used first.
+        pipelined: Run extraction, transformation and loading as overlapping stages connected
+            by bounded queues, one batch per file, or per chunk if chunksize is set.
+        metrics_report: If set, write the per-stage metrics of the run (wall and CPU time, rows,
+            bytes read, peak RSS) to this JSON file.
+        metrics_prometheus: If set, also write them to this file in the Prometheus text format.
+        validate: Check every row against the validation rules before the transform and
+            quarantine the failing rows instead of loading them.
+        reject_dir: The folder the quarantined rows are written to, one reject file per
+            input file with the reasons each row was rejected for. Defaults to data/rejected.
+        aggregates: Keep the reporting aggregate tables up to date, recomputing only the
+            days and months the loaded orders fall on.
+        rebuild: Recompute the aggregate tables from the whole fact table after the load.
+        partition_by: If set to "year", "month" or "day", load the facts into one shard file
+            per period of their PaymentDate instead of the core database. The aggregate
+            tables are not maintained for a partitioned warehouse.
+        shard_dir: The folder the shard files are kept in. Defaults to a folder next to
+            the database.
+        watch: Stay resident and load the files arriving in data/unprocessed in micro-batches
+            until interrupted, instead of loading the files present once. The existing
+            warehouse is kept and orders already loaded are skipped unless incremental is
+            "upsert".
+        batch_policy: The BatchPolicy grouping the arriving files into micro-batches in
+            watch mode.
+        checkpoint: Commit every chunk with a checkpoint in the run journal, so a run that
+            failed or was killed is resumed where it stopped by the next checkpointed run,
+            which then keeps the warehouse. Chunks of 100000 rows unless chunksize is set.
+        worker: Run as one of several workers sharing data/unprocessed: claim files from it,
+            load them and move them to data/processed until interrupted. Like watch, it keeps
+            the existing warehouse. Start as many workers as needed, on one or more hosts.
+        worker_id: The id of this worker, by default the host name and process id.
+        lease_seconds: How long a worker's claim on a file lasts without a heartbeat, after
+            which the other workers put the file back into data/unprocessed.
+        small_batch_bytes: Batches of files smaller than this in total are loaded with the
+            csv module instead of pandas, unless an option only the pandas pipeline supports
+            is set. 0 disables the small-batch path.
+        archive: Compress the loaded files into the date-partitioned archive in data/archive
+            instead of moving them to data/processed, so they can be replayed later.
+        paths: The Paths of the database, data folders and model scripts. Defaults to the
+            layout of this repository, see `config.default_paths`.
+
     Returns:
         None
     """
     # Set up logging
     setup_logging()
 
-    # Set the path to the SQLite database
-    database = r".\output\abcmusicaldwh.db"
+    # Set the paths of the database, the data folders and the model scripts
+    paths = paths or default_paths()
+    database = str(paths.database)
+    reject_dir = reject_dir or str(paths.rejected)
+
+    # Keep the loaded files in the compressed archive if asked to
+    file_archive = None
+    if archive:
+        archive_encoding = encoding if encoding != "auto" else "unicode_escape"
+        file_archive = FileArchive(paths.archive, database, date_formats=date_formats, encoding=archive_encoding)
 
     # Create a connection to the database
+    paths.database.parent.mkdir(parents=True, exist_ok=True)
     create_connection(database)
 
-    # Create the necessary tables in the database
-    create_tables_in_db(database, r".\model\create_tables.sql")
+    # Set up the per-period fact shards
+    fact_shards = None
+    if partition_by:
+        from lib.partitions import FactShards, default_shard_dir, drop_shards
+        fact_shards = FactShards(shard_dir or default_shard_dir(database), period=partition_by)
+        aggregates = rebuild = False
+
+    # Checkpointed runs are committed chunk by chunk, 100000 rows unless set otherwise
+    if checkpoint:
+        from lib.journal import incomplete_run
+        chunksize = chunksize or 100000
 
-    # Get a list of CSV files to process
-    files = get_csv_files_for_processing(r".\data\unprocessed")
+    # Drop the existing tables unless loading incrementally, staying resident or resuming a run
+    resident = watch or worker
+    resuming = checkpoint and incomplete_run(database, chunksize) is not None
+    if not incremental and not resident and not resuming:
+        create_tables_in_db(database, str(paths.drop_tables))
+        if fact_shards is not None:
+            drop_shards(fact_shards.shard_dir)
 
-    # exit if no files exist to process
-    if len(files) == 0:
+    # Bring the schema up to date with the migrations that have not been applied yet
+    apply_migrations(database, str(paths.migrations))
+
+    # Get a list of CSV files to process. Only the files present now are moved at the
+    # end of the run, not the files arriving while it loads
+    present_files = [] if resident else get_csv_files_for_processing(str(paths.unprocessed))
+    files = filter_unprocessed_files(database, present_files)
+
+    # exit if no files exist to process, moving away files that were already loaded
+    if len(files) == 0 and not resident:
         logging.error("No files to process, please place files in data/unprocessed", exc_info=True)
+        move_processed_files(str(paths.unprocessed), str(paths.processed), files=present_files, archive=file_archive)
         exit()
 
-    # Extract data from all CSV files
-    raw_df = extract_all_files(files)
+    # Collect the per-stage metrics of the run, written out even if it fails
+    collector = MetricsCollector()
+    try:
+        with collector:
+            # Set up the index of rows loaded by earlier runs
+            fingerprint_index = None
+            if dedup_rows:
+                from lib.fingerprints import FingerprintIndex
+                fingerprint_index = FingerprintIndex(database)
+
+            # Set up the cache of parsed input files
+            cache = None
+            if cache_dir:
+                from lib.cache import ParsedFileCache
+                cache = ParsedFileCache(cache_dir, max_bytes=cache_size_mb * 1024 * 1024)
+
+            # Set up the rules rows are validated against
+            validation_rules = None
+            if validate:
+                from lib.validation import default_rules
+                validation_rules = default_rules(date_formats)
+
+            # Only plain loads of small batches can skip pandas
+            small_batches = small_batch_bytes and not (
+                checkpoint or pipelined or chunksize or workers or dedup_rows
+                or cache or validate or fact_shards or encoding == "auto"
+            )
+
+            # The options every pipeline loads the files with
+            load_options = dict(
+                fact_keys=fact_keys,
+                track_files=True,
+                fingerprint_index=fingerprint_index,
+                compact=compact,
+                date_formats=date_formats,
+                engine=engine,
+                encoding=encoding,
+                validation_rules=validation_rules,
+                reject_dir=reject_dir,
+                aggregates=aggregates,
+                fact_shards=fact_shards,
+            )
+
+            # Extract, transform and load the data
+            def load_files(files, session=None):
+                # chunking and pipelining do not change how duplicate orders are treated
+                order_mode = incremental or ("append" if resident else "insert")
+                if small_batches and is_small_batch(files, small_batch_bytes):
+                    try:
+                        return load_small_files(
+                            database,
+                            files,
+                            order_mode=order_mode,
+                            track_files=True,
+                            date_formats=date_formats,
+                            encoding=encoding,
+                            aggregates=aggregates,
+                            session=session,
+                        )
+                    except ValueError as e:
+                        logging.warning(f"Loading {len(files)} files with pandas, the small-batch path cannot: {e}")
+
+                from lib.pipeline import run_pipeline, run_chunked_pipeline, run_checkpointed_pipeline, run_pipelined
+                if checkpoint:
+                    return run_checkpointed_pipeline(
+                        database, files, chunksize, order_mode=order_mode, session=session, **load_options
+                    )
+                elif pipelined:
+                    return run_pipelined(
+                        database, files, chunksize=chunksize, order_mode=order_mode, cache=cache,
+                        session=session, **load_options
+                    )
+                elif chunksize:
+                    return run_chunked_pipeline(
+                        database, files, chunksize, order_mode=order_mode, session=session, **load_options
+                    )
+                else:
+                    return run_pipeline(
+                        database, files, workers=workers, order_mode=order_mode, cache=cache, session=session,
+                        **load_options
+                    )
+
+            if watch:
+                # Load the arriving files in micro-batches until interrupted
+                stop = threading.Event()
+                stop_on_signals(stop)
+                watch_folder(
+                    database,
+                    str(paths.unprocessed),
+                    str(paths.processed),
+                    load_files,
+                    policy=batch_policy or BatchPolicy(),
+                    stop=stop,
+                    archive=file_archive,
+                )
+            elif worker:
+                # Claim and load files alongside the other workers until interrupted
+                stop = threading.Event()
+                stop_on_signals(stop)
+                run_worker(
+                    database,
+                    str(paths.unprocessed),
+                    str(paths.processed),
+                    load_files,
+                    worker_id=worker_id,
+                    lease_seconds=lease_seconds,
+                    stop=stop,
+                    archive=file_archive,
+                )
+            else:
+                load_files(files)
+
+            # Build the secondary indexes after the bulk load
+            build_deferred_indexes(database, str(paths.deferred_indexes))
+
+            # Recompute the aggregate tables from scratch if asked to
+            if rebuild:
+                from lib.aggregates import rebuild_aggregates
+                rebuild_aggregates(database)
+
+            # Move the files loaded or skipped as already loaded to the processed folder,
+            # leaving the files recorded as failed in the manifest
+            if not resident:
+                failed_files = filter_unprocessed_files(database, present_files)
+                loaded_files = [f for f in present_files if f not in failed_files]
+                move_processed_files(str(paths.unprocessed), str(paths.processed), files=loaded_files, archive=file_archive)
+    finally:
+        if metrics_report:
+            collector.write_json(metrics_report)
+        if metrics_prometheus:
+            collector.write_prometheus(metrics_prometheus)
+
+
+def replay(
+    first=None,
+    last=None,
+    chunksize=100000,
+    fact_keys="pandas",
+    incremental=None,
+    date_formats=None,
+    encoding="unicode_escape",
+    aggregates=True,
+    drop=False,
+    partition_by=None,
+    shard_dir=None,
+    paths=None,
+):
+    """
+    Load the rows of a date range from the compressed archive back into the warehouse,
+    e.g. to backfill a period or to rebuild the warehouse after a schema change.
+
+    Args:
+        first: The first day to load, as yyyy-mm-dd. Defaults to the earliest archived.
+        last: The last day to load, as yyyy-mm-dd. Defaults to the latest archived.
+        chunksize: The maximum number of rows read from an archived file at once.
+        fact_keys: How the fact rows get their dimension keys, see `main`.
+        incremental: "upsert" to update the orders already loaded; by default they are
+            kept as they are.
+        date_formats: The strftime formats PaymentDate is parsed with, tried in order.
+        encoding: The encoding the archived files are decoded with.
+        aggregates: Keep the reporting aggregate tables up to date.
+        drop: Drop the warehouse tables first and rebuild them from the archive. The
+            archive index is kept.
+        partition_by: Set if the warehouse is partitioned, to load the facts into the shards.
+        shard_dir: The folder the shard files are kept in. Defaults to a folder next to
+            the database.
+        paths: The Paths of the warehouse, see `config.default_paths`.
+
+    Returns:
+        None
+    """
+    from lib.pipeline import replay_archive
+
+    setup_logging()
+    paths = paths or default_paths()
+    database = str(paths.database)
+    fact_shards = None
+    if partition_by:
+        from lib.partitions import FactShards, default_shard_dir, drop_shards
+        fact_shards = FactShards(shard_dir or default_shard_dir(database), period=partition_by)
+        aggregates = False
+    if drop:
+        create_tables_in_db(database, str(paths.drop_tables))
+        if fact_shards is not None:
+            drop_shards(fact_shards.shard_dir)
+    apply_migrations(database, str(paths.migrations))
+    archive = FileArchive(paths.archive, database, date_formats=date_formats, encoding=encoding)
+    replay_archive(
+        database,
+        archive,
+        first=first,
+        last=last,
+        chunksize=chunksize,
+        fact_keys=fact_keys,
+        order_mode=incremental or "append",
+        date_formats=date_formats,
+        encoding=encoding,
+        aggregates=aggregates,
+        fact_shards=fact_shards,
+    )
+    build_deferred_indexes(database, str(paths.deferred_indexes))
 
-    # Transform the data
-    transformed_df = transform_data(raw_df)
 
-    # Create dimension tables
-    dim_client_df = create_dimension_client(transformed_df)
-    dim_payment_df = create_dimension_payment(transformed_df)
-    dim_product_df = create_dimension_product(transformed_df)
+def rebuild(paths=None):
+    """
+    Bring the schema up to date, build the deferred indexes and recompute the aggregate
+    tables from the whole fact table, without loading any files.
 
-    # Convert the PaymentDate column to a string
-    dim_payment_df["PaymentDate"] = dim_payment_df["PaymentDate"].astype(str)
+    Args:
+        paths: The Paths of the warehouse, see `config.default_paths`.
 
-    # Load the dimension tables into the database
-    load_data_clients(database, dim_client_df)
-    load_data_payments(database, dim_payment_df)
-    load_data_products(database, dim_product_df)
+    Returns:
+        None
+    """
+    from lib.aggregates import rebuild_aggregates
 
-    # Create the fact table with foreign keys to dimension tables
-    fact_orders_df = create_fact_orders(database, transformed_df)
+    setup_logging()
+    paths = paths or default_paths()
+    database = str(paths.database)
+    apply_migrations(database, str(paths.migrations))
+    build_deferred_indexes(database, str(paths.deferred_indexes))
+    rebuild_aggregates(database)
 
-    # Load the fact table into the database
-    load_data_orders(database, fact_orders_df)
 
-    # Move processed files to the processed folder
-    move_processed_files(r".\data\unprocessed", r".\data\processed",)
+def status(paths=None):
+    """
+    Print a summary of the warehouse and its inbox, without writing to the database.
+
+    Args:
+        paths: The Paths of the warehouse, see `config.default_paths`.
+
+    Returns:
+        None
+    """
+    from lib.status import format_status, warehouse_status
+
+    paths = paths or default_paths()
+    print(format_status(warehouse_status(str(paths.database), inbox=str(paths.unprocessed))))
+
+
+def serve(port=8765, partition_by=None, shard_dir=None, paths=None):
+    """
+    Serve the canned queries of the query service over HTTP on localhost until interrupted.
+
+    Args:
+        port: The port to listen on.
+        partition_by: Set if the warehouse is partitioned, so the queries read the facts
+            from the shards.
+        shard_dir: The folder the shard files are kept in. Defaults to a folder next to
+            the database.
+        paths: The Paths of the warehouse, see `config.default_paths`.
+
+    Returns:
+        None
+    """
+    from lib.partitions import default_shard_dir
+    from lib.queries import QueryService, make_server
+
+    setup_logging()
+    database = str((paths or default_paths()).database)
+    shard_dir = (shard_dir or default_shard_dir(database)) if partition_by else None
+    service = QueryService(database, shard_dir=shard_dir)
+    server = make_server(service, port=port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+def build_parser():
+    """
+    Build the command line parser, one subcommand per entry of COMMANDS.
+
+    Returns:
+        An argparse.ArgumentParser.
+    """
+    location = argparse.ArgumentParser(add_help=False)
+    location.add_argument("--root", default=None, help="folder holding the output, data and model folders, by default the repository root")
+    location.add_argument("--database", default=None, help="SQLite database, by default output/abcmusicaldwh.db under the root")
+    location.add_argument("--data-dir", default=None, help="folder holding the unprocessed, processed and rejected folders, by default data under the root")
+
+    load = argparse.ArgumentParser(add_help=False, parents=[location])
+    load.add_argument("--chunksize", type=int, default=None, help="stream input files in chunks of this many rows")
+    load.add_argument("--workers", type=int, default=None, help="extract and transform files across this many worker processes")
+    load.add_argument("--fact-keys", choices=["pandas", "sql", "star"], default="pandas", help="resolve fact dimension keys with pandas merges, inside SQLite, or from single-pass factorized codes")
+    load.add_argument("--incremental", choices=["append", "upsert"], default=None, help="keep the existing warehouse and append new orders or upsert changed ones")
+    load.add_argument("--dedup-rows", action="store_true", help="drop rows already loaded by earlier runs")
+    load.add_argument("--compact", action="store_true", help="hold text columns as categoricals and arrow-backed strings")
+    load.add_argument("--date-format", action="append", dest="date_formats", help="strftime format of PaymentDate, may be repeated to try several in order")
+    load.add_argument("--csv-engine", choices=["pandas", "pyarrow"], default="pandas", help="CSV reader backend")
+    load.add_argument("--encoding", default="unicode_escape", help="encoding of the input files, or 'auto' to detect it per file")
+    load.add_argument("--cache-dir", default=None, help="cache parsed input files in this directory for reruns")
+    load.add_argument("--cache-size-mb", type=int, default=2048, help="size the parsed-file cache is trimmed to")
+    load.add_argument("--pipelined", action="store_true", help="overlap the extract, transform and load of consecutive files or chunks")
+    load.add_argument("--metrics-report", default=None, help="write the per-stage metrics of the run to this JSON file")
+    load.add_argument("--metrics-prometheus", default=None, help="write the per-stage metrics in the Prometheus text format to this file")
+    load.add_argument("--validate", action="store_true", help="quarantine rows failing the validation rules instead of loading them")
+    load.add_argument("--reject-dir", default=None, help="folder the quarantined rows are written to, by default data/rejected")
+    load.add_argument("--no-aggregates", action="store_false", dest="aggregates", help="do not maintain the reporting aggregate tables")
+    load.add_argument("--rebuild-aggregates", action="store_true", help="recompute the aggregate tables from the whole fact table after the load")
+    load.add_argument("--partition-by", choices=["year", "month", "day"], default=None, help="load the facts into one shard file per period of their payment date")
+    load.add_argument("--shard-dir", default=None, help="folder the fact shard files are kept in")
+    load.add_argument("--archive", action="store_true", help="compress loaded files into data/archive instead of moving them to data/processed")
+    load.add_argument("--small-batch-kb", type=int, default=SMALL_BATCH_BYTES // 1024, help="load batches smaller than this without pandas, 0 to always use pandas")
+
+    parser = argparse.ArgumentParser(description="ABC Musical data warehouse ETL pipeline")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", parents=[load], help="load the files in data/unprocessed once (default)")
+    run.add_argument("--checkpoint", action="store_true", help="commit each chunk with a checkpoint in the run journal and resume the last interrupted run")
+
+    watch = commands.add_parser("watch", parents=[load], help="stay resident and load arriving files in micro-batches")
+    watch.add_argument("--batch-max-files", type=int, default=50, help="maximum files per micro-batch")
+    watch.add_argument("--batch-max-mb", type=int, default=256, help="maximum megabytes per micro-batch")
+    watch.add_argument("--batch-latency", type=float, default=2.0, help="seconds a ready file waits for others to join its batch")
+    watch.add_argument("--poll-interval", type=float, default=0.5, help="seconds between two scans of data/unprocessed")
+
+    worker = commands.add_parser("worker", parents=[load], help="claim and load files from data/unprocessed alongside other workers")
+    worker.add_argument("--worker-id", default=None, help="id of this worker, by default host name and process id")
+    worker.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS, help="seconds a claim on a file lasts without a heartbeat")
+
+    replay = commands.add_parser("replay", parents=[location], help="load a date range from the compressed archive back into the warehouse")
+    replay.add_argument("--first", default=None, help="first payment day to load, yyyy-mm-dd")
+    replay.add_argument("--last", default=None, help="last payment day to load, yyyy-mm-dd")
+    replay.add_argument("--chunksize", type=int, default=100000, help="rows read from an archived file at once")
+    replay.add_argument("--fact-keys", choices=["pandas", "sql", "star"], default="pandas", help="resolve fact dimension keys with pandas merges, inside SQLite, or from single-pass factorized codes")
+    replay.add_argument("--incremental", choices=["append", "upsert"], default=None, help="upsert to update orders already loaded; they are skipped by default")
+    replay.add_argument("--date-format", action="append", dest="date_formats", help="strftime format of PaymentDate, may be repeated to try several in order")
+    replay.add_argument("--encoding", default="unicode_escape", help="encoding of the archived files")
+    replay.add_argument("--no-aggregates", action="store_false", dest="aggregates", help="do not maintain the reporting aggregate tables")
+    replay.add_argument("--drop", action="store_true", help="drop the warehouse tables and rebuild them from the archive")
+    replay.add_argument("--partition-by", choices=["year", "month", "day"], default=None, help="load the facts into the shards of a partitioned warehouse")
+    replay.add_argument("--shard-dir", default=None, help="folder the fact shard files are kept in")
+
+    commands.add_parser("rebuild", parents=[location], help="build the deferred indexes and recompute the aggregate tables")
+    commands.add_parser("status", parents=[location], help="summarize the warehouse and the files waiting to be loaded")
+
+    serve = commands.add_parser("serve", parents=[location], help="serve the canned queries over HTTP on localhost")
+    serve.add_argument("--port", type=int, default=8765, help="port to listen on")
+    serve.add_argument("--partition-by", choices=["year", "month", "day"], default=None, help="read the facts from the shards of a partitioned warehouse")
+    serve.add_argument("--shard-dir", default=None, help="folder the fact shard files are kept in")
+    return parser
+
+
+def parse_args(argv):
+    """
+    Parse the command line, accepting the flags of the earlier single-command CLI.
+
+    Without a subcommand the arguments are those of "run", and the former --watch,
+    --worker and --serve flags select the subcommand of the same name.
+
+    Args:
+        argv: The arguments, without the program name.
+
+    Returns:
+        An argparse.Namespace.
+    """
+    argv = list(argv)
+    if not argv or argv[0] not in COMMANDS + ["-h", "--help"]:
+        command = next((flag[2:] for flag in ["--watch", "--worker", "--serve"] if flag in argv), "run")
+        argv = [command] + [arg for arg in argv if arg != f"--{command}"]
+    return build_parser().parse_args(argv)
 
 
 if __name__ == '__main__':
-    main()
+    args = parse_args(sys.argv[1:])
+    paths = default_paths(args.root, args.database, args.data_dir)
+    if args.command == "status":
+        status(paths)
+    elif args.command == "replay":
+        replay(
+            first=args.first,
+            last=args.last,
+            chunksize=args.chunksize,
+            fact_keys=args.fact_keys,
+            incremental=args.incremental,
+            date_formats=args.date_formats,
+            encoding=args.encoding,
+            aggregates=args.aggregates,
+            drop=args.drop,
+            partition_by=args.partition_by,
+            shard_dir=args.shard_dir,
+            paths=paths,
+        )
+    elif args.command == "rebuild":
+        rebuild(paths)
+    elif args.command == "serve":
+        serve(port=args.port, partition_by=args.partition_by, shard_dir=args.shard_dir, paths=paths)
+    else:
+        batch_policy = None
+        if args.command == "watch":
+            batch_policy = BatchPolicy(
+                max_files=args.batch_max_files,
+                max_bytes=args.batch_max_mb * 1024 * 1024,
+                max_latency=args.batch_latency,
+                poll_interval=args.poll_interval,
+            )
+        main(
+            chunksize=args.chunksize,
+            workers=args.workers,
+            fact_keys=args.fact_keys,
+            incremental=args.incremental,
+            dedup_rows=args.dedup_rows,
+            compact=args.compact,
+            date_formats=args.date_formats,
+            engine=args.csv_engine,
+            encoding=args.encoding,
+            cache_dir=args.cache_dir,
+            cache_size_mb=args.cache_size_mb,
+            pipelined=args.pipelined,
+            metrics_report=args.metrics_report,
+            metrics_prometheus=args.metrics_prometheus,
+            validate=args.validate,
+            reject_dir=args.reject_dir,
+            aggregates=args.aggregates,
+            rebuild=args.rebuild_aggregates,
+            partition_by=args.partition_by,
+            shard_dir=args.shard_dir,
+            watch=args.command == "watch",
+            batch_policy=batch_policy,
+            checkpoint=getattr(args, "checkpoint", False),
+            worker=args.command == "worker",
+            worker_id=getattr(args, "worker_id", None),
+            lease_seconds=getattr(args, "lease_seconds", DEFAULT_LEASE_SECONDS),
+            small_batch_bytes=args.small_batch_kb * 1024,
+            archive=args.archive,
+            paths=paths,
+        )
@@ -0,0 +1,69 @@
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from src.lib import aggregates
+from src.lib.aggregates import AGGREGATE_TABLES, rebuild_aggregates
+from src.lib.etl import extract_file
+from src.lib.migrations import apply_migrations
+from src.lib.pipeline import run_chunked_pipeline, run_pipeline
+
+MIGRATIONS_DIR = "./model/migrations"
+DATA_FILE = Path("./data/unprocessed/data.csv")
+
+
+def read_aggregates(database):
+    conn = sqlite3.connect(database)
+    try:
+        return {
+            table: conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2, 3").fetchall()
+            for table in AGGREGATE_TABLES
+        }
+    finally:
+        conn.close()
+
+
+def assert_aggregates_match_rebuild(database):
+    refreshed = read_aggregates(database)
+    rebuild_aggregates(database)
+    assert refreshed == read_aggregates(database)
+    return refreshed
+
+
+@pytest.mark.parametrize("fact_keys", ["pandas", "star"])
+def test_refreshed_aggregates_match_a_full_rebuild(tmp_path, fact_keys):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+
+    run_chunked_pipeline(database, [DATA_FILE], chunksize=10, fact_keys=fact_keys, aggregates=True)
+    refreshed = assert_aggregates_match_rebuild(database)
+
+    conn = sqlite3.connect(database)
+    revenue = conn.execute("SELECT SUM(total_price), COUNT(*) FROM fact_orders").fetchone()
+    conn.close()
+    for table in AGGREGATE_TABLES:
+        assert sum(row[5] for row in refreshed[table]) == pytest.approx(revenue[0])
+        assert sum(row[3] for row in refreshed[table]) == revenue[1]
+
+
+def test_later_loads_only_recompute_their_days(tmp_path, monkeypatch):
+    # never fall back to a full rebuild once the first load is aggregated
+    monkeypatch.setattr(aggregates, "REBUILD_DAY_SHARE", 1e9)
+    df = extract_file(DATA_FILE)
+    first, second = tmp_path / "first.csv", tmp_path / "second.csv"
+    df.iloc[:13].to_csv(first, index=False)
+    changed = df.iloc[9:].copy()
+    # re-send four orders of the first file, moving the only order of 2021-04-10
+    changed.iloc[0, changed.columns.get_loc("PaymentDate")] = "01/01/2021"
+    changed.iloc[0, changed.columns.get_loc("PaymentBillingCode")] = "PO-MOVED"
+    changed.to_csv(second, index=False)
+
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    run_pipeline(database, [first], aggregates=True)
+    run_pipeline(database, [second], order_mode="upsert", aggregates=True)
+
+    refreshed = assert_aggregates_match_rebuild(database)
+    assert "2021-01-01" in {row[0] for row in refreshed["agg_daily_revenue"]}
+    assert "2021-04-10" not in {row[0] for row in refreshed["agg_daily_revenue"]}
@@ -0,0 +1,87 @@
+import gzip
+import shutil
+import sqlite3
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+
+from src.lib.archive import FileArchive
+from src.lib.db_helper import create_tables_in_db
+from src.lib.migrations import apply_migrations
+from src.lib.pipeline import replay_archive, run_pipeline
+
+MIGRATIONS_DIR = "./model/migrations"
+DROP_TABLES = "./model/drop_tables.sql"
+DATA_FILE = Path("./data/unprocessed/data.csv")
+
+
+def facts(database):
+    conn = sqlite3.connect(database)
+    try:
+        return conn.execute(
+            """
+            SELECT f.order_number, c.client_name, p.product_name, pay.payment_date, f.total_price
+            FROM fact_orders f
+            JOIN dim_clients c USING (client_key)
+            JOIN dim_products p USING (product_key)
+            JOIN dim_payment pay USING (payment_key)
+            ORDER BY f.order_number
+            """
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def test_files_are_compressed_into_day_partitions_and_indexed(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    archive = FileArchive(tmp_path / "archive", database)
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    shutil.copy(DATA_FILE, inbox / "orders.csv")
+    shutil.copy(DATA_FILE, inbox / "resent.csv")
+
+    entry = archive.add(inbox / "orders.csv", archived_on=date(2021, 5, 4))
+    assert entry.archive_path == f"2021/05/04/orders.{entry.content_hash[:12]}.csv.gz"
+    assert not (inbox / "orders.csv").exists()
+    with gzip.open(archive.path(entry), "rb") as f:
+        assert f.read() == DATA_FILE.read_bytes()
+    assert entry.archived_size < entry.file_size
+
+    df = pd.read_csv(DATA_FILE, dtype=str)
+    dates = pd.to_datetime(df["PaymentDate"], format="%d/%m/%Y", errors="coerce").dropna()
+    assert entry.row_count == len(df)
+    assert (entry.first_payment_date, entry.last_payment_date) == (
+        f"{dates.min():%Y-%m-%d}",
+        f"{dates.max():%Y-%m-%d}",
+    )
+
+    # a redelivered copy is not stored twice
+    assert archive.add(inbox / "resent.csv") == entry
+    assert not (inbox / "resent.csv").exists()
+    assert archive.select() == [entry]
+    assert archive.select(last="2020-12-31") == []
+
+
+def test_replay_rebuilds_the_warehouse_from_the_archive(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    source = tmp_path / "orders.csv"
+    shutil.copy(DATA_FILE, source)
+    run_pipeline(database, [source], aggregates=True)
+    loaded = facts(database)
+    archive = FileArchive(tmp_path / "archive", database)
+    archive.add(source)
+
+    # the archive index survives dropping the warehouse
+    create_tables_in_db(database, DROP_TABLES)
+    apply_migrations(database, MIGRATIONS_DIR)
+    assert replay_archive(database, archive, chunksize=10, aggregates=True) == len(loaded)
+    assert facts(database) == loaded
+
+    create_tables_in_db(database, DROP_TABLES)
+    apply_migrations(database, MIGRATIONS_DIR)
+    replay_archive(database, archive, first="2021-02-01", last="2021-02-28")
+    february = [row for row in loaded if row[3].startswith("2021-02")]
+    assert february and facts(database) == february
@@ -0,0 +1,46 @@
+import sqlite3
+
+from benchmarks.generate_orders import GeneratorConfig, generate_orders
+from benchmarks.run_benchmarks import compare
+from src.lib.etl import extract_file
+from src.lib.migrations import apply_migrations
+from src.lib.pipeline import run_pipeline
+
+MIGRATIONS_DIR = "./model/migrations"
+
+
+def test_generated_orders_match_the_extract_schema(tmp_path):
+    config = GeneratorConfig(rows=5_000, clients=50, products=20, payments=300, duplicate_ratio=0.1, bad_line_ratio=0.02, seed=7)
+    path = tmp_path / "orders.csv"
+    expected_orders = generate_orders(path, config)
+
+    # the same config always writes the same file
+    generate_orders(tmp_path / "again.csv", config)
+    assert (tmp_path / "again.csv").read_bytes() == path.read_bytes()
+
+    df = extract_file(path)
+    assert 0.95 * config.rows < len(df) < config.rows
+    assert df["OrderNumber"].nunique() == expected_orders
+    assert df["ClientName"].nunique() == 50
+    assert df["ProductName"].nunique() == 20
+    assert df["PaymentBillingCode"].nunique() == 300
+
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    assert run_pipeline(database, [path]) == expected_orders
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT COUNT(*) FROM fact_orders").fetchone()[0] == expected_orders
+    conn.close()
+
+
+def test_compare_flags_only_significant_slowdowns():
+    baseline = {
+        "1000/pipeline": {"wall_seconds": 1.0, "stages": {"extract_file": 0.5, "transform_data": 0.01}},
+    }
+    results = {
+        "1000/pipeline": {"wall_seconds": 1.1, "stages": {"extract_file": 0.8, "transform_data": 0.03}},
+        "1000/main": {"wall_seconds": 5.0},
+    }
+    assert compare(results, baseline, threshold=0.2) == [
+        "1000/pipeline extract_file: 0.800s vs 0.500s baseline (+60%)"
+    ]
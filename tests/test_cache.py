@@ -0,0 +1,82 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from src.lib import etl
+from src.lib.cache import ParsedFileCache
+from src.lib.etl import extract_file, input_schema
+
+DATA_FILE = "./data/unprocessed/data.csv"
+OTHER_FILE = "./data/ignore/new_data.csv"
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_cached_file_matches_parsed_file(tmp_path, monkeypatch, compact):
+    cache = ParsedFileCache(str(tmp_path / "cache"))
+    expected = extract_file(DATA_FILE, compact=compact)
+
+    assert extract_file(DATA_FILE, compact=compact, cache=cache) is not None
+    assert len(list((tmp_path / "cache").glob("*.feather"))) == 1
+
+    # a hit must not parse the CSV file again
+    def fail_read_csv(*args, **kwargs):
+        raise AssertionError("read_csv called on a cache hit")
+
+    monkeypatch.setattr(etl, "read_csv", fail_read_csv)
+    pd.testing.assert_frame_equal(extract_file(DATA_FILE, compact=compact, cache=cache), expected)
+
+
+def test_cache_is_keyed_by_content_and_schema(tmp_path):
+    cache = ParsedFileCache(str(tmp_path / "cache"))
+    copy = tmp_path / "copy.csv"
+    shutil.copy(DATA_FILE, copy)
+
+    assert cache.entry_path(copy, input_schema(), "utf-8") == cache.entry_path(DATA_FILE, input_schema(), "utf-8")
+    assert cache.entry_path(copy, input_schema(), "utf-8") != cache.entry_path(copy, input_schema(compact=True), "utf-8")
+
+    with open(copy, "a") as f:
+        f.write("\n")
+    assert cache.entry_path(copy, input_schema(), "utf-8") != cache.entry_path(DATA_FILE, input_schema(), "utf-8")
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ParsedFileCache(str(tmp_path / "cache"))
+    extract_file(DATA_FILE, cache=cache)
+    first_entry = cache.entry_path(DATA_FILE, input_schema(), "unicode_escape")
+    os.utime(first_entry, (0, 0))
+
+    # room for one entry only, so caching a second file evicts the older one
+    cache.max_bytes = first_entry.stat().st_size
+    extract_file(OTHER_FILE, cache=cache)
+    assert not first_entry.exists()
+    assert cache.entry_path(OTHER_FILE, input_schema(), "unicode_escape").exists()
+
+
+def test_skipped_lines_are_only_collected_when_they_are_rejected(tmp_path, monkeypatch):
+    long_line = tmp_path / "long_line.csv"
+    lines = open(DATA_FILE).read().splitlines(keepends=True)
+    with open(long_line, "w") as f:
+        f.write("".join(lines[:2]) + lines[2].rstrip("\n") + ",surplus\n" + "".join(lines[3:]))
+
+    # without a reject folder, the line is skipped by the C parser and the file is cached
+    engines = []
+    original_read_csv = pd.read_csv
+
+    def read_csv(*args, **kwargs):
+        engines.append(kwargs.get("engine"))
+        return original_read_csv(*args, **kwargs)
+
+    monkeypatch.setattr(pd, "read_csv", read_csv)
+    cache = ParsedFileCache(str(tmp_path / "cache"))
+    assert len(extract_file(long_line, cache=cache)) == len(lines) - 2
+    assert "python" not in engines
+    assert len(list((tmp_path / "cache").glob("*.feather"))) == 1
+
+    # with one, it is collected and the file is not cached, so it is rejected again on a rerun
+    other_cache = ParsedFileCache(str(tmp_path / "other_cache"))
+    assert len(extract_file(long_line, cache=other_cache, reject_dir=str(tmp_path / "rejected"))) == len(lines) - 2
+    assert "python" in engines
+    assert list((tmp_path / "other_cache").glob("*.feather")) == []
+    assert len(list((tmp_path / "rejected").glob("*.rejects.csv"))) == 1
@@ -0,0 +1,53 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from src.lib.db_helper import LoadSession, load_data_clients, load_data_products
+from src.lib.migrations import apply_migrations
+
+MIGRATIONS_DIR = "./model/migrations"
+
+dim_client_df = pd.DataFrame({
+    "ClientName": ["john doe", "jane doe"],
+    "DeliveryAddress": ["123 Main St", "456 Elm St"],
+    "DeliveryCity": ["Anytown", "Othertown"],
+    "DeliveryPostcode": ["12345", "67890"],
+    "DeliveryCountry": ["USA", "Canada"],
+    "DeliveryContactNumber": ["555-1234", "555-5678"],
+})
+
+
+def count_rows(database, table):
+    conn = sqlite3.connect(database)
+    count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_load_session_commits_all_loads(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+
+    with LoadSession(database) as session, session.transaction():
+        load_data_clients(database, dim_client_df, conn=session.conn)
+        # uncommitted rows are not visible to other connections
+        assert count_rows(database, "dim_clients") == 0
+
+    assert count_rows(database, "dim_clients") == 2
+    with LoadSession(database) as session:
+        assert session.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_load_session_rolls_back_on_failure(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    # product_type is NOT NULL, so this load fails after the clients were loaded
+    bad_product_df = pd.DataFrame({"ProductName": ["Piano"], "ProductType": [None]})
+
+    with pytest.raises(sqlite3.IntegrityError):
+        with LoadSession(database) as session, session.transaction():
+            load_data_clients(database, dim_client_df, conn=session.conn)
+            load_data_products(database, bad_product_df, conn=session.conn)
+
+    assert count_rows(database, "dim_clients") == 0
@@ -1,8 +1,11 @@
 import pandas as pd
 import numpy as np
+import pytest
 
 
-from src.lib.etl import get_csv_files_for_processing, extract_file, transform_data, create_dimension_client, create_dimension_payment, create_dimension_product, create_fact_orders
+from pathlib import Path
+
+from src.lib.etl import get_csv_files_for_processing, extract_file, extract_all_files, extract_transform_files_parallel, parse_dates, PAYMENT_DATE_FORMATS, transform_data, create_dimension_client, create_dimension_payment, create_dimension_product, create_fact_orders, build_star_schema
 
 def test_get_csv_files_for_processing():
     folder_path = "./data/test_data/"
@@ -30,6 +33,25 @@ def test_extract_file():
     result_df = extract_file(file_path)
     pd.testing.assert_frame_equal(result_df, expected_df)
     
+def test_extract_file_compact():
+    files = [Path("./data/unprocessed/data.csv"), Path("./data/ignore/new_data.csv")]
+    default_df = extract_all_files(files)
+    compact_df = extract_all_files(files, compact=True)
+
+    assert compact_df["Currency"].dtype == "category"
+    assert set(compact_df["DeliveryCountry"].cat.categories) == set(default_df["DeliveryCountry"])
+    assert compact_df.memory_usage(deep=True).sum() < default_df.memory_usage(deep=True).sum()
+    pd.testing.assert_frame_equal(compact_df.astype(object), default_df.astype(object))
+    
+def test_extract_transform_files_parallel():
+    files = [Path("./data/ignore/data2.csv"), Path("./data/unprocessed/data.csv"), Path("./data/ignore/datacopy.csv")]
+    result_df = extract_transform_files_parallel(files, workers=2)
+
+    expected_df = transform_data(extract_all_files(files), load_date=result_df["LoadDate"].iloc[0])
+    pd.testing.assert_frame_equal(result_df, expected_df)
+    assert result_df["RecordId"].is_unique
+    assert result_df["file"].unique().tolist() == ["data2", "data", "datacopy"]
+    
 def test_transform_data():
     # create test input dataframe
     input_data = {'PaymentDate': ['2022-01-01', '2022-01-02', '2022-01-03'],
@@ -61,12 +83,46 @@ def test_transform_data():
                      'ProductQuantity': [1, 2, 3],
                      'TotalPrice': [10.0, 40.0, 90.0],
                      'LoadDate': output_df['LoadDate'], # how to match load datetime in test?
-                     'RecordId': np.arange(len(input_df))}
+                     'RecordId': np.arange(len(input_df)),
+                     'RowFingerprint': output_df['RowFingerprint']}
     expected_df = pd.DataFrame(data=expected_data)
     
     # assert that output dataframe equals expected dataframe
     pd.testing.assert_frame_equal(output_df, expected_df)
     
+    assert output_df['RowFingerprint'].dtype == np.uint64
+    assert output_df['RowFingerprint'].is_unique
+    
+def test_parse_dates():
+    values = pd.Series(["03/04/2021", "21/03/2021", "2022-01-01", None, "03/04/2021"], name="PaymentDate")
+    expected = pd.Series(pd.to_datetime(["2021-04-03", "2021-03-21", "2022-01-01", None, "2021-04-03"]), name="PaymentDate")
+    pd.testing.assert_series_equal(parse_dates(values, PAYMENT_DATE_FORMATS), expected)
+    
+def test_parse_dates_reports_malformed_values(caplog):
+    values = pd.Series(["21/03/2021", "02/28/2023", "not a date"], name="PaymentDate")
+
+    parsed = parse_dates(values, PAYMENT_DATE_FORMATS)
+    assert parsed.isna().tolist() == [False, True, True]
+    assert "2 rows of PaymentDate match none of the formats" in caplog.text
+
+    with pytest.raises(ValueError):
+        parse_dates(values, PAYMENT_DATE_FORMATS, errors="raise")
+
+def test_transform_data_drops_rows_with_malformed_payment_dates(caplog):
+    df = extract_file("./data/test_data/file1.csv")
+    df["PaymentDate"] = ["21/03/2021", "not a date", None]
+
+    output_df = transform_data(df)
+    assert output_df["OrderNumber"].tolist() == ["1001", "1003"]
+    assert output_df["PaymentDate"].isna().tolist() == [False, True]
+    assert output_df.index.tolist() == [0, 1]
+    assert "Dropped 1 rows whose PaymentDate" in caplog.text
+    
+def test_row_fingerprint_is_stable_across_files():
+    first_df = transform_data(extract_file("./data/ignore/data2.csv"))
+    second_df = transform_data(extract_file("./data/ignore/datacopy.csv"))
+    pd.testing.assert_series_equal(first_df["RowFingerprint"], second_df["RowFingerprint"])
+    
 
 # test data
 input_df = pd.DataFrame({
@@ -113,6 +169,22 @@ def test_create_dimension_product():
     expected_columns = ["RecordId", "OrderNumber", "ProductName", "ProductType"]
     assert set(create_dimension_product(input_df).columns) == set(expected_columns)
     
+def test_build_star_schema():
+    star = build_star_schema(input_df)
+
+    # one row per natural key, in order of first appearance
+    assert star.dim_client["ClientName"].tolist() == ["John Doe", "Jane Doe", "Mary Smith"]
+    assert star.dim_product["ProductName"].tolist() == ["Product A", "Product B", "Product C"]
+    assert len(star.dim_payment) == 4
+    assert set(star.dim_client.columns) == set(create_dimension_client(input_df).columns)
+    assert set(star.dim_payment.columns) == set(create_dimension_payment(input_df).columns)
+    assert set(star.dim_product.columns) == set(create_dimension_product(input_df).columns)
+
+    # the fact codes point at the dimension rows of each order
+    assert star.fact_orders["client_code"].tolist() == [0, 1, 0, 2]
+    assert star.fact_orders["product_code"].tolist() == [0, 1, 0, 2]
+    assert star.fact_orders["payment_code"].tolist() == [0, 1, 2, 3]
+    
 # def test_create_fact_orders():
 #     # test that the function returns the correct number of rows
 #     assert len(create_fact_orders(input_df)) == 4
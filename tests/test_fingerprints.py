@@ -0,0 +1,49 @@
+import os
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.lib.fingerprints import BloomFilter, FingerprintIndex
+from src.lib.migrations import apply_migrations
+from src.lib.pipeline import run_pipeline
+
+MIGRATIONS_DIR = "./model/migrations"
+DATA_FILE = Path("./data/unprocessed/data.csv")
+
+
+def test_bloom_filter_has_no_false_negatives():
+    rng = np.random.default_rng(0)
+    added = rng.integers(0, 2**63, size=10_000, dtype=np.uint64)
+    others = rng.integers(0, 2**63, size=10_000, dtype=np.uint64)
+    bloom = BloomFilter.for_capacity(10_000, 0.01)
+    bloom.add(added)
+
+    assert bloom.might_contain(added).all()
+    assert bloom.might_contain(others).mean() < 0.05
+
+
+def test_rows_loaded_by_earlier_runs_are_dropped(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    loaded_rows = run_pipeline(database, [DATA_FILE], fingerprint_index=FingerprintIndex(database))
+    assert os.path.exists(f"{database}.bloom.npz")
+
+    # the next delivery repeats two rows of the first one and adds a new order
+    source_df = pd.read_csv(DATA_FILE, dtype=str)
+    new_order = source_df.iloc[[2]].assign(OrderNumber="PO9999999-1")
+    overlap_file = tmp_path / "overlap.csv"
+    pd.concat([source_df.iloc[:2], new_order]).to_csv(overlap_file, index=False)
+
+    # order_mode "insert" would fail on the repeated orders if they were not dropped
+    assert run_pipeline(database, [overlap_file], fingerprint_index=FingerprintIndex(database)) == 1
+
+    # without its bloom file the index is rebuilt from the table
+    os.remove(f"{database}.bloom.npz")
+    assert run_pipeline(database, [overlap_file], fingerprint_index=FingerprintIndex(database)) == 0
+
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT COUNT(*) FROM fact_orders").fetchone()[0] == loaded_rows + 1
+    assert conn.execute("SELECT row_count FROM row_fingerprint_state").fetchone()[0] == len(source_df) + 1
+    conn.close()
@@ -0,0 +1,96 @@
+import sqlite3
+from collections import Counter
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.lib import pipeline
+from src.lib.journal import RUN_COMPLETED, RUN_FAILED, incomplete_run
+from src.lib.migrations import apply_migrations
+from src.lib.pipeline import run_checkpointed_pipeline, run_pipeline
+
+MIGRATIONS_DIR = "./model/migrations"
+DATA_FILE = Path("./data/unprocessed/data.csv")
+
+
+def run_status(database):
+    conn = sqlite3.connect(database)
+    try:
+        return conn.execute("SELECT run_id, status FROM load_runs ORDER BY run_id").fetchall()
+    finally:
+        conn.close()
+
+
+def fact_count(database):
+    conn = sqlite3.connect(database)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM fact_orders").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_interrupted_run_resumes_from_its_last_checkpoint(tmp_path, monkeypatch):
+    first = tmp_path / "first.csv"
+    second = tmp_path / "second.csv"
+    pd.read_csv(DATA_FILE, dtype=str).to_csv(first, index=False)
+    df = pd.read_csv(DATA_FILE, dtype=str)
+    df["OrderNumber"] = df["OrderNumber"] + "-B"
+    df.to_csv(second, index=False)
+
+    expected = str(tmp_path / "expected.db")
+    apply_migrations(expected, MIGRATIONS_DIR)
+    run_pipeline(expected, [first, second])
+
+    transformed = Counter()
+    fail = {"second": 1}
+
+    def counting_transform(chunk, *args, **kwargs):
+        # fails on the second chunk of second.csv while the failure is armed
+        file = chunk["file"].iat[0]
+        if fail.get(file) == transformed[file]:
+            raise RuntimeError("simulated failure")
+        transformed[file] += 1
+        return original_transform(chunk, *args, **kwargs)
+
+    original_transform = pipeline.transform_data
+    monkeypatch.setattr(pipeline, "transform_data", counting_transform)
+
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    with pytest.raises(RuntimeError):
+        run_checkpointed_pipeline(
+            database, [first, second], chunksize=10, order_mode="insert", track_files=True
+        )
+    assert run_status(database) == [(1, RUN_FAILED)]
+    assert incomplete_run(database, 10) == 1
+    # first.csv and the first chunk of second.csv stay committed
+    assert fact_count(database) == fact_count(expected) // 2 + 10
+
+    fail.clear()
+    run_checkpointed_pipeline(
+        database, [first, second], chunksize=10, order_mode="insert", track_files=True
+    )
+    assert run_status(database) == [(1, RUN_COMPLETED)]
+    assert incomplete_run(database) is None
+    # the committed chunks were not transformed again, and no order was loaded twice
+    assert transformed == {"first": 3, "second": 3}
+    assert fact_count(database) == fact_count(expected)
+
+    conn = sqlite3.connect(database)
+    manifest = conn.execute("SELECT file_name, row_count, status FROM file_manifest ORDER BY 1").fetchall()
+    conn.close()
+    assert manifest == [("first.csv", 26, "loaded"), ("second.csv", 26, "loaded")]
+
+
+def test_run_with_another_chunksize_starts_afresh(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    conn = sqlite3.connect(database)
+    conn.execute("INSERT INTO load_runs (status, chunksize) VALUES ('failed', 5)")
+    conn.commit()
+    conn.close()
+
+    run_checkpointed_pipeline(database, [DATA_FILE], chunksize=10)
+    assert run_status(database) == [(1, RUN_FAILED), (2, RUN_COMPLETED)]
+    assert incomplete_run(database, 5) == 1
@@ -0,0 +1,80 @@
+import shutil
+import sqlite3
+
+import pytest
+
+from src.lib.etl import get_csv_files_for_processing
+from src.lib.migrations import apply_migrations
+from src.lib.pipeline import run_chunked_pipeline, run_pipeline
+
+MIGRATIONS_DIR = "./model/migrations"
+DATA_FILE = "./data/unprocessed/data.csv"
+
+
+def test_loaded_and_redelivered_files_are_skipped(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    inbox = tmp_path / "unprocessed"
+    inbox.mkdir()
+    shutil.copy(DATA_FILE, inbox / "data.csv")
+    shutil.copy(DATA_FILE, inbox / "datacopy.csv")
+
+    # the copy has the same content, so only one of the two is processed
+    files = get_csv_files_for_processing(str(inbox), database=database)
+    assert [f.name for f in files] == ["data.csv"]
+    run_pipeline(database, files, track_files=True)
+
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT file_name, row_count, status FROM file_manifest").fetchall() == [("data.csv", 26, "loaded")]
+    conn.close()
+
+    # a redelivery under a new name is skipped, a file with new content is not
+    shutil.copy(DATA_FILE, inbox / "redelivered.csv")
+    with open(inbox / "changed.csv", "w") as f:
+        f.write(open(DATA_FILE).read().replace("4700", "4800"))
+    files = get_csv_files_for_processing(str(inbox), database=database)
+    assert [f.name for f in files] == ["changed.csv"]
+
+
+def test_manifest_errors_are_not_reported_as_an_empty_folder(tmp_path):
+    # the database has no file_manifest table, e.g. it was never migrated
+    database = str(tmp_path / "test.db")
+    sqlite3.connect(database).close()
+    inbox = tmp_path / "unprocessed"
+    inbox.mkdir()
+    shutil.copy(DATA_FILE, inbox / "data.csv")
+
+    with pytest.raises(sqlite3.OperationalError):
+        get_csv_files_for_processing(str(inbox), database=database)
+
+
+def test_files_that_fail_to_extract_are_recorded_as_failed(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    inbox = tmp_path / "unprocessed"
+    inbox.mkdir()
+    shutil.copy(DATA_FILE, inbox / "data.csv")
+    lines = open(DATA_FILE).read().splitlines(keepends=True)
+    header = lines[0].rstrip("\n").split(",")
+    row = lines[1].rstrip("\n").split(",")
+    row[header.index("UnitPrice")] = "not a price"
+    with open(inbox / "bad.csv", "w") as f:
+        f.write(lines[0] + ",".join(row) + "\n")
+
+    files = get_csv_files_for_processing(str(inbox), database=database)
+    run_pipeline(database, files, track_files=True)
+
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT file_name, status FROM file_manifest ORDER BY file_name").fetchall() == [
+        ("bad.csv", "failed"),
+        ("data.csv", "loaded"),
+    ]
+    conn.close()
+    files = get_csv_files_for_processing(str(inbox), database=database)
+    assert [f.name for f in files] == ["bad.csv"]
+
+    # on its own, the file is still recorded rather than silently skipped
+    run_pipeline(database, files, track_files=True)
+    assert get_csv_files_for_processing(str(inbox), database=database) == files
+    with pytest.raises(ValueError):
+        run_chunked_pipeline(database, files, 10, track_files=True)
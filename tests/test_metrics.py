@@ -0,0 +1,81 @@
+import json
+import os
+from pathlib import Path
+
+from src.lib.metrics import MetricsCollector, instrument, stage
+from src.lib.migrations import apply_migrations
+from src.lib.pipeline import run_chunked_pipeline, run_pipeline
+
+MIGRATIONS_DIR = "./model/migrations"
+DATA_FILE = Path("./data/unprocessed/data.csv")
+
+
+def test_collector_records_every_stage(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+
+    with MetricsCollector() as collector:
+        loaded_rows = run_pipeline(database, [DATA_FILE])
+
+    by_stage = {r.stage: r for r in collector.records}
+    assert {
+        "extract_file",
+        "transform_data",
+        "create_dimension_client",
+        "create_dimension_payment",
+        "create_dimension_product",
+        "create_fact_orders",
+        "load_data_clients",
+        "load_data_payments",
+        "load_data_products",
+        "load_data_orders",
+    } <= set(by_stage)
+
+    extract = by_stage["extract_file"]
+    assert extract.file == "data"
+    assert extract.bytes_read == os.path.getsize(DATA_FILE)
+    assert extract.rows_out == 26
+    assert by_stage["transform_data"].rows_in == 26
+    assert by_stage["load_data_orders"].rows_out == loaded_rows
+    assert all(r.wall_seconds >= 0 and r.cpu_seconds >= 0 for r in collector.records)
+
+    report_path = tmp_path / "report.json"
+    collector.write_json(str(report_path))
+    report = json.loads(report_path.read_text())
+    assert report["summary"]["extract_file"]["calls"] == 1
+    assert len(report["stages"]) == len(collector.records)
+
+    prometheus_path = tmp_path / "metrics.prom"
+    collector.write_prometheus(str(prometheus_path))
+    lines = prometheus_path.read_text().splitlines()
+    assert "# TYPE etl_stage_wall_seconds gauge" in lines
+    assert f'etl_stage_rows_out{{stage="extract_file",file="data"}} 26' in lines
+
+
+def test_chunked_stages_are_attributed_to_their_file(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+
+    with MetricsCollector() as collector:
+        run_chunked_pipeline(database, [DATA_FILE], chunksize=10)
+
+    extracts = [r for r in collector.records if r.stage == "extract_file" and r.rows_out]
+    assert [r.rows_out for r in extracts] == [10, 10, 6]
+    assert sum(r.bytes_read for r in extracts) == os.path.getsize(DATA_FILE)
+    assert {r.file for r in collector.records if r.stage.startswith("load_data_")} == {"data"}
+
+
+def test_nothing_is_recorded_without_a_collector():
+    calls = []
+
+    @instrument
+    def double(x):
+        calls.append(x)
+        return 2 * x
+
+    collector = MetricsCollector()
+    assert double(2) == 4
+    with stage("block") as block:
+        block.rows_in = 1
+    assert calls == [2]
+    assert collector.records == []
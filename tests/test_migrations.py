@@ -0,0 +1,56 @@
+import shutil
+import sqlite3
+
+import pytest
+
+from src.lib.migrations import apply_migrations, build_deferred_indexes, list_migrations
+
+MIGRATIONS_DIR = "./model/migrations"
+INDEXES_PATH = "./model/deferred_indexes.sql"
+
+
+def test_apply_migrations_is_idempotent_and_keeps_data(tmp_path):
+    database = str(tmp_path / "test.db")
+    latest_version = list_migrations(MIGRATIONS_DIR)[-1][0]
+
+    assert apply_migrations(database, MIGRATIONS_DIR) == latest_version
+    conn = sqlite3.connect(database)
+    conn.execute("INSERT INTO dim_products (product_name, product_type) VALUES ('Piano', 'Keyboard')")
+    conn.commit()
+    conn.close()
+
+    assert apply_migrations(database, MIGRATIONS_DIR) == latest_version
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT COUNT(*) FROM dim_products").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM schema_migrations").fetchone()[0] == len(list_migrations(MIGRATIONS_DIR))
+    conn.close()
+
+
+def test_failing_migration_leaves_previous_version(tmp_path):
+    migrations_dir = tmp_path / "migrations"
+    shutil.copytree(MIGRATIONS_DIR, migrations_dir)
+    latest_version = list_migrations(MIGRATIONS_DIR)[-1][0]
+    (migrations_dir / f"{latest_version + 1:04d}_broken.sql").write_text(
+        "CREATE TABLE broken (id INTEGER);\nINSERT INTO missing_table VALUES (1);\n"
+    )
+    database = str(tmp_path / "test.db")
+
+    with pytest.raises(sqlite3.OperationalError):
+        apply_migrations(database, str(migrations_dir))
+
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()[0] == latest_version
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'broken'").fetchone() is None
+    conn.close()
+
+
+def test_build_deferred_indexes(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    build_deferred_indexes(database, INDEXES_PATH)
+    build_deferred_indexes(database, INDEXES_PATH)
+
+    conn = sqlite3.connect(database)
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'fact_orders'")}
+    conn.close()
+    assert {"idx_fact_orders_client_key", "idx_fact_orders_product_key", "idx_fact_orders_payment_key"} <= indexes
@@ -0,0 +1,164 @@
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.lib import pipeline
+from src.lib.db_helper import LoadSession
+from src.lib.etl import extract_file, transform_data
+from src.lib.migrations import apply_migrations
+from src.lib.partitions import FactShards, attach_shards, attached_limit, list_shards
+from src.lib.pipeline import load_batch, run_chunked_pipeline, run_pipeline
+
+MIGRATIONS_DIR = "./model/migrations"
+DATA_FILE = Path("./data/unprocessed/data.csv")
+
+FACT_QUERY = "SELECT order_number, client_key, product_key, payment_key, total_price FROM {} ORDER BY order_number"
+
+
+@pytest.mark.parametrize("fact_keys", ["pandas", "star"])
+def test_sharded_facts_match_the_core_table(tmp_path, fact_keys):
+    core = str(tmp_path / "core.db")
+    apply_migrations(core, MIGRATIONS_DIR)
+    run_pipeline(core, [DATA_FILE], fact_keys=fact_keys)
+
+    sharded = str(tmp_path / "sharded.db")
+    apply_migrations(sharded, MIGRATIONS_DIR)
+    fact_shards = FactShards(tmp_path / "shards")
+    loaded_rows = run_chunked_pipeline(
+        sharded, [DATA_FILE], chunksize=10, fact_keys=fact_keys, fact_shards=fact_shards
+    )
+
+    # data.csv has payments in January to April 2021
+    assert [key for key, _ in list_shards(tmp_path / "shards")] == ["2021_01", "2021_02", "2021_03", "2021_04"]
+
+    conn = sqlite3.connect(sharded)
+    assert conn.execute("SELECT COUNT(*) FROM fact_orders").fetchone()[0] == 0
+    assert attach_shards(conn, tmp_path / "shards") == ["2021_01", "2021_02", "2021_03", "2021_04"]
+    facts = conn.execute(FACT_QUERY.format("fact_orders_all")).fetchall()
+    assert len(facts) == loaded_rows
+
+    core_conn = sqlite3.connect(core)
+    assert facts == core_conn.execute(FACT_QUERY.format("fact_orders")).fetchall()
+
+    # each shard only holds its own month
+    march = conn.execute(
+        """
+        SELECT DISTINCT strftime('%Y-%m', p.payment_date)
+        FROM shard_2021_03.fact_orders f JOIN dim_payment p ON p.payment_key = f.payment_key
+        """
+    ).fetchall()
+    assert march == [("2021-03",)]
+
+    # a narrower range only attaches the shards it needs
+    assert attach_shards(conn, tmp_path / "shards", first="2021_02", last="2021_03") == ["2021_02", "2021_03"]
+    assert conn.execute("SELECT COUNT(*) FROM fact_orders_all").fetchone()[0] < loaded_rows
+    conn.close()
+    core_conn.close()
+
+
+def test_failed_load_rolls_back_every_shard(tmp_path, monkeypatch):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    fact_shards = FactShards(tmp_path / "shards")
+
+    def fail_on_second_file(transformed_df, *args, **kwargs):
+        if (transformed_df["file"] == "second").any():
+            raise RuntimeError("simulated failure")
+        return original_transform(transformed_df, *args, **kwargs)
+
+    original_transform = pipeline.transform_data
+    monkeypatch.setattr(pipeline, "transform_data", fail_on_second_file)
+    second = tmp_path / "second.csv"
+    pd.read_csv(DATA_FILE, dtype=str).to_csv(second, index=False)
+
+    with pytest.raises(RuntimeError):
+        run_chunked_pipeline(database, [DATA_FILE, second], chunksize=100, fact_shards=fact_shards)
+
+    # the first file's shards were created but their facts rolled back
+    assert list_shards(tmp_path / "shards")
+    for _, path in list_shards(tmp_path / "shards"):
+        conn = sqlite3.connect(path)
+        assert conn.execute("SELECT COUNT(*) FROM fact_orders").fetchone()[0] == 0
+        conn.close()
+
+
+def _resend_in_april(tmp_path, quantity="3"):
+    # the first order of data.csv, paid in March, re-sent with an April payment date
+    resent = tmp_path / f"resent_{quantity}.csv"
+    df = pd.read_csv(DATA_FILE, dtype=str).head(1)
+    df["PaymentDate"] = "21/04/2021"
+    df["ProductQuantity"] = quantity
+    df["TotalPrice"] = str(4700 * int(quantity))
+    df.to_csv(resent, index=False)
+    return resent
+
+
+def _order_shards(database, shard_dir, order_number):
+    conn = sqlite3.connect(database)
+    keys = [
+        key
+        for key in attach_shards(conn, shard_dir)
+        if conn.execute(f"SELECT 1 FROM shard_{key}.fact_orders WHERE order_number = ?", (order_number,)).fetchone()
+    ]
+    total = conn.execute("SELECT COUNT(*) FROM fact_orders_all").fetchone()[0]
+    conn.close()
+    return keys, total
+
+
+@pytest.mark.parametrize("order_mode, expected_shard", [("upsert", "2021_04"), ("append", "2021_03")])
+def test_an_order_resent_in_another_period_stays_in_one_shard(tmp_path, order_mode, expected_shard):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    fact_shards = FactShards(tmp_path / "shards")
+    loaded_rows = run_pipeline(database, [DATA_FILE], fact_shards=fact_shards)
+    assert _order_shards(database, tmp_path / "shards", "PO0060504-1") == (["2021_03"], loaded_rows)
+
+    resent = _resend_in_april(tmp_path)
+    run_pipeline(database, [resent], order_mode=order_mode, fact_shards=fact_shards)
+    assert _order_shards(database, tmp_path / "shards", "PO0060504-1") == ([expected_shard], loaded_rows)
+
+    # "insert" skips the order if it has the same values and fails otherwise
+    assert run_pipeline(database, [resent], fact_shards=fact_shards) == 0
+    with pytest.raises(sqlite3.IntegrityError):
+        run_pipeline(database, [_resend_in_april(tmp_path, quantity="4")], fact_shards=fact_shards)
+
+
+def test_shard_commits_are_undone_when_the_core_database_does_not_commit(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    fact_shards = FactShards(tmp_path / "shards")
+    loaded_rows = run_pipeline(database, [DATA_FILE], fact_shards=fact_shards)
+    resent = _resend_in_april(tmp_path)
+    transformed_df = transform_data(extract_file(resent))
+
+    # the shards commit the moved order, then the core database fails to commit
+    with LoadSession(database) as session:
+        with pytest.raises(RuntimeError):
+            with session.transaction():
+                with fact_shards.transaction(session.conn):
+                    load_batch(database, transformed_df, conn=session.conn, order_mode="upsert", fact_shards=fact_shards)
+                raise RuntimeError("simulated failure")
+    assert _order_shards(database, tmp_path / "shards", "PO0060504-1") == (["2021_04"], loaded_rows)
+
+    # the next load recovers the shards before loading
+    with LoadSession(database) as session, session.transaction():
+        fact_shards.recover(session.conn)
+    assert _order_shards(database, tmp_path / "shards", "PO0060504-1") == (["2021_03"], loaded_rows)
+    assert list((tmp_path / "shards").glob("pending_*")) == []
+    conn = sqlite3.connect(tmp_path / "shards" / "fact_orders_2021_03.db")
+    assert conn.execute("SELECT total_price FROM fact_orders WHERE order_number = 'PO0060504-1'").fetchone() == (14100,)
+    assert conn.execute("SELECT COUNT(*) FROM shard_undo").fetchone() == (0,)
+    conn.close()
+
+
+def test_attach_limit_falls_back_to_the_sqlite_default():
+    class OldConnection:
+        # sqlite3.Connection has no getlimit before Python 3.11
+        pass
+
+    assert attached_limit(OldConnection()) == 10
+    conn = sqlite3.connect(":memory:")
+    assert attached_limit(conn) >= 1
+    conn.close()
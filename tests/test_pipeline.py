@@ -0,0 +1,180 @@
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.lib.migrations import apply_migrations
+from src.lib import pipeline
+from src.lib.pipeline import run_pipeline, run_chunked_pipeline, run_pipelined
+
+MIGRATIONS_DIR = "./model/migrations"
+DATA_FILES = [Path("./data/unprocessed/data.csv")]
+
+
+def read_table(database, query, parameters=()):
+    conn = sqlite3.connect(database)
+    rows = conn.execute(query, parameters).fetchall()
+    conn.close()
+    return rows
+
+
+def test_run_chunked_pipeline_matches_run_pipeline(tmp_path):
+    full_db = str(tmp_path / "full.db")
+    chunked_db = str(tmp_path / "chunked.db")
+    apply_migrations(full_db, MIGRATIONS_DIR)
+    apply_migrations(chunked_db, MIGRATIONS_DIR)
+
+    full_rows = run_pipeline(full_db, DATA_FILES)
+    chunked_rows = run_chunked_pipeline(chunked_db, DATA_FILES, chunksize=4)
+
+    assert chunked_rows == full_rows
+    for query in [
+        "SELECT * FROM dim_clients ORDER BY client_name",
+        "SELECT * FROM dim_products ORDER BY product_name",
+        "SELECT * FROM dim_payment ORDER BY payment_billing_code",
+        "SELECT * FROM fact_orders ORDER BY order_number",
+    ]:
+        assert read_table(chunked_db, query) == read_table(full_db, query)
+
+
+@pytest.mark.parametrize("fact_keys", ["sql", "star"])
+def test_fact_keys_modes_match_pandas_fact_keys(tmp_path, fact_keys):
+    pandas_db = str(tmp_path / "pandas.db")
+    mode_db = str(tmp_path / "mode.db")
+    chunked_mode_db = str(tmp_path / "chunked_mode.db")
+    for database in [pandas_db, mode_db, chunked_mode_db]:
+        apply_migrations(database, MIGRATIONS_DIR)
+
+    pandas_rows = run_pipeline(pandas_db, DATA_FILES, fact_keys="pandas")
+    assert run_pipeline(mode_db, DATA_FILES, fact_keys=fact_keys) == pandas_rows
+    assert run_chunked_pipeline(chunked_mode_db, DATA_FILES, chunksize=4, fact_keys=fact_keys) == pandas_rows
+
+    for query in [
+        "SELECT * FROM dim_clients ORDER BY client_name",
+        "SELECT * FROM dim_products ORDER BY product_name",
+        "SELECT * FROM dim_payment ORDER BY payment_billing_code",
+        "SELECT * FROM fact_orders ORDER BY order_number",
+    ]:
+        assert read_table(mode_db, query) == read_table(pandas_db, query)
+        assert read_table(chunked_mode_db, query) == read_table(pandas_db, query)
+
+
+@pytest.mark.parametrize("fact_keys", ["pandas", "sql", "star"])
+def test_incremental_runs_only_load_new_or_changed_orders(tmp_path, fact_keys):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    loaded_rows = run_pipeline(database, DATA_FILES, fact_keys=fact_keys)
+    facts = read_table(database, "SELECT * FROM fact_orders ORDER BY order_number")
+
+    # rerunning the same file adds nothing
+    assert run_pipeline(database, DATA_FILES, fact_keys=fact_keys, order_mode="append") == 0
+    assert run_pipeline(database, DATA_FILES, fact_keys=fact_keys, order_mode="upsert") == 0
+    assert read_table(database, "SELECT * FROM fact_orders ORDER BY order_number") == facts
+
+    # a redelivered file with one changed order and one new order
+    changed_df = pd.read_csv(DATA_FILES[0], dtype=str)
+    changed_df.loc[0, "ProductQuantity"] = "4"
+    changed_df.loc[0, "TotalPrice"] = "18800"
+    new_order = changed_df.iloc[[1]].assign(OrderNumber="PO9999999-1")
+    changed_file = tmp_path / "changed.csv"
+    pd.concat([changed_df, new_order]).to_csv(changed_file, index=False)
+
+    assert run_pipeline(database, [changed_file], fact_keys=fact_keys, order_mode="append") == 1
+    assert run_pipeline(database, [changed_file], fact_keys=fact_keys, order_mode="upsert") == 1
+    assert len(read_table(database, "SELECT * FROM fact_orders")) == loaded_rows + 1
+    assert read_table(
+        database, "SELECT product_quantity, total_price FROM fact_orders WHERE order_number = ?", (changed_df.loc[0, "OrderNumber"],)
+    ) == [(4, 18800)]
+
+
+@pytest.mark.parametrize("fact_keys", ["pandas", "sql", "star"])
+def test_compact_representation_loads_the_same_warehouse(tmp_path, fact_keys):
+    files = DATA_FILES + [Path("./data/ignore/new_data.csv")]
+    default_db = str(tmp_path / "default.db")
+    compact_db = str(tmp_path / "compact.db")
+    chunked_compact_db = str(tmp_path / "chunked_compact.db")
+    for database in [default_db, compact_db, chunked_compact_db]:
+        apply_migrations(database, MIGRATIONS_DIR)
+
+    run_pipeline(default_db, files, fact_keys=fact_keys)
+    run_pipeline(compact_db, files, fact_keys=fact_keys, compact=True)
+    run_chunked_pipeline(chunked_compact_db, files, chunksize=4, fact_keys=fact_keys, compact=True)
+
+    for query in [
+        "SELECT * FROM dim_clients ORDER BY client_name",
+        "SELECT * FROM dim_products ORDER BY product_name",
+        "SELECT * FROM dim_payment ORDER BY payment_billing_code",
+        "SELECT * FROM fact_orders ORDER BY order_number",
+    ]:
+        assert read_table(compact_db, query) == read_table(default_db, query)
+        assert read_table(chunked_compact_db, query) == read_table(default_db, query)
+
+
+@pytest.mark.parametrize("chunksize", [None, 4])
+def test_run_pipelined_matches_run_pipeline(tmp_path, chunksize):
+    files = DATA_FILES + [Path("./data/ignore/new_data.csv")]
+    full_db = str(tmp_path / "full.db")
+    pipelined_db = str(tmp_path / "pipelined.db")
+    apply_migrations(full_db, MIGRATIONS_DIR)
+    apply_migrations(pipelined_db, MIGRATIONS_DIR)
+
+    full_rows = run_pipeline(full_db, files)
+    assert run_pipelined(pipelined_db, files, chunksize=chunksize, queue_size=1) == full_rows
+
+    for query in [
+        "SELECT * FROM dim_clients ORDER BY client_name",
+        "SELECT * FROM dim_products ORDER BY product_name",
+        "SELECT * FROM dim_payment ORDER BY payment_billing_code",
+        "SELECT * FROM fact_orders ORDER BY order_number",
+    ]:
+        assert read_table(pipelined_db, query) == read_table(full_db, query)
+
+
+def test_run_pipelined_rolls_back_when_a_stage_fails(tmp_path, monkeypatch):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    transform_data = pipeline.transform_data
+    calls = []
+
+    def failing_transform(batch, **kwargs):
+        calls.append(len(batch))
+        if len(calls) == 3:
+            raise ValueError("transform failed")
+        return transform_data(batch, **kwargs)
+
+    monkeypatch.setattr(pipeline, "transform_data", failing_transform)
+    with pytest.raises(ValueError, match="transform failed"):
+        run_pipelined(database, DATA_FILES, chunksize=4, track_files=True)
+
+    assert read_table(database, "SELECT COUNT(*) FROM fact_orders") == [(0,)]
+    assert read_table(database, "SELECT status FROM file_manifest") == [("failed",)]
+
+
+LOADERS = {
+    "whole": lambda database, files: run_pipeline(database, files),
+    "chunked": lambda database, files: run_chunked_pipeline(database, files, chunksize=1000),
+    "pipelined": lambda database, files: run_pipelined(database, files),
+    "sql_fact_keys": lambda database, files: run_chunked_pipeline(database, files, chunksize=1000, fact_keys="sql"),
+}
+
+
+@pytest.mark.parametrize("loader", list(LOADERS))
+def test_orders_repeated_across_files_are_treated_alike_by_every_pipeline(tmp_path, loader):
+    df = pd.read_csv(DATA_FILES[0], dtype=str)
+    df.head(3).to_csv(tmp_path / "a.csv", index=False)
+    # b.csv repeats the first order of a.csv as it is
+    df.iloc[[0, 3]].to_csv(tmp_path / "b.csv", index=False)
+    # c.csv repeats it with another quantity
+    conflicting = df.iloc[[0]].assign(ProductQuantity="4", TotalPrice="18800")
+    conflicting.to_csv(tmp_path / "c.csv", index=False)
+
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    assert LOADERS[loader](database, [tmp_path / "a.csv", tmp_path / "b.csv"]) == 4
+
+    database = str(tmp_path / "conflicting.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    with pytest.raises(sqlite3.IntegrityError):
+        LOADERS[loader](database, [tmp_path / "a.csv", tmp_path / "c.csv"])
+    assert read_table(database, "SELECT COUNT(*) FROM fact_orders") == [(0,)]
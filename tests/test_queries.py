@@ -0,0 +1,120 @@
+import json
+import sqlite3
+import threading
+import urllib.request
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.lib.aggregates import rebuild_aggregates
+from src.lib.db_helper import create_tables_in_db
+from src.lib.migrations import apply_migrations
+from src.lib.pipeline import run_pipeline
+from src.lib.queries import QueryService, make_server
+
+MIGRATIONS_DIR = "./model/migrations"
+DROP_TABLES = "./model/drop_tables.sql"
+DATA_FILE = Path("./data/unprocessed/data.csv")
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    run_pipeline(database, [DATA_FILE], aggregates=True)
+    return database
+
+
+def test_results_are_cached_until_the_next_load(tmp_path, database):
+    service = QueryService(database)
+    first = service.run("top_products", limit="3")
+    assert not first.cached
+    assert first.columns == ["product_name", "product_type", "currency", "order_count", "units", "revenue"]
+    assert len(first.rows) == 3
+    assert [row[5] for row in first.rows] == sorted((row[5] for row in first.rows), reverse=True)
+
+    again = service.run("top_products", limit=3)
+    assert again.cached and again.rows == first.rows
+
+    # a load commits a new generation, so the next lookup reads the warehouse again
+    more = tmp_path / "more.csv"
+    df = pd.read_csv(DATA_FILE, dtype=str)
+    df.assign(OrderNumber=df["OrderNumber"] + "-B").to_csv(more, index=False)
+    run_pipeline(database, [more], aggregates=True)
+
+    after = service.run("top_products", limit=3)
+    assert not after.cached
+    assert after.generation > first.generation
+    assert [row[3] for row in after.rows] == [2 * row[3] for row in first.rows]
+    service.close()
+
+
+def test_a_rebuilt_warehouse_is_not_served_from_the_cache(database):
+    service = QueryService(database)
+    first = service.run("top_clients")
+
+    # the default run drops and recreates the tables before loading
+    create_tables_in_db(database, DROP_TABLES)
+    apply_migrations(database, MIGRATIONS_DIR)
+    run_pipeline(database, [DATA_FILE])
+
+    after = service.run("top_clients")
+    assert not after.cached
+    assert after.generation > first.generation
+    assert after.rows == first.rows
+    service.close()
+
+
+def test_rebuilt_aggregates_are_not_served_from_the_cache(database):
+    service = QueryService(database)
+    first = service.run("daily_revenue")
+
+    # a change the incremental refresh does not track, then a rebuild
+    conn = sqlite3.connect(database)
+    with conn:
+        conn.execute("UPDATE fact_orders SET product_quantity = product_quantity + 1")
+    conn.close()
+    rebuild_aggregates(database)
+
+    after = service.run("daily_revenue")
+    assert not after.cached
+    units = after.columns.index("units")
+    assert sum(row[units] for row in after.rows) > sum(row[units] for row in first.rows)
+    service.close()
+
+
+def test_connections_are_read_only(database):
+    service = QueryService(database)
+    with service.pool.connection() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM fact_orders")
+    with pytest.raises(ValueError):
+        service.run("daily_revenue", currency="GBP")
+    service.close()
+
+
+def test_http_endpoint_serves_canned_queries(database):
+    service = QueryService(database)
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{base}/queries") as response:
+            assert "order" in json.load(response)
+
+        order_number = sqlite3.connect(database).execute(
+            "SELECT order_number FROM fact_orders LIMIT 1"
+        ).fetchone()[0]
+        with urllib.request.urlopen(f"{base}/query/order?order_number={order_number}") as response:
+            body = json.load(response)
+        assert [row[0] for row in body["rows"]] == [order_number]
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{base}/query/missing")
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
@@ -0,0 +1,65 @@
+import codecs
+
+import pandas as pd
+import pytest
+
+from src.lib.etl import concat_frames, input_schema
+from src.lib.readers import LEGACY_ENCODING, detect_encoding, read_csv, read_csv_chunks
+
+DATA_FILE = "./data/unprocessed/data.csv"
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_pyarrow_engine_matches_pandas_engine(tmp_path, compact):
+    # one row too many fields, which both engines skip, and one missing value
+    source = open(DATA_FILE).read().rstrip("\n").split("\n")
+    source[3] = source[3] + ",extra"
+    fields = source[4].split(",")
+    fields[9] = ""
+    source[4] = ",".join(fields)
+    file_path = tmp_path / "orders.csv"
+    file_path.write_text("\n".join(source) + "\n")
+
+    expected = read_csv(file_path, input_schema(compact))
+    assert len(expected) == 25
+    assert expected["DeliveryCity"].isna().sum() == 1
+
+    for encoding in (LEGACY_ENCODING, "auto"):
+        pd.testing.assert_frame_equal(
+            read_csv(file_path, input_schema(compact), engine="pyarrow", encoding=encoding),
+            expected,
+        )
+        chunks = list(
+            read_csv_chunks(file_path, input_schema(compact), 7, engine="pyarrow", encoding=encoding)
+        )
+        assert [len(chunk) for chunk in chunks] == [7, 7, 7, 4]
+        pd.testing.assert_frame_equal(concat_frames(chunks), expected, check_categorical=False)
+
+
+def test_pyarrow_engine_falls_back_on_short_rows(tmp_path):
+    file_path = tmp_path / "short.csv"
+    file_path.write_text(open(DATA_FILE).read().rstrip("\n") + "\nPO1234567-1,John Smith,Piano,Keyboard,4700,1,4700\n")
+
+    df = read_csv(file_path, input_schema(), engine="pyarrow")
+    pd.testing.assert_frame_equal(df, read_csv(file_path, input_schema()))
+    assert df["ProductName"].iloc[-1] == "Piano"
+    assert df["PaymentDate"].isna().iloc[-1]
+
+
+def test_detect_encoding(tmp_path):
+    ascii_file = tmp_path / "ascii.csv"
+    ascii_file.write_bytes(b"a,b\n1,2\n")
+    utf8_file = tmp_path / "utf8.csv"
+    utf8_file.write_bytes("a,b\n1,Zoë\n".encode("utf-8"))
+    bom_file = tmp_path / "bom.csv"
+    bom_file.write_bytes(codecs.BOM_UTF8 + b"a,b\n1,2\n")
+    escaped_file = tmp_path / "escaped.csv"
+    escaped_file.write_bytes(b"a,b\n1,Zo\\xeb\n")
+    latin1_file = tmp_path / "latin1.csv"
+    latin1_file.write_bytes("a,b\n1,Zoë\n".encode("latin-1"))
+
+    assert detect_encoding(ascii_file) == "utf-8"
+    assert detect_encoding(utf8_file) == "utf-8"
+    assert detect_encoding(bom_file) == "utf-8-sig"
+    assert detect_encoding(escaped_file) == LEGACY_ENCODING
+    assert detect_encoding(latin1_file) == LEGACY_ENCODING
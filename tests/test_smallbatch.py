@@ -0,0 +1,103 @@
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.lib.migrations import apply_migrations
+from src.lib.pipeline import run_pipeline
+from src.lib.smallbatch import is_small_batch, load_small_files
+from src.lib.status import format_status, warehouse_status
+
+MIGRATIONS_DIR = "./model/migrations"
+DATA_FILE = Path("./data/unprocessed/data.csv")
+
+TABLES = {
+    "dim_clients": "SELECT client_name, delivery_address, delivery_city, delivery_postcode, delivery_country, delivery_contact_number FROM dim_clients ORDER BY client_key",
+    "dim_payment": "SELECT payment_date, payment_type, payment_billing_code, currency FROM dim_payment ORDER BY payment_key",
+    "dim_products": "SELECT product_name, product_type FROM dim_products ORDER BY product_key",
+    "fact_orders": "SELECT order_number, client_key, product_key, payment_key, unit_price, product_quantity, total_price FROM fact_orders ORDER BY order_number",
+    "agg_daily_revenue": "SELECT * FROM agg_daily_revenue ORDER BY 1, 2, 3",
+    "agg_monthly_revenue_by_country": "SELECT * FROM agg_monthly_revenue_by_country ORDER BY 1, 2, 3",
+    "file_manifest": "SELECT content_hash, file_name, row_count, status FROM file_manifest ORDER BY 1",
+}
+
+
+def snapshot(database):
+    conn = sqlite3.connect(database)
+    try:
+        return {table: conn.execute(query).fetchall() for table, query in TABLES.items()}
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("order_mode", ["insert", "upsert"])
+def test_small_files_load_like_the_pandas_pipeline(tmp_path, order_mode):
+    changed = tmp_path / "changed.csv"
+    df = pd.read_csv(DATA_FILE, dtype=str)
+    df["TotalPrice"] = "1.5"
+    df.to_csv(changed, index=False)
+    files = [DATA_FILE] if order_mode == "insert" else [DATA_FILE, changed]
+    assert is_small_batch(files)
+
+    snapshots = []
+    for name, load in [("pandas", run_pipeline), ("small", load_small_files)]:
+        database = str(tmp_path / f"{name}.db")
+        apply_migrations(database, MIGRATIONS_DIR)
+        for f in files:
+            load(database, [f], order_mode=order_mode, track_files=True, aggregates=True)
+        snapshots.append(snapshot(database))
+
+    assert snapshots[0] == snapshots[1]
+    assert snapshots[1]["fact_orders"]
+
+
+def test_rows_with_malformed_payment_dates_are_dropped_on_both_paths(tmp_path):
+    malformed = tmp_path / "malformed.csv"
+    df = pd.read_csv(DATA_FILE, dtype=str)
+    df.loc[0, "PaymentDate"] = "31/02/2021"
+    df.loc[1, "PaymentDate"] = None
+    df.to_csv(malformed, index=False)
+
+    snapshots = []
+    for name, load in [("pandas", run_pipeline), ("small", load_small_files)]:
+        database = str(tmp_path / f"{name}.db")
+        apply_migrations(database, MIGRATIONS_DIR)
+        load(database, [malformed], track_files=True)
+        snapshots.append(snapshot(database))
+
+    assert snapshots[0] == snapshots[1]
+    orders = [row[0] for row in snapshots[1]["fact_orders"]]
+    assert df.loc[0, "OrderNumber"] not in orders
+    assert df.loc[1, "OrderNumber"] in orders
+    assert len(orders) == len(df) - 1
+
+
+def test_small_path_rejects_files_it_cannot_load_before_writing(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    missing_quantity = tmp_path / "missing_quantity.csv"
+    df = pd.read_csv(DATA_FILE, dtype=str)
+    df.loc[3, "ProductQuantity"] = None
+    df.to_csv(missing_quantity, index=False)
+
+    with pytest.raises(ValueError):
+        load_small_files(database, [DATA_FILE, missing_quantity], track_files=True)
+
+    status = warehouse_status(database, inbox=str(tmp_path))
+    assert (status.fact_rows, status.files_loaded, status.files_failed) == (0, 0, 0)
+    assert status.pending_files == 1
+    assert status.load_generation == 0
+
+
+def test_status_reports_loads_without_writing(tmp_path):
+    database = str(tmp_path / "test.db")
+    assert "not created yet" in format_status(warehouse_status(database))
+    assert not Path(database).exists()
+
+    apply_migrations(database, MIGRATIONS_DIR)
+    rows = load_small_files(database, [DATA_FILE], track_files=True)
+    status = warehouse_status(database)
+    assert status.fact_rows == rows > 0
+    assert (status.files_loaded, status.load_generation, status.incomplete_run) == (1, 1, None)
+    assert f"fact rows:       {rows}" in format_status(status)
@@ -0,0 +1,115 @@
+import pickle
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.lib.etl import extract_file
+from src.lib.manifest import hash_file
+from src.lib.migrations import apply_migrations
+from src.lib.pipeline import run_chunked_pipeline, run_pipeline
+from src.lib.validation import default_rules, validate
+
+MIGRATIONS_DIR = "./model/migrations"
+DATA_FILE = "./data/unprocessed/data.csv"
+
+
+def corrupt(df):
+    df = df.copy()
+    df.loc[1, "TotalPrice"] = df.loc[1, "TotalPrice"] + 10
+    df.loc[2, "ClientName"] = np.nan
+    df.loc[2, "ProductQuantity"] = 0
+    df.loc[3, "PaymentDate"] = "31/02/2023"
+    return df
+
+
+def test_validate_splits_rows_with_reason_codes():
+    df = corrupt(extract_file(DATA_FILE))
+    result = validate(df, default_rules())
+
+    assert len(result.valid) == len(df) - 3
+    assert result.valid["OrderNumber"].tolist() == df.drop(index=[1, 2, 3])["OrderNumber"].tolist()
+    assert result.rejects["RejectReasons"].tolist() == [
+        "TOTAL_PRICE_MISMATCH",
+        "MISSING_CLIENT_NAME;TOTAL_PRICE_MISMATCH;NON_POSITIVE_PRODUCT_QUANTITY",
+        "INVALID_PAYMENT_DATE",
+    ]
+    assert result.counts == {
+        "TOTAL_PRICE_MISMATCH": 2,
+        "MISSING_CLIENT_NAME": 1,
+        "NON_POSITIVE_PRODUCT_QUANTITY": 1,
+        "INVALID_PAYMENT_DATE": 1,
+    }
+
+
+def test_valid_batch_passes_unchanged():
+    df = extract_file(DATA_FILE)
+    result = validate(df, default_rules())
+    pd.testing.assert_frame_equal(result.valid, df)
+    assert len(result.rejects) == 0
+    assert result.counts == {}
+
+
+def test_rules_can_be_sent_to_worker_processes():
+    df = corrupt(extract_file(DATA_FILE))
+    rules = pickle.loads(pickle.dumps(default_rules()))
+    assert len(validate(df, rules).rejects) == 3
+
+
+@pytest.mark.parametrize("chunksize", [None, 10])
+def test_pipeline_quarantines_rejected_rows(tmp_path, chunksize):
+    data_file = tmp_path / "orders.csv"
+    corrupt(extract_file(DATA_FILE)).to_csv(data_file, index=False)
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    reject_dir = tmp_path / "rejected"
+
+    if chunksize:
+        loaded_rows = run_chunked_pipeline(
+            database, [data_file], chunksize, validation_rules=default_rules(), reject_dir=str(reject_dir)
+        )
+    else:
+        loaded_rows = run_pipeline(
+            database, [data_file], validation_rules=default_rules(), reject_dir=str(reject_dir)
+        )
+
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT COUNT(*) FROM fact_orders").fetchone()[0] == loaded_rows == 23
+    conn.close()
+
+    # one reject file per input file, published once the load committed
+    assert [p.name for p in reject_dir.iterdir()] == [f"orders.{hash_file(data_file)[:12]}.rejects.csv"]
+    rejects = pd.read_csv(next(reject_dir.iterdir()))
+    assert len(rejects) == 3
+    assert "file" not in rejects.columns
+    assert rejects["RejectReasons"].iloc[2] == "INVALID_PAYMENT_DATE"
+
+
+@pytest.mark.parametrize("chunksize", [None, 10])
+def test_skipped_lines_are_rejected_once_the_load_commits(tmp_path, chunksize):
+    data_file = tmp_path / "orders.csv"
+    lines = open(DATA_FILE).read().splitlines(keepends=True)
+    lines[3] = lines[3].rstrip("\n") + ",surplus\n"
+    data_file.write_text("".join(lines))
+    reject_dir = tmp_path / "rejected"
+    database = str(tmp_path / "test.db")
+
+    def load():
+        if chunksize:
+            return run_chunked_pipeline(database, [data_file], chunksize, reject_dir=str(reject_dir))
+        return run_pipeline(database, [data_file], order_mode="append", reject_dir=str(reject_dir))
+
+    # the load fails on the unmigrated database, so nothing is rejected yet
+    with pytest.raises(sqlite3.Error):
+        load()
+    assert list(reject_dir.iterdir()) == []
+
+    apply_migrations(database, MIGRATIONS_DIR)
+    assert load() == 25
+    assert load() == 0
+    (reject_file,) = reject_dir.iterdir()
+    rejects = pd.read_csv(reject_file, dtype=str)
+    assert rejects["RejectReasons"].tolist() == ["EXTRA_FIELDS"]
+    assert rejects["OrderNumber"].iloc[0] == lines[3].split(",")[0]
+    assert rejects["PaymentDate"].iloc[0].endswith(",surplus")
@@ -0,0 +1,79 @@
+import shutil
+import sqlite3
+from pathlib import Path
+
+from src.lib.migrations import apply_migrations
+from src.lib.pipeline import run_pipeline
+from src.lib.watch import BatchPolicy, FolderWatcher, watch_folder
+
+MIGRATIONS_DIR = "./model/migrations"
+DATA_FILE = Path("./data/unprocessed/data.csv")
+
+
+def test_files_are_batched_once_they_stop_changing(tmp_path):
+    watcher = FolderWatcher(tmp_path, BatchPolicy(max_files=2, max_latency=5.0, settle_seconds=1.0))
+    (tmp_path / "a.csv").write_text("a")
+    (tmp_path / "ignored.txt").write_text("x")
+
+    watcher.poll(now=0.0)
+    assert watcher.next_batch(now=0.0) == []
+
+    # still being written, so it has to settle again
+    (tmp_path / "a.csv").write_text("a, longer")
+    watcher.poll(now=1.0)
+    watcher.poll(now=2.0)
+    assert list(watcher.ready) == [tmp_path / "a.csv"]
+
+    # one ready file waits for the latency to pass
+    assert watcher.next_batch(now=3.0) == []
+    assert watcher.next_batch(now=7.0) == [tmp_path / "a.csv"]
+    assert not watcher.ready
+    (tmp_path / "a.csv").unlink()
+
+    # a full batch is loaded without waiting, the rest goes in the next one
+    for name in ["b.csv", "c.csv", "d.csv"]:
+        (tmp_path / name).write_text(name)
+    watcher.poll(now=10.0)
+    watcher.poll(now=11.0)
+    assert watcher.next_batch(now=11.0) == [tmp_path / "b.csv", tmp_path / "c.csv"]
+    assert watcher.next_batch(now=11.0) == []
+    assert watcher.next_batch(now=16.0) == [tmp_path / "d.csv"]
+
+
+def test_ignored_files_are_offered_again_once_modified(tmp_path):
+    watcher = FolderWatcher(tmp_path, BatchPolicy(max_latency=0.0, settle_seconds=0.0))
+    bad = tmp_path / "bad.csv"
+    bad.write_text("broken")
+    watcher.poll(now=0.0)
+    watcher.poll(now=0.0)
+    watcher.ignore(watcher.next_batch(now=0.0))
+
+    watcher.poll(now=1.0)
+    watcher.poll(now=1.0)
+    assert watcher.next_batch(now=1.0) == []
+
+    bad.write_text("fixed, and longer")
+    watcher.poll(now=2.0)
+    watcher.poll(now=2.0)
+    assert watcher.next_batch(now=2.0) == [bad]
+
+
+def test_watch_folder_loads_arriving_files(tmp_path):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    folder, processed = tmp_path / "unprocessed", tmp_path / "processed"
+    folder.mkdir()
+    processed.mkdir()
+    shutil.copy(DATA_FILE, folder / "data.csv")
+
+    def load_files(files, session):
+        return run_pipeline(database, files, order_mode="append", track_files=True, session=session)
+
+    policy = BatchPolicy(max_latency=0.0, settle_seconds=0.0, poll_interval=0.01)
+    loaded_rows = watch_folder(database, folder, processed, load_files, policy=policy, max_batches=1)
+
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT COUNT(*) FROM fact_orders").fetchone()[0] == loaded_rows > 0
+    conn.close()
+    assert not (folder / "data.csv").exists()
+    assert (processed / "data.csv").exists()
@@ -0,0 +1,146 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.lib.migrations import apply_migrations
+from src.lib.pipeline import run_pipeline
+from src.lib.workqueue import WorkQueue, retry_locked, run_worker
+
+MIGRATIONS_DIR = "./model/migrations"
+DATA_FILE = Path("./data/unprocessed/data.csv")
+
+
+@pytest.fixture
+def inbox(tmp_path):
+    inbox = tmp_path / "unprocessed"
+    inbox.mkdir()
+    (tmp_path / "processed").mkdir()
+    df = pd.read_csv(DATA_FILE, dtype=str)
+    for part in range(4):
+        # each file has its own orders
+        df.assign(OrderNumber=df["OrderNumber"] + f"-{part}").to_csv(
+            inbox / f"orders_{part}.csv", index=False
+        )
+    return inbox
+
+
+def leases(tmp_path):
+    conn = sqlite3.connect(tmp_path / "inprogress" / "leases.db")
+    try:
+        return conn.execute("SELECT worker_id, file_name FROM file_leases ORDER BY 1, 2").fetchall()
+    finally:
+        conn.close()
+
+
+def test_each_file_is_claimed_by_one_worker(tmp_path, inbox):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    first = WorkQueue(inbox, worker_id="first")
+    second = WorkQueue(inbox, worker_id="second")
+
+    claimed = first.claim(3) + second.claim(3)
+    assert sorted(path.name for path in claimed) == [f"orders_{part}.csv" for part in range(4)]
+    assert [path.parent.name for path in claimed] == ["first"] * 3 + ["second"]
+    assert not list(inbox.glob("*.csv"))
+    assert len(leases(tmp_path)) == 4
+
+
+def test_expired_leases_are_reclaimed(tmp_path, inbox):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    crashed = WorkQueue(inbox, worker_id="crashed", lease_seconds=10)
+    survivor = WorkQueue(inbox, worker_id="survivor", lease_seconds=10)
+    crashed.claim(2)
+
+    # a file renamed by a worker that died before recording its lease
+    (tmp_path / "inprogress" / "vanished").mkdir()
+    (inbox / "orders_3.csv").rename(tmp_path / "inprogress" / "vanished" / "orders_3.csv")
+
+    now = time.time()
+    assert survivor.reclaim_expired(now=now) == []
+    # a heartbeat keeps the leases alive
+    crashed.renew()
+    assert survivor.reclaim_expired(now=now + 5) == []
+
+    reclaimed = survivor.reclaim_expired(now=time.time() + 11)
+    assert sorted(path.name for path in reclaimed) == ["orders_0.csv", "orders_1.csv", "orders_3.csv"]
+    assert all(path.parent == inbox for path in reclaimed)
+    assert leases(tmp_path) == []
+
+
+def test_workers_load_every_file_once(tmp_path, inbox):
+    expected = str(tmp_path / "expected.db")
+    apply_migrations(expected, MIGRATIONS_DIR)
+    expected_rows = run_pipeline(expected, sorted(inbox.glob("*.csv")))
+
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+
+    def load_files(files, session):
+        return run_pipeline(database, files, order_mode="insert", track_files=True, session=session)
+
+    loaded = {}
+
+    def worker(worker_id):
+        loaded[worker_id] = run_worker(
+            database, inbox, tmp_path / "processed", load_files,
+            worker_id=worker_id, batch_files=1, exit_when_idle=True,
+        )
+
+    threads = [threading.Thread(target=worker, args=(f"worker-{n}",)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(loaded.values()) == expected_rows
+    assert len(list((tmp_path / "processed").glob("*.csv"))) == 4
+    assert leases(tmp_path) == []
+
+
+def test_leases_are_renewed_while_a_load_holds_the_write_lock(tmp_path, inbox):
+    database = str(tmp_path / "test.db")
+    apply_migrations(database, MIGRATIONS_DIR)
+    other = WorkQueue(inbox, worker_id="other", lease_seconds=0.6)
+    reclaimed = []
+
+    def slow_load_files(files, session):
+        # hold the warehouse's write lock for several lease periods
+        with session.transaction():
+            deadline = time.time() + 2
+            while time.time() < deadline:
+                reclaimed.extend(other.reclaim_expired())
+                time.sleep(0.1)
+        return run_pipeline(database, files, order_mode="insert", track_files=True, session=session)
+
+    run_worker(
+        database, inbox, tmp_path / "processed", slow_load_files,
+        worker_id="slow", lease_seconds=0.6, batch_files=4, exit_when_idle=True,
+    )
+
+    assert reclaimed == []
+    assert len(list((tmp_path / "processed").glob("*.csv"))) == 4
+    assert leases(tmp_path) == []
+
+
+def test_retry_locked_retries_only_lock_errors():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise sqlite3.OperationalError("database is locked")
+        return "loaded"
+
+    assert retry_locked(flaky, backoff=0) == "loaded"
+    assert len(calls) == 3
+
+    def broken():
+        raise sqlite3.OperationalError("no such table: fact_orders")
+
+    with pytest.raises(sqlite3.OperationalError):
+        retry_locked(broken, backoff=0)